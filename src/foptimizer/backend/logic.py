@@ -1,10 +1,72 @@
-from concurrent.futures import ProcessPoolExecutor, as_completed
+import functools
+import inspect
+import math
+import os
+import tempfile
+from bisect import bisect_right
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from pathlib import Path
 
-from .tools.audio_conversion import wav_to_ogg, wav_stereo_to_mono
-from .tools.deduplication import remove_duplicate_vtfs, remove_vpk_files
-from .tools.image_conversion import fit_alpha, halve_normal, optimize_png, shrink_solid
-from .tools.remove_redundancies import remove_unaccessed_vtfs, remove_unused_files
+from .tools.archives import (
+    create_archive_sink,
+    is_archive,
+    is_archive_output,
+    list_archive_entries,
+    read_archive_entry,
+)
+from .tools.audio_conversion import wav_downsample, wav_stereo_to_mono, wav_to_ogg
+from .tools.bsp_pakfile import optimize_bsp_pakfiles
+from .tools.deduplication import (
+    remove_duplicate_sounds,
+    remove_duplicate_vtfs,
+    remove_vpk_files,
+)
+from .tools.fastdl import build_fastdl
+from .tools.image_conversion import (
+    LOSSY_MIN_PSNR,
+    estimate_entry_memory,
+    estimate_file_memory,
+    estimate_vtf_entry_memory,
+    estimate_vtf_memory,
+    fit_alpha,
+    fit_material_alpha,
+    halve_normal,
+    find_png_tool,
+    optimize_png,
+    optimize_pngs,
+    shrink_solid,
+)
+from .tools.minification import KEYVALUES_TEXT_DIRS, minify_script
+from .tools.misc import get_memory_budget
+from .tools.remove_redundancies import (
+    remove_unaccessed_materials,
+    remove_unaccessed_sounds,
+    remove_unaccessed_vtfs,
+    remove_unused_files,
+)
+
+
+MEMORY_ESTIMATORS = {
+    "vtf": estimate_vtf_memory,
+}
+ENTRY_MEMORY_ESTIMATORS = {
+    "vtf": estimate_vtf_entry_memory,
+}
+
+# tools which accept an in-memory archive entry as their input_file, the others run
+# external encoders on a temporary copy
+BUFFERED_TOOLS = (fit_alpha, halve_normal, shrink_solid)
+
+# tools with a variant taking many files at once, so one external process handles a
+# whole batch of small files, and whether that process is available for the arguments
+BATCH_TOOLS = {
+    optimize_png: (
+        optimize_pngs,
+        lambda lossless=True, **kwargs: find_png_tool(lossless) is not None,
+    ),
+}
+# files passed to one external process, short of Windows' command line limit
+BATCH_SIZE = 64
 
 
 def _universal_worker(tool_func, src: Path, dst: Path, ext: tuple[str], **kwargs):
@@ -14,51 +76,246 @@ def _universal_worker(tool_func, src: Path, dst: Path, ext: tuple[str], **kwargs
     return tool_func(input_file=src, output_file=dst, **kwargs)
 
 
+def _archive_worker(
+    tool_func, archive_path: Path, entry_path: str, dst: Path, ext: tuple[str], **kwargs
+):
+    src = read_archive_entry(archive_path, entry_path)
+    if tool_func in BUFFERED_TOOLS:
+        result = _universal_worker(tool_func, src, dst, ext, **kwargs)
+    else:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_src = Path(temp_dir) / src.name
+            temp_src.write_bytes(src)
+            result = _universal_worker(tool_func, temp_src, dst, ext, **kwargs)
+
+    # the tool wrote the entry back unchanged, so it stays in the archive only
+    output = dst.with_suffix(f".{ext[1]}")
+    if output.is_file() and output.stat().st_size == len(src):
+        if output.read_bytes() == src:
+            output.unlink()
+    return result
+
+
+def _batch_worker(
+    tool_func, srcs: list[Path], dsts: list[Path], ext: tuple[str], **kwargs
+):
+    outputs = []
+    for dst in dsts:
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        outputs.append(dst.with_suffix(f".{ext[1]}"))
+    return BATCH_TOOLS[tool_func][0](input_files=srcs, output_files=outputs, **kwargs)
+
+
+def _group_batch_tasks(tasks: list[tuple], max_workers: int) -> list[tuple]:
+    # files of one folder are batched together, as their outputs share a folder too
+    folders = {}
+    for task in tasks:
+        folders.setdefault(Path(task[1]).parent, []).append(task)
+
+    # each batch runs on one core, so there are at least as many batches as workers
+    size = min(BATCH_SIZE, max(1, math.ceil(len(tasks) / max_workers)))
+    batches = []
+    for folder_tasks in folders.values():
+        for i in range(0, len(folder_tasks), size):
+            batch = folder_tasks[i : i + size]
+            batches.append(
+                (
+                    # the tool handles one file of the batch at a time
+                    max(task[0] for task in batch),
+                    tuple(task[1] for task in batch),
+                    _batch_worker,
+                    ([task[3][0] for task in batch],),
+                )
+            )
+    return batches
+
+
+def _in_dirs(rel_path, include_dirs: tuple[str]) -> bool:
+    if include_dirs is None:
+        return True
+    return any(part.lower() in include_dirs for part in Path(rel_path).parts[:-1])
+
+
+def _get_batch_tasks(
+    input_dir: Path, ext: tuple[str], include_dirs: tuple[str] = None
+) -> list[tuple]:
+    if is_archive(input_dir):
+        estimator = ENTRY_MEMORY_ESTIMATORS.get(ext[0], estimate_entry_memory)
+        return [
+            (estimator(length), entry_path, _archive_worker, (input_dir, entry_path))
+            for entry_path, length in list_archive_entries(input_dir, f".{ext[0]}")
+            if _in_dirs(entry_path, include_dirs)
+        ]
+
+    estimator = MEMORY_ESTIMATORS.get(ext[0], estimate_file_memory)
+    return [
+        (estimator(src), src.relative_to(input_dir), _universal_worker, (src,))
+        for src in input_dir.rglob(f"*.{ext[0]}")
+        if _in_dirs(src.relative_to(input_dir), include_dirs)
+    ]
+
+
+def archive_output(logic_func):
+    """
+    Lets a logic_* function write into a .vpk or .gma given as its output folder. The
+    function writes to a staging folder beside the archive instead. Batch workers' files
+    are packed as each one finishes, and anything else staged is packed at the end.
+    When the input is an archive too, its entries that were not replaced are carried
+    over, and when the function worked on the input folder in place, that is packed.
+    A function taking an archive_sink argument is given the archive to pass on to
+    handle_batch_parallel.
+    """
+
+    takes_sink = "archive_sink" in inspect.signature(logic_func).parameters
+
+    @functools.wraps(logic_func)
+    def wrapper(input_dir: Path, output_dir: Path, *args, **kwargs):
+        if not is_archive_output(output_dir):
+            return logic_func(input_dir, output_dir, *args, **kwargs)
+
+        with create_archive_sink(output_dir) as sink, tempfile.TemporaryDirectory(
+            dir=output_dir.parent
+        ) as temp_dir:
+            # left uncreated, as some functions copy a whole tree to their output
+            staging_dir = Path(temp_dir) / output_dir.stem
+
+            if takes_sink:
+                kwargs["archive_sink"] = sink
+            result = logic_func(input_dir, staging_dir, *args, **kwargs)
+
+            if is_archive(input_dir):
+                sink.add_tree(staging_dir)
+                sink.add_archive(input_dir, skip=sink.replaced)
+            elif staging_dir.is_dir():
+                sink.add_tree(staging_dir)
+            elif input_dir.is_dir():
+                # nothing was written out, so the function changed the input in place
+                sink.add_tree(input_dir)
+
+        return result
+
+    return wrapper
+
+
+def _pack_output(
+    archive_sink, output_dir: Path, src, ext: tuple[str], remove: bool
+) -> None:
+    output = (output_dir / src).with_suffix(f".{ext[1]}")
+    if not output.is_file():
+        return
+
+    entry_path = output.relative_to(output_dir).as_posix()
+    archive_sink.add(entry_path, output.read_bytes())
+    output.unlink()
+
+    # a converted file replaces its source unless the source is kept
+    if ext[0] != ext[1] and remove:
+        archive_sink.replaced.add(Path(src).as_posix())
+
+
 def handle_batch_parallel(
     input_dir: Path,
     output_dir: Path,
     ext: tuple[str],
     opt_func,
     progress_window=None,
+    memory_budget: int = None,
+    include_dirs: tuple[str] = None,
+    archive_sink=None,
     **kwargs,
 ):
-    files = list(input_dir.rglob(f"*.{ext[0]}"))
-    total = len(files)
+    # a GMA or VPK input is read entry by entry, and only changed entries are written,
+    # to a folder beside the archive unless another output folder is given
+    if is_archive(input_dir) and output_dir == input_dir and not archive_sink:
+        output_dir = input_dir.with_name(input_dir.stem.removesuffix("_dir"))
+
+    # only files under a folder of one of these lowercase names, if given
+    tasks = _get_batch_tasks(input_dir, ext, include_dirs)
+    total = len(tasks)
+    max_workers = os.cpu_count() or 1
+    # archive entries are spilled to a temporary file each, so they are not batched
+    if (
+        opt_func in BATCH_TOOLS
+        and BATCH_TOOLS[opt_func][1](**kwargs)
+        and not is_archive(input_dir)
+    ):
+        tasks = _group_batch_tasks(tasks, max_workers)
 
     if total == 0:
         if progress_window:
             progress_window.update(0, 0)
         return
 
-    with ProcessPoolExecutor() as executor:
-        futures = {}
-        for src in files:
-            future = executor.submit(
-                _universal_worker,
-                opt_func,
-                src,
-                output_dir / src.relative_to(input_dir),
-                ext=ext,
-                **kwargs,
-            )
-            futures[future] = src
+    if memory_budget is None:
+        memory_budget = get_memory_budget()
+
+    # pending tasks sorted by estimated peak memory, so the largest task that
+    # still fits the remaining budget can be found with a bisect
+    tasks.sort(key=lambda task: task[0])
+    estimates = [task[0] for task in tasks]
+    sources = [task[1:] for task in tasks]
+
+    reserved = 0
+    processed = 0
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        running = {}
+
+        while sources or running:
+            while sources and len(running) < max_workers:
+                index = bisect_right(estimates, memory_budget - reserved) - 1
+                if index < 0:
+                    if running:
+                        break
+                    # a task larger than the whole budget runs on its own
+                    index = len(estimates) - 1
+
+                estimate = estimates.pop(index)
+                src, worker, worker_args = sources.pop(index)
+                if isinstance(src, tuple):
+                    dst = [output_dir / batch_src for batch_src in src]
+                else:
+                    dst = output_dir / src
+                future = executor.submit(
+                    worker, opt_func, *worker_args, dst, ext=ext, **kwargs
+                )
+                running[future] = (src, estimate)
+                reserved += estimate
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                src, estimate = running.pop(future)
+                reserved -= estimate
+
+                batch = src if isinstance(src, tuple) else (src,)
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Error processing {Path(batch[0]).name}: {e}")
 
-        for i, future in enumerate(as_completed(futures), 1):
-            try:
-                future.result()
-            except Exception as e:
-                print(f"Error processing {futures[future].name}: {e}")
+                if archive_sink:
+                    for batch_src in batch:
+                        _pack_output(
+                            archive_sink,
+                            output_dir,
+                            batch_src,
+                            ext,
+                            kwargs.get("remove", True),
+                        )
 
-            if progress_window and (i % 10 == 0 or i == total):
-                progress_window.update(i, total)
+                processed += len(batch)
+                if progress_window and (processed % 10 == 0 or processed == total):
+                    progress_window.update(processed, total)
 
 
+@archive_output
 def logic_optimize_png(
     input_dir: Path,
     output_dir: Path,
     level: int = 6,
     lossless: bool = True,
     progress_window=None,
+    archive_sink=None,
 ):
     handle_batch_parallel(
         input_dir=input_dir,
@@ -66,50 +323,79 @@ def logic_optimize_png(
         ext=("png", "png"),
         opt_func=optimize_png,
         progress_window=progress_window,
+        archive_sink=archive_sink,
         level=level,
         lossless=lossless,
     )
 
 
+@archive_output
 def logic_fit_alpha(
-    input_dir: Path, output_dir: Path, lossless: bool, progress_window=None
+    input_dir: Path,
+    output_dir: Path,
+    lossless: bool,
+    level: int = 98,
+    min_psnr: float = LOSSY_MIN_PSNR,
+    progress_window=None,
+    archive_sink=None,
 ):
+    # the GUI level sets the minimum SSIM %, while the PSNR floor keeps its default
     handle_batch_parallel(
         input_dir=input_dir,
         output_dir=output_dir,
         ext=("vtf", "vtf"),
         opt_func=fit_alpha,
         progress_window=progress_window,
+        archive_sink=archive_sink,
         lossless=lossless,
+        min_ssim=level / 100,
+        min_psnr=min_psnr,
+    )
+
+
+@archive_output
+def logic_fit_material_alpha(input_dir: Path, output_dir: Path, progress_window=None):
+    fit_material_alpha(
+        input_dir=input_dir, output_dir=output_dir, progress_window=progress_window
     )
 
 
-def logic_halve_normals(input_dir: Path, output_dir: Path, progress_window=None):
+@archive_output
+def logic_halve_normals(
+    input_dir: Path, output_dir: Path, progress_window=None, archive_sink=None
+):
     handle_batch_parallel(
         input_dir=input_dir,
         output_dir=output_dir,
         ext=("vtf", "vtf"),
         opt_func=halve_normal,
         progress_window=progress_window,
+        archive_sink=archive_sink,
     )
 
 
-def logic_shrink_solid(input_dir: Path, output_dir: Path, progress_window=None):
+@archive_output
+def logic_shrink_solid(
+    input_dir: Path, output_dir: Path, progress_window=None, archive_sink=None
+):
     handle_batch_parallel(
         input_dir=input_dir,
         output_dir=output_dir,
         ext=("vtf", "vtf"),
         opt_func=shrink_solid,
         progress_window=progress_window,
+        archive_sink=archive_sink,
     )
 
 
+@archive_output
 def logic_wav_to_ogg(
     input_dir: Path,
     output_dir: Path,
     level: int = 5,
     remove: bool = True,
     progress_window=None,
+    archive_sink=None,
 ):
     handle_batch_parallel(
         input_dir=input_dir,
@@ -117,11 +403,13 @@ def logic_wav_to_ogg(
         ext=("wav", "ogg"),
         opt_func=wav_to_ogg,
         progress_window=progress_window,
+        archive_sink=archive_sink,
         quality=level,
         remove=remove,
     )
 
 
+@archive_output
 def logic_remove_unaccessed_vtfs(
     input_dir: Path, output_dir: Path, remove: bool = True, progress_window=None
 ):
@@ -133,6 +421,31 @@ def logic_remove_unaccessed_vtfs(
     )
 
 
+@archive_output
+def logic_remove_unaccessed_materials(
+    input_dir: Path, output_dir: Path, remove: bool = True, progress_window=None
+):
+    remove_unaccessed_materials(
+        input_dir=input_dir,
+        output_dir=output_dir,
+        remove=remove,
+        progress_window=progress_window,
+    )
+
+
+@archive_output
+def logic_remove_unaccessed_sounds(
+    input_dir: Path, output_dir: Path, remove: bool = True, progress_window=None
+):
+    remove_unaccessed_sounds(
+        input_dir=input_dir,
+        output_dir=output_dir,
+        remove=remove,
+        progress_window=progress_window,
+    )
+
+
+@archive_output
 def logic_remove_unused_files(
     input_dir: Path, output_dir: Path, remove: bool, progress_window=None
 ):
@@ -144,6 +457,7 @@ def logic_remove_unused_files(
     )
 
 
+# not archive_output, as the input is changed in place
 def logic_remove_duplicate_vtfs(
     input_dir: Path, output_dir: Path, progress_window=None
 ):
@@ -152,6 +466,29 @@ def logic_remove_duplicate_vtfs(
     )
 
 
+# not archive_output, as the input is changed in place
+def logic_remove_pixel_duplicate_vtfs(
+    input_dir: Path, output_dir: Path, level: int = 0, progress_window=None
+):
+    remove_duplicate_vtfs(
+        input_dir=input_dir,
+        output_dir=output_dir,
+        pixel=True,
+        max_distance=int(level) if level else None,
+        progress_window=progress_window,
+    )
+
+
+# not archive_output, as the input is changed in place
+def logic_remove_duplicate_sounds(
+    input_dir: Path, output_dir: Path, progress_window=None
+):
+    remove_duplicate_sounds(
+        input_dir=input_dir, output_dir=output_dir, progress_window=progress_window
+    )
+
+
+# not archive_output, as the input is changed in place
 def logic_remove_vpk_files(
     input_dir: Path, output_dir: Path, progress_window=None
 ):
@@ -160,11 +497,14 @@ def logic_remove_vpk_files(
     )
 
 
+@archive_output
 def logic_wav_stereo_to_mono(
     input_dir: Path,
     output_dir: Path,
+    lossless: bool = False,
     remove: bool = True,
     progress_window=None,
+    archive_sink=None,
 ):
     handle_batch_parallel(
         input_dir=input_dir,
@@ -172,5 +512,65 @@ def logic_wav_stereo_to_mono(
         ext=("wav", "wav"),
         opt_func=wav_stereo_to_mono,
         progress_window=progress_window,
+        archive_sink=archive_sink,
         remove=remove,
-    )
\ No newline at end of file
+        max_difference=0.0 if lossless else None,
+    )
+
+
+@archive_output
+def logic_wav_downsample(
+    input_dir: Path,
+    output_dir: Path,
+    level: int = 40,
+    progress_window=None,
+    archive_sink=None,
+):
+    handle_batch_parallel(
+        input_dir=input_dir,
+        output_dir=output_dir,
+        ext=("wav", "wav"),
+        opt_func=wav_downsample,
+        progress_window=progress_window,
+        archive_sink=archive_sink,
+        max_energy_loss=10 ** (-level / 10),
+    )
+
+
+# not archive_output, as a FastDL mirror is served from a folder, not mounted
+def logic_build_fastdl(input_dir: Path, output_dir: Path, progress_window=None):
+    build_fastdl(
+        input_dir=input_dir, output_dir=output_dir, progress_window=progress_window
+    )
+
+
+@archive_output
+def logic_minify_scripts(
+    input_dir: Path,
+    output_dir: Path,
+    lossless: bool = True,
+    progress_window=None,
+    archive_sink=None,
+):
+    # Lua, then the KeyValues text of scripts and materials
+    for suffix in ("lua", "txt", "vmt"):
+        handle_batch_parallel(
+            input_dir=input_dir,
+            output_dir=output_dir,
+            ext=(suffix, suffix),
+            opt_func=minify_script,
+            progress_window=progress_window,
+            archive_sink=archive_sink,
+            # other text files, e.g. readmes and credits, are not KeyValues
+            include_dirs=KEYVALUES_TEXT_DIRS if suffix == "txt" else None,
+            keep_lines=lossless,
+        )
+
+
+@archive_output
+def logic_optimize_bsp_pakfiles(
+    input_dir: Path, output_dir: Path, progress_window=None
+):
+    optimize_bsp_pakfiles(
+        input_dir=input_dir, output_dir=output_dir, progress_window=progress_window
+    )
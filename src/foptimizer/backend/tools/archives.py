@@ -0,0 +1,366 @@
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import time
+import zlib
+from abc import ABC, abstractmethod
+from pathlib import Path, PurePosixPath
+
+from sourcepp import vpkpp
+
+
+ARCHIVE_SUFFIXES = (".gma", ".vpk")
+
+VPK_SIGNATURE = 0x55AA1234
+# signature, version, tree size, then the data, MD5 and signature section sizes
+VPK_HEADER = struct.Struct("<7I")
+# crc, preload bytes, archive index, offset, length, terminator
+VPK_ENTRY = struct.Struct("<I2H2IH")
+VPK_CHUNK_SIZE = 200 * 1024 * 1024
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# archives opened by this process, so a worker reads many entries from one open
+open_archives = {}
+
+
+class ArchiveBuffer(bytes):
+    """
+    The contents of an archive entry, passed to tools in place of an input path. It
+    loads directly into vtfpp and answers the few Path queries tools make of their
+    input, e.g. name, stem and stat().st_size.
+    """
+
+    def __new__(cls, data: bytes, archive_path: Path, entry_path: str):
+        buffer = super().__new__(cls, data)
+        buffer.archive_path = archive_path
+        buffer.entry_path = entry_path
+        return buffer
+
+    def __reduce__(self):
+        return ArchiveBuffer, (bytes(self), self.archive_path, self.entry_path)
+
+    def __str__(self) -> str:
+        return f"{self.archive_path}/{self.entry_path}"
+
+    @property
+    def name(self) -> str:
+        return PurePosixPath(self.entry_path).name
+
+    @property
+    def stem(self) -> str:
+        return PurePosixPath(self.entry_path).stem
+
+    @property
+    def suffix(self) -> str:
+        return PurePosixPath(self.entry_path).suffix
+
+    def read_bytes(self) -> bytes:
+        return bytes(self)
+
+    def stat(self) -> os.stat_result:
+        return os.stat_result((0, 0, 0, 0, 0, 0, len(self), 0, 0, 0))
+
+
+def is_archive(path: Path) -> bool:
+    return path.suffix.lower() in ARCHIVE_SUFFIXES and path.is_file()
+
+
+def open_archive(archive_path: Path) -> vpkpp.PackFile:
+    """
+    Opens a GMA or VPK, reusing it if this process already opened it.
+
+    :param archive_path: The path of the archive. For multi-chunk VPKs, the _dir.vpk.
+    :type archive_path: Path
+    :return: The opened archive.
+    :rtype: vpkpp.PackFile
+    """
+
+    key = os.path.abspath(archive_path)
+    archive = open_archives.get(key)
+    if archive is None:
+        archive = vpkpp.PackFile.open(key)
+        if archive is None:
+            raise ValueError(f"{archive_path} could not be opened as an archive.")
+        open_archives[key] = archive
+    return archive
+
+
+def list_archive_entries(archive_path: Path, suffix: str = "") -> list[tuple[str, int]]:
+    """
+    Lists the entries of an archive, without reading their contents.
+
+    :param archive_path: The path of the archive.
+    :type archive_path: Path
+    :param suffix: The lowercase extension to filter entries by, e.g. ".vtf".
+    :type suffix: str
+    :return: A list of (entry path, length) tuples.
+    :rtype: list
+    """
+
+    entries = []
+    open_archive(archive_path).run_for_all_entries(
+        lambda path, entry: (
+            entries.append((path, entry.length))
+            if path.lower().endswith(suffix)
+            else None
+        )
+    )
+    return entries
+
+
+def read_archive_entry(archive_path: Path, entry_path: str) -> ArchiveBuffer:
+    """
+    Reads an archive entry into memory.
+
+    :param archive_path: The path of the archive.
+    :type archive_path: Path
+    :param entry_path: The path of the entry inside the archive.
+    :type entry_path: str
+    :return: The entry's contents.
+    :rtype: ArchiveBuffer
+    """
+
+    data = open_archive(archive_path).read_entry(entry_path)
+    if data is None:
+        raise FileNotFoundError(f"{entry_path} is not in {archive_path}.")
+    return ArchiveBuffer(data, archive_path, entry_path)
+
+
+class ArchiveSink(ABC):
+    """
+    An output archive which finished files are streamed into as they complete. Each
+    entry's CRC32 is computed as it is added, and later entries with a path already in
+    the archive are ignored.
+    """
+
+    def __init__(self, archive_path: Path):
+        self.archive_path = archive_path
+        self.entries = {}
+        # source entries replaced by an entry under another name, e.g. a converted WAV
+        self.replaced = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __contains__(self, entry_path: str) -> bool:
+        return _entry_key(entry_path) in self.entries
+
+    def add(self, entry_path: str, data: bytes) -> bool:
+        """
+        Adds an entry to the archive.
+
+        :param entry_path: The path of the entry inside the archive.
+        :type entry_path: str
+        :param data: The contents of the entry.
+        :type data: bytes
+        :return: Whether the entry was added, i.e. its path was not in the archive yet.
+        :rtype: bool
+        """
+
+        key = _entry_key(entry_path)
+        if key in self.entries:
+            return False
+        self.entries[key] = self._write(bytes(data), zlib.crc32(data))
+        return True
+
+    def add_tree(self, root: Path) -> None:
+        """
+        Adds every file under a directory, relative to it.
+
+        :param root: The directory to add, if it exists.
+        :type root: Path
+        """
+
+        if not root.is_dir():
+            return
+
+        for path in sorted(root.rglob("*")):
+            if path.is_file():
+                self.add(path.relative_to(root).as_posix(), path.read_bytes())
+
+    def add_archive(self, archive_path: Path, skip: set = frozenset()) -> None:
+        """
+        Adds every entry of another archive that is not in this archive yet.
+
+        :param archive_path: The archive to copy entries from.
+        :type archive_path: Path
+        :param skip: Entry paths to leave out, e.g. entries replaced under a new name.
+        :type skip: set
+        """
+
+        skip = {_entry_key(entry_path) for entry_path in skip}
+        for entry_path, _ in list_archive_entries(archive_path):
+            if entry_path not in self and _entry_key(entry_path) not in skip:
+                self.add(entry_path, read_archive_entry(archive_path, entry_path))
+
+    @abstractmethod
+    def _write(self, data: bytes, crc: int):
+        """
+        Stores an entry's contents.
+
+        :param data: The contents of the entry.
+        :type data: bytes
+        :param crc: The CRC32 of data.
+        :type crc: int
+        :return: What close needs to list the entry, e.g. its offset and length.
+        """
+
+    @abstractmethod
+    def close(self) -> None:
+        """
+        Writes out the archive's file table and closes it.
+        """
+
+
+class VPKSink(ArchiveSink):
+    """
+    A multi-chunk VPK (version 2). Entry data is appended to numbered chunk files as it
+    arrives, and entries with identical contents share the same data in the chunks.
+    """
+
+    def __init__(self, archive_path: Path, chunk_size: int = VPK_CHUNK_SIZE):
+        super().__init__(archive_path)
+        self.stem = archive_path.stem.removesuffix("_dir")
+        self.chunk_size = chunk_size
+
+        self.chunk_index = -1
+        self.chunk_file = None
+        self.chunk_offset = 0
+        # content digest -> (crc, chunk index, offset, length)
+        self.contents = {}
+
+    def _next_chunk(self) -> None:
+        if self.chunk_file:
+            self.chunk_file.close()
+        self.chunk_index += 1
+        self.chunk_file = open(
+            self.archive_path.with_name(f"{self.stem}_{self.chunk_index:03d}.vpk"), "wb"
+        )
+        self.chunk_offset = 0
+
+    def _write(self, data: bytes, crc: int):
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        stored = self.contents.get(digest)
+        if stored is not None:
+            return stored
+
+        if self.chunk_file is None or (
+            self.chunk_offset and self.chunk_offset + len(data) > self.chunk_size
+        ):
+            self._next_chunk()
+
+        stored = (crc, self.chunk_index, self.chunk_offset, len(data))
+        self.chunk_file.write(data)
+        self.chunk_offset += len(data)
+        self.contents[digest] = stored
+        return stored
+
+    def close(self) -> None:
+        if self.chunk_file:
+            self.chunk_file.close()
+
+        tree = {}
+        for entry_path, stored in self.entries.items():
+            directory, _, name = entry_path.rpartition("/")
+            stem, dot, extension = name.rpartition(".")
+            if not dot:
+                stem, extension = extension, ""
+            tree.setdefault(extension or " ", {}).setdefault(directory or " ", {})[
+                stem
+            ] = stored
+
+        parts = []
+        for extension, directories in sorted(tree.items()):
+            parts.append(extension.encode("utf-8") + b"\0")
+            for directory, files in sorted(directories.items()):
+                parts.append(directory.encode("utf-8") + b"\0")
+                for stem, (crc, chunk_index, offset, length) in sorted(files.items()):
+                    parts.append(stem.encode("utf-8") + b"\0")
+                    parts.append(
+                        VPK_ENTRY.pack(crc, 0, chunk_index, offset, length, 0xFFFF)
+                    )
+                parts.append(b"\0")
+            parts.append(b"\0")
+        parts.append(b"\0")
+        tree_blob = b"".join(parts)
+
+        dir_path = self.archive_path.with_name(f"{self.stem}_dir.vpk")
+        with open(dir_path, "wb") as dir_file:
+            dir_file.write(
+                VPK_HEADER.pack(VPK_SIGNATURE, 2, len(tree_blob), 0, 0, 0, 0)
+            )
+            dir_file.write(tree_blob)
+
+
+class GMASink(ArchiveSink):
+    """
+    A Garry's Mod addon (GMA version 3). Its file table precedes the data, so entry data
+    is staged in a temporary file until the archive is closed. GMAs cannot share data
+    between entries, so identical entries are stored once per path.
+    """
+
+    def __init__(self, archive_path: Path):
+        super().__init__(archive_path)
+        self.data_file = tempfile.TemporaryFile(dir=archive_path.parent)
+
+    def _write(self, data: bytes, crc: int):
+        self.data_file.write(data)
+        return crc, len(data)
+
+    def close(self) -> None:
+        header = [
+            b"GMAD",
+            struct.pack("<BQQ", 3, 0, int(time.time())),
+            # no required content
+            b"\0",
+            self.archive_path.stem.encode("utf-8") + b"\0",
+            json.dumps({"description": "", "type": "", "tags": []}).encode("utf-8")
+            + b"\0",
+            b"Author Name\0",
+            struct.pack("<i", 1),
+        ]
+        for number, (entry_path, (crc, length)) in enumerate(self.entries.items(), 1):
+            header.append(struct.pack("<I", number))
+            header.append(entry_path.encode("utf-8") + b"\0")
+            header.append(struct.pack("<qI", length, crc))
+        header.append(struct.pack("<I", 0))
+        header = b"".join(header)
+
+        crc = zlib.crc32(header)
+        with open(self.archive_path, "wb") as archive_file:
+            archive_file.write(header)
+            self.data_file.seek(0)
+            while chunk := self.data_file.read(COPY_CHUNK_SIZE):
+                crc = zlib.crc32(chunk, crc)
+                archive_file.write(chunk)
+            archive_file.write(struct.pack("<I", crc))
+        self.data_file.close()
+
+
+def _entry_key(entry_path: str) -> str:
+    return entry_path.replace("\\", "/").strip("/").lower()
+
+
+def is_archive_output(path: Path) -> bool:
+    return path.suffix.lower() in ARCHIVE_SUFFIXES and not path.is_dir()
+
+
+def create_archive_sink(archive_path: Path) -> ArchiveSink:
+    """
+    Creates an output archive of the type its extension names.
+
+    :param archive_path: The path of the .gma or .vpk to write.
+    :type archive_path: Path
+    :return: The archive sink.
+    :rtype: ArchiveSink
+    """
+
+    archive_path.parent.mkdir(parents=True, exist_ok=True)
+    if archive_path.suffix.lower() == ".gma":
+        return GMASink(archive_path)
+    return VPKSink(archive_path)
@@ -0,0 +1,332 @@
+import lzma
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from .keyvalues import get_key_values
+from .material_graph import material_key
+from .misc import exception_logger
+
+
+MDL_SIGNATURE = b"IDST"
+# studiohdr_t: numtextures, textureindex, numcdtextures, cdtextureindex
+MDL_TEXTURES = struct.Struct("<4i")
+MDL_TEXTURES_OFFSET = 204
+MDL_TEXTURE_SIZE = 64
+
+BSP_SIGNATURE = b"VBSP"
+BSP_LUMP = struct.Struct("<3i4s")
+BSP_LUMPS_OFFSET = 8
+BSP_LUMP_ENTITIES = 0
+BSP_LUMP_GAME_LUMP = 35
+BSP_LUMP_TEXDATA_STRING_DATA = 43
+BSP_GAME_LUMP = struct.Struct("<i2H2i")
+BSP_STATIC_PROP_ID = int.from_bytes(b"sprp", "big")
+BSP_STATIC_PROP_NAME_SIZE = 128
+
+# id, actual size, lzma size, properties
+SOURCE_LZMA_HEADER = struct.Struct("<4s2I5s")
+
+SKYBOX_SIDES = ("rt", "bk", "lf", "ft", "up", "dn")
+REFERENCE_SCAN_CHUNK_SIZE = 16
+
+SCRIPT_SUFFIXES = (".lua", ".txt", ".res", ".vmt")
+SCRIPT_SCAN_CHUNK_SIZE = 64
+
+# the automaton each script scanning worker process builds once
+script_automaton = None
+
+
+def _read_cstring(data: bytes, offset: int) -> str:
+    end = data.find(b"\0", offset)
+    return data[offset : end if end != -1 else len(data)].decode("latin-1")
+
+
+def _decompress_source_lzma(data: bytes) -> bytes:
+    if data[:4] != b"LZMA":
+        return data
+
+    _, actual_size, lzma_size, properties = SOURCE_LZMA_HEADER.unpack_from(data)
+    # rebuild the standard .lzma header that Source strips
+    alone = (
+        properties
+        + struct.pack("<Q", actual_size)
+        + data[SOURCE_LZMA_HEADER.size : SOURCE_LZMA_HEADER.size + lzma_size]
+    )
+    return lzma.LZMADecompressor(format=lzma.FORMAT_ALONE).decompress(alone)[
+        :actual_size
+    ]
+
+
+def parse_mdl_materials(mdl_path: Path) -> set[str]:
+    """
+    Computes every material a model can use, combining each of its texture names with
+    each of its $cdmaterials search paths.
+
+    :param mdl_path: The path of the MDL file.
+    :type mdl_path: Path
+    :return: A set of material keys relative to materials/, without their extension.
+    :rtype: set
+    """
+
+    data = mdl_path.read_bytes()
+    if data[:4] != MDL_SIGNATURE:
+        return set()
+
+    num_textures, texture_index, num_cd, cd_index = MDL_TEXTURES.unpack_from(
+        data, MDL_TEXTURES_OFFSET
+    )
+
+    names = []
+    for i in range(num_textures):
+        texture_offset = texture_index + i * MDL_TEXTURE_SIZE
+        (name_index,) = struct.unpack_from("<i", data, texture_offset)
+        names.append(_read_cstring(data, texture_offset + name_index))
+
+    search_paths = []
+    for i in range(num_cd):
+        (path_offset,) = struct.unpack_from("<i", data, cd_index + i * 4)
+        search_paths.append(_read_cstring(data, path_offset))
+
+    materials = set()
+    for search_path in search_paths or [""]:
+        search_path = search_path.replace("\\", "/").strip("/")
+        for name in names:
+            full_name = f"{search_path}/{name}" if search_path else name
+            materials.add(material_key(full_name, ".vmt"))
+
+    return materials
+
+
+def _bsp_lump(data: bytes, index: int) -> bytes:
+    offset, length, _, _ = BSP_LUMP.unpack_from(
+        data, BSP_LUMPS_OFFSET + index * BSP_LUMP.size
+    )
+    return _decompress_source_lzma(data[offset : offset + length])
+
+
+def parse_bsp_references(bsp_path: Path) -> dict:
+    """
+    Computes the materials, models and entity keyvalues a map references, from its
+    TexDataStringData, static prop dictionary and entity lumps.
+
+    :param bsp_path: The path of the BSP file.
+    :type bsp_path: Path
+    :return: A dictionary with "materials" and "models" sets of lowercase paths, and an
+        "entities" list of (key, value) tuples for every entity keyvalue.
+    :rtype: dict
+    """
+
+    references = {"materials": set(), "models": set(), "entities": []}
+
+    data = bsp_path.read_bytes()
+    if data[:4] != BSP_SIGNATURE:
+        return references
+
+    for name in _bsp_lump(data, BSP_LUMP_TEXDATA_STRING_DATA).split(b"\0"):
+        if name:
+            references["materials"].add(material_key(name.decode("latin-1"), ".vmt"))
+
+    game_lump = _bsp_lump(data, BSP_LUMP_GAME_LUMP)
+    if len(game_lump) >= 4:
+        (count,) = struct.unpack_from("<i", game_lump)
+        for i in range(count):
+            lump_id, _, _, offset, length = BSP_GAME_LUMP.unpack_from(
+                game_lump, 4 + i * BSP_GAME_LUMP.size
+            )
+            if lump_id != BSP_STATIC_PROP_ID:
+                continue
+
+            static_props = _decompress_source_lzma(data[offset : offset + length])
+            (entries,) = struct.unpack_from("<i", static_props)
+            for j in range(entries):
+                name = _read_cstring(static_props, 4 + j * BSP_STATIC_PROP_NAME_SIZE)
+                references["models"].add(name.replace("\\", "/").lower())
+
+    entities = _bsp_lump(data, BSP_LUMP_ENTITIES).decode("latin-1").rstrip("\0")
+    for key, value, _, _ in get_key_values(entities):
+        key = key.lower()
+        references["entities"].append((key, value))
+
+        if value.lower().endswith(".mdl"):
+            references["models"].add(value.replace("\\", "/").lower())
+        elif key == "skyname":
+            for suffix in ("", "_hdr"):
+                for side in SKYBOX_SIDES:
+                    references["materials"].add(
+                        material_key(f"skybox/{value}{suffix}{side}", ".vmt")
+                    )
+
+    return references
+
+
+def _scan_references_worker(path: Path):
+    try:
+        if path.suffix.lower() == ".mdl":
+            references = {"materials": parse_mdl_materials(path), "models": set()}
+            references["entities"] = []
+            return path, references
+        return path, parse_bsp_references(path)
+    except Exception as e:
+        return path, e
+
+
+def scan_model_and_map_references(input_dir: Path) -> dict:
+    """
+    Parses every MDL and BSP file in a directory tree in parallel.
+
+    :param input_dir: The directory to scan.
+    :type input_dir: Path
+    :return: A dictionary of file path keys and parse_bsp_references-style values.
+    :rtype: dict
+    """
+
+    paths = [
+        path
+        for path in input_dir.rglob("*")
+        if path.suffix.lower() in (".mdl", ".bsp") and path.is_file()
+    ]
+
+    results = {}
+    with ProcessPoolExecutor() as executor:
+        for path, references in executor.map(
+            _scan_references_worker, paths, chunksize=REFERENCE_SCAN_CHUNK_SIZE
+        ):
+            if isinstance(references, Exception):
+                exception_logger(references)
+                continue
+            results[path] = references
+
+    return results
+
+
+class AhoCorasick:
+    """
+    A multi-pattern string matcher, finding every occurrence of any of its patterns in a
+    single pass over the text regardless of how many patterns there are.
+    """
+
+    def __init__(self, patterns: list[bytes]):
+        self.goto = [{}]
+        self.fail = [0]
+        # the indices of every pattern ending at each state, including through fail links
+        self.output = [()]
+
+        for index, pattern in enumerate(patterns):
+            state = 0
+            for byte in pattern:
+                next_state = self.goto[state].get(byte)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][byte] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(())
+                state = next_state
+            self.output[state] += (index,)
+
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for byte, next_state in self.goto[state].items():
+                queue.append(next_state)
+
+                fallback = self.fail[state]
+                while fallback and byte not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(byte, 0)
+                self.output[next_state] += self.output[self.fail[next_state]]
+
+    def search(self, data: bytes) -> set[int]:
+        """
+        Finds which patterns occur in data.
+
+        :param data: The text to search.
+        :type data: bytes
+        :return: The indices of every pattern found.
+        :rtype: set
+        """
+
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+
+        found = set()
+        state = 0
+        for byte in data:
+            while state and byte not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(byte, 0)
+            if output[state]:
+                found.update(output[state])
+
+        return found
+
+
+def _init_script_worker(patterns: list[bytes]) -> None:
+    global script_automaton
+    script_automaton = AhoCorasick(patterns)
+
+
+def _scan_script_worker(path: Path):
+    try:
+        data = path.read_bytes().lower()
+        data = data.replace(b"\\\\", b"/").replace(b"\\", b"/")
+        return script_automaton.search(data)
+    except Exception as e:
+        return e
+
+
+def scan_script_references(
+    input_dir: Path,
+    candidates,
+    suffixes: tuple[str] = SCRIPT_SUFFIXES,
+    locate: bool = False,
+) -> set[str] | dict[str, list[Path]]:
+    """
+    Finds which candidate asset paths are mentioned in any Lua, text, resource or VMT
+    file in a directory tree, e.g. in Material("...") calls. Matching is
+    case-insensitive, treats backslashes as forward slashes and accepts a candidate
+    appearing inside a longer path.
+
+    :param input_dir: The directory to scan the scripts of.
+    :type input_dir: Path
+    :param candidates: The asset paths to look for, e.g. material keys.
+    :type candidates: Iterable[str]
+    :param suffixes: The lowercase extensions of the files to scan.
+    :type suffixes: tuple[str]
+    :param locate: True to also return which files mention each candidate.
+    :type locate: bool
+    :return: The set of candidates found, or if locate is True, a dictionary of found
+        candidates and the files mentioning them.
+    :rtype: set | dict
+    """
+
+    candidates = sorted({candidate.lower() for candidate in candidates if candidate})
+    if not candidates:
+        return {} if locate else set()
+
+    paths = [
+        path
+        for path in input_dir.rglob("*")
+        if path.suffix.lower() in suffixes and path.is_file()
+    ]
+    if not paths:
+        return {} if locate else set()
+
+    patterns = [candidate.encode("latin-1", errors="ignore") for candidate in candidates]
+
+    found = {}
+    with ProcessPoolExecutor(
+        initializer=_init_script_worker, initargs=(patterns,)
+    ) as executor:
+        for path, result in zip(
+            paths,
+            executor.map(_scan_script_worker, paths, chunksize=SCRIPT_SCAN_CHUNK_SIZE),
+        ):
+            if isinstance(result, Exception):
+                exception_logger(result)
+                continue
+            for index in result:
+                found.setdefault(candidates[index], []).append(path)
+
+    return found if locate else set(found)
@@ -1,10 +1,20 @@
+import os
+import shutil
+import struct
 import subprocess
 import sys
+from math import gcd
 from pathlib import Path
 
-from pydub import AudioSegment
+import numpy as np
 
-from .misc import exception_logger, fop_copy
+from .misc import SUBPROCESS_FLAGS, exception_logger, fop_copy, report_logger
+
+try:
+    import soundfile
+except (ImportError, OSError):
+    # libsndfile may be missing even when the wrapper is installed
+    soundfile = None
 
 if getattr(sys, "frozen", False):
     BASE_DIR = Path(sys.executable).parent
@@ -12,6 +22,100 @@ else:
     BASE_DIR = Path(__file__).resolve().parent
 OGGENC_EXE = BASE_DIR / "oggenc2" / "oggenc2.exe"
 
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+# format tag, channels, sample rate, byte rate, block align, bits per sample
+WAV_FMT = struct.Struct("<2H2I2H")
+WAV_CHUNK_HEADER = struct.Struct("<4sI")
+# front centre, the speaker a mono extensible WAV is mapped to
+MONO_CHANNEL_MASK = 0x4
+WAV_STREAM_FRAMES = 65536
+
+# the sample rates Source plays natively
+SOURCE_SAMPLE_RATES = (11025, 22050, 44100)
+SPECTRUM_SIZE = 4096
+# content above this fraction of a new Nyquist frequency is counted as lost, as the
+# resampling filter starts rolling off below it
+RESAMPLE_ROLLOFF = 0.9
+RESAMPLE_HALF_TAPS = 10
+RESAMPLE_KAISER_BETA = 5.0
+RESAMPLE_STREAM_FRAMES = 16384
+CUE_POINT = struct.Struct("<2I4s3I")
+SMPL_HEADER = struct.Struct("<9I")
+SMPL_LOOP = struct.Struct("<6I")
+
+
+def _encode_ogg_libvorbis(input_file: Path, output_file: Path, quality: int) -> None:
+    with open(input_file, "rb") as wav_file:
+        layout = WavLayout(wav_file)
+        # libsndfile sets the Vorbis quality to 1 - compression_level, where oggenc's
+        # -q maps to a quality of q / 10. It cannot go below -q 0, so -1 is encoded as 0
+        compression_level = min(1.0, max(0.0, 1 - quality / 10))
+        with soundfile.SoundFile(
+            output_file,
+            "w",
+            samplerate=layout.sample_rate,
+            channels=layout.channels,
+            format="OGG",
+            subtype="VORBIS",
+            compression_level=compression_level,
+        ) as ogg_file:
+            for samples in layout.iter_frames(wav_file):
+                ogg_file.write(samples / layout.full_scale)
+
+
+def _find_oggenc() -> str | None:
+    if sys.platform == "win32" and OGGENC_EXE.is_file():
+        return str(OGGENC_EXE)
+    return shutil.which("oggenc2") or shutil.which("oggenc")
+
+
+def _encode_ogg_oggenc(input_file: Path, output_file: Path, quality: int) -> None:
+    oggenc = _find_oggenc()
+    if oggenc is None:
+        raise FileNotFoundError("No oggenc binary was found.")
+
+    command = [
+        oggenc,
+        str(input_file),
+        "-q",
+        str(quality),
+        "-o",
+        str(output_file),
+    ]
+    subprocess.run(
+        command,
+        check=True,
+        capture_output=True,
+        text=True,
+        creationflags=SUBPROCESS_FLAGS,
+    )
+
+
+OGG_ENCODERS = {
+    "libvorbis": _encode_ogg_libvorbis,
+    "oggenc": _encode_ogg_oggenc,
+}
+
+
+def get_ogg_encoders() -> list[str]:
+    """
+    Lists the OGG encoder backends available on this platform, preferring the
+    in-process libvorbis encoder, which avoids a process spawn per file, over an oggenc
+    binary (the bundled oggenc2.exe on Windows, or one on the PATH elsewhere).
+
+    :return: The names of the available OGG_ENCODERS, in order of preference.
+    :rtype: list[str]
+    """
+
+    encoders = []
+    if soundfile is not None and "VORBIS" in soundfile.available_subtypes("OGG"):
+        encoders.append("libvorbis")
+    if _find_oggenc():
+        encoders.append("oggenc")
+    return encoders
+
 
 def wav_to_ogg(
     input_file: Path,
@@ -19,9 +123,14 @@ def wav_to_ogg(
     quality: int = 5,
     remove: bool = True,
     progress_window=None,
+    encoder: str = None,
 ) -> bool:
     """
-    Converts a WAV audio file to an OGG audio file using oggenc2
+    Converts a WAV audio file to an OGG audio file. Unless an encoder is given, each
+    available backend is tried in turn, so WAVs the in-process encoder cannot decode,
+    e.g. ADPCM, still go through oggenc where it exists. As the in-process encoder
+    cannot go below quality 0, quality -1 goes through oggenc first, and is encoded as
+    0 and listed in report.log where only the in-process encoder is available.
 
     :param input_file: The WAV file to convert.
     :type input_file: Path
@@ -30,26 +139,33 @@ def wav_to_ogg(
     :param quality: The bitrate "level" (-1 to 10) to encode the OGG with.
     -1 => lowest quality, smallest filesizes. 10 => highest quality, largest filesizes.
     :type quality: int
+    :param encoder: The name of an OGG_ENCODERS backend to use, or None to pick one.
+    :type encoder: str
     :return: Whether the function completed successfully.
     :rtype: bool
     """
 
     try:
-        command = [
-            str(OGGENC_EXE),
-            str(input_file),
-            "-q",
-            str(quality),
-            "-o",
-            str(output_file),
-        ]
-        subprocess.run(
-            command,
-            check=True,
-            capture_output=True,
-            text=True,
-            creationflags=subprocess.CREATE_NO_WINDOW,
-        )
+        encoders = [encoder] if encoder else get_ogg_encoders()
+        if not encoders:
+            raise RuntimeError(
+                "No OGG encoder is available: install soundfile, or oggenc on the PATH."
+            )
+        if quality < 0 and "oggenc" in encoders:
+            encoders = ["oggenc"] + [name for name in encoders if name != "oggenc"]
+
+        for i, name in enumerate(encoders):
+            try:
+                OGG_ENCODERS[name](input_file, output_file, quality)
+                break
+            except Exception as e:
+                if i == len(encoders) - 1:
+                    raise
+                exception_logger(e)
+
+        if quality < 0 and name == "libvorbis":
+            report_logger("wav_to_ogg", input_file, quality=quality, encoded_quality=0)
+
         if remove:
             input_file.unlink()
 
@@ -61,13 +177,205 @@ def wav_to_ogg(
         return False
 
 
+class WavLayout:
+    """
+    The chunk layout and sample format of a RIFF WAV file, read without its samples.
+    """
+
+    def __init__(self, wav_file):
+        riff, _, wave = struct.unpack("<4sI4s", wav_file.read(12))
+        if riff != b"RIFF" or wave != b"WAVE":
+            raise ValueError("Not a RIFF WAVE file.")
+
+        # (chunk id, offset of the chunk's data, size) in file order
+        self.chunks = []
+        while header := wav_file.read(WAV_CHUNK_HEADER.size):
+            if len(header) < WAV_CHUNK_HEADER.size:
+                break
+            chunk_id, size = WAV_CHUNK_HEADER.unpack(header)
+            self.chunks.append((chunk_id, wav_file.tell(), size))
+            wav_file.seek(size + (size & 1), os.SEEK_CUR)
+
+        fmt = self.chunk(b"fmt ")
+        data = self.chunk(b"data")
+        if fmt is None or data is None:
+            raise ValueError("WAV file has no fmt or data chunk.")
+
+        wav_file.seek(fmt[1])
+        self.fmt = wav_file.read(fmt[2])
+        (
+            self.format_tag,
+            self.channels,
+            self.sample_rate,
+            _,
+            self.block_align,
+            self.bits,
+        ) = WAV_FMT.unpack_from(self.fmt)
+
+        self.sample_format = self.format_tag
+        if self.format_tag == WAVE_FORMAT_EXTENSIBLE and len(self.fmt) >= 26:
+            # the sub-format GUID starts with the actual format tag
+            (self.sample_format,) = struct.unpack_from("<H", self.fmt, 24)
+        if self.sample_format not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT):
+            raise ValueError(f"Unsupported WAV sample format {self.sample_format:#x}.")
+
+        self.sample_width = self.bits // 8
+        self.data_offset = data[1]
+        # a truncated data chunk is read up to the end of the file
+        wav_file.seek(0, os.SEEK_END)
+        self.frames = min(data[2], wav_file.tell() - data[1]) // self.block_align
+
+    def chunk(self, chunk_id: bytes) -> tuple[bytes, int, int] | None:
+        return next((chunk for chunk in self.chunks if chunk[0] == chunk_id), None)
+
+    @property
+    def full_scale(self) -> float:
+        if self.sample_format == WAVE_FORMAT_IEEE_FLOAT:
+            return 1.0
+        return float(1 << (self.bits - 1))
+
+    def decode(self, raw: bytes) -> np.ndarray:
+        """
+        Converts raw interleaved frames to a (frames, channels) array of floats on the
+        integer scale of the sample format, e.g. -32768 to 32767 for 16-bit PCM.
+        """
+
+        width = self.sample_width
+        if self.sample_format == WAVE_FORMAT_IEEE_FLOAT:
+            samples = np.frombuffer(raw, dtype=f"<f{width}").astype(np.float64)
+        elif width == 1:
+            samples = np.frombuffer(raw, dtype=np.uint8).astype(np.float64) - 128
+        elif width == 3:
+            triplets = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+            samples = triplets[:, 0] | triplets[:, 1] << 8 | triplets[:, 2] << 16
+            samples = (samples ^ 0x800000) - 0x800000
+            samples = samples.astype(np.float64)
+        else:
+            samples = np.frombuffer(raw, dtype=f"<i{width}").astype(np.float64)
+
+        return samples.reshape(-1, self.channels)
+
+    def encode(self, samples: np.ndarray) -> bytes:
+        """
+        Converts an array of floats on the integer scale of the sample format back to
+        raw interleaved frames, rounding and clipping integer formats.
+        """
+
+        width = self.sample_width
+        if self.sample_format == WAVE_FORMAT_IEEE_FLOAT:
+            return samples.astype(f"<f{width}").tobytes()
+
+        limit = 1 << (self.bits - 1)
+        samples = np.clip(np.rint(samples), -limit, limit - 1).astype(np.int32)
+        if width == 1:
+            return (samples + 128).astype(np.uint8).tobytes()
+        if width == 3:
+            return samples.astype("<i4").view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+        return samples.astype(f"<i{width}").tobytes()
+
+    def iter_frames(self, wav_file, frames: int = WAV_STREAM_FRAMES):
+        """
+        Yields the samples in blocks of up to frames frames, keeping memory constant
+        regardless of the file's length.
+        """
+
+        wav_file.seek(self.data_offset)
+        remaining = self.frames
+        while remaining > 0:
+            count = min(frames, remaining)
+            raw = wav_file.read(count * self.block_align)
+            count = len(raw) // self.block_align
+            if count == 0:
+                break
+            yield self.decode(raw[: count * self.block_align])
+            remaining -= count
+
+    def mono_fmt(self) -> bytes:
+        fmt = bytearray(self.fmt)
+        block_align = self.sample_width
+        WAV_FMT.pack_into(
+            fmt,
+            0,
+            self.format_tag,
+            1,
+            self.sample_rate,
+            self.sample_rate * block_align,
+            block_align,
+            self.bits,
+        )
+        if self.format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 24:
+            struct.pack_into("<I", fmt, 20, MONO_CHANNEL_MASK)
+        return bytes(fmt)
+
+
+def write_wav(
+    output_file: Path,
+    input_file: Path,
+    layout: WavLayout,
+    fmt: bytes,
+    transform,
+    size: int,
+    chunks: dict = None,
+) -> None:
+    """
+    Writes a WAV file with a new fmt chunk and streamed sample data, copying every other
+    chunk of the input (e.g. cue and smpl, which Source uses for looping) in its
+    original order. The file is written beside output_file and moved over it last, so
+    output_file may be input_file.
+
+    :param output_file: The WAV file to write to.
+    :type output_file: Path
+    :param input_file: The WAV file the other chunks are copied from.
+    :type input_file: Path
+    :param layout: The layout of input_file.
+    :type layout: WavLayout
+    :param fmt: The new fmt chunk data.
+    :type fmt: bytes
+    :param transform: A function converting each block of input samples from
+        WavLayout.iter_frames to raw output sample data.
+    :param size: The total size of the output sample data in bytes.
+    :type size: int
+    :param chunks: Replacement data for other chunks, keyed by chunk id.
+    :type chunks: dict
+    """
+
+    chunks = chunks or {}
+
+    temp_file = output_file.with_name(output_file.name + ".tmp")
+    with open(input_file, "rb") as src, open(temp_file, "wb") as dst:
+        dst.write(b"RIFF\0\0\0\0WAVE")
+        for chunk_id, offset, chunk_size in layout.chunks:
+            if chunk_id == b"fmt ":
+                dst.write(WAV_CHUNK_HEADER.pack(chunk_id, len(fmt)) + fmt)
+                dst.write(b"\0" * (len(fmt) & 1))
+            elif chunk_id == b"data":
+                dst.write(WAV_CHUNK_HEADER.pack(chunk_id, size))
+                for samples in layout.iter_frames(src):
+                    dst.write(transform(samples))
+                # lets a stateful transform flush what it still holds
+                dst.write(transform(None))
+                dst.write(b"\0" * (size & 1))
+            else:
+                src.seek(offset)
+                data = chunks.get(chunk_id, src.read(chunk_size))
+                dst.write(WAV_CHUNK_HEADER.pack(chunk_id, len(data)) + data)
+                dst.write(b"\0" * (len(data) & 1))
+
+        riff_size = dst.tell() - 8
+        dst.seek(4)
+        dst.write(struct.pack("<I", riff_size))
+    os.replace(temp_file, output_file)
+
+
 def wav_stereo_to_mono(
     input_file: Path,
     output_file: Path,
     remove: bool = True,
+    max_difference: float = None,
 ) -> bool:
     """
-    Converts a stereo WAV to a mono one, with both channels crushed into one.
+    Converts a multichannel WAV to a mono one, averaging its channels. The file is
+    streamed in blocks, so memory stays constant regardless of its length.
 
     :param input_file: The WAV file to convert.
     :type input_file: Path
@@ -75,21 +383,287 @@ def wav_stereo_to_mono(
     :type output_file: Path
     :param remove: True if the function should remove the stereo WAV from the input directory instead
         of copying the mono to the output directory.
+    :param max_difference: If set, only downmix "fake stereo", whose channels never
+        differ by more than this fraction of full scale. 0 => identical channels only.
+    :type max_difference: float
     :return: Whether the function completed successfully.
     :rtype: bool
     """
 
     try:
-        input_wav = AudioSegment.from_wav(input_file)
-
-        if input_wav.channels == 2:
-            mono_wav = input_wav.set_channels(1)
-            mono_wav.export(output_file, format="wav")
-            
-            if remove and input_file != output_file:
-                input_file.unlink()
+        with open(input_file, "rb") as wav_file:
+            layout = WavLayout(wav_file)
+
+            difference = 0.0
+            if layout.channels > 1 and max_difference is not None:
+                for samples in layout.iter_frames(wav_file):
+                    spread = samples.max(axis=1) - samples.min(axis=1)
+                    difference = max(difference, float(spread.max(initial=0)))
+                difference /= layout.full_scale
+
+        downmix = layout.channels > 1 and (
+            max_difference is None or difference <= max_difference
+        )
+        report_logger(
+            "wav_stereo_to_mono",
+            input_file,
+            channels=layout.channels,
+            channel_difference=round(difference, 6),
+            downmixed=downmix,
+        )
+
+        if not downmix:
+            fop_copy(src=input_file, dst=output_file, mode=1)
+            return True
+
+        write_wav(
+            output_file=output_file,
+            input_file=input_file,
+            layout=layout,
+            fmt=layout.mono_fmt(),
+            transform=lambda samples: (
+                layout.encode(samples.mean(axis=1)) if samples is not None else b""
+            ),
+            size=layout.frames * layout.sample_width,
+        )
+
+        if remove and input_file != output_file:
+            input_file.unlink()
+
+        return True
+    except Exception as e:
+        exception_logger(e)
+        return False
+
+
+class PolyphaseResampler:
+    """
+    A streaming rational resampler, i.e. upsampling by up, filtering with a
+    Kaiser-windowed sinc low-pass and downsampling by down, computing only the output
+    samples through each filter phase.
+    """
+
+    def __init__(self, up: int, down: int, channels: int, frames: int):
+        divisor = gcd(up, down)
+        self.up, self.down = up // divisor, down // divisor
+
+        max_rate = max(self.up, self.down)
+        self.half_len = RESAMPLE_HALF_TAPS * max_rate
+        n = np.arange(-self.half_len, self.half_len + 1)
+        kernel = np.sinc(n / max_rate) / max_rate
+        kernel *= np.kaiser(len(n), RESAMPLE_KAISER_BETA) * self.up
+
+        self.taps = -(-len(kernel) // self.up)
+        kernel = np.pad(kernel, (0, self.taps * self.up - len(kernel)))
+        # phases[p, j] weighs the input sample j steps back for output phase p
+        self.phases = kernel.reshape(self.taps, self.up).T
+
+        self.total = -(-frames * self.up // self.down)
+        self.produced = 0
+        self.received = 0
+        # absolute input index of buffer[0], starting with zeros before the input
+        self.buffer = np.zeros((self.taps - 1, channels))
+        self.buffer_start = -(self.taps - 1)
+
+    def process(self, samples: np.ndarray | None) -> np.ndarray:
+        """
+        Resamples the next block of input, or flushes the rest of the output when
+        samples is None.
+
+        :param samples: A (frames, channels) block of input samples.
+        :type samples: np.ndarray | None
+        :return: A (frames, channels) block of output samples.
+        :rtype: np.ndarray
+        """
+
+        if samples is None:
+            # the input continues as silence past its end
+            padding = self.taps + self.half_len // self.up + 1
+            samples = np.zeros((padding, self.buffer.shape[1]))
+            end = self.total
         else:
+            self.received += len(samples)
+            end = None
+
+        self.buffer = np.concatenate([self.buffer, samples])
+        last = self.buffer_start + len(self.buffer) - 1
+
+        # output n reads input up to index (n * down + half_len) // up
+        available = ((last + 1) * self.up - 1 - self.half_len) // self.down + 1
+        end = min(self.total, available if end is None else end)
+        if end <= self.produced:
+            return np.zeros((0, self.buffer.shape[1]))
+
+        positions = np.arange(self.produced, end) * self.down + self.half_len
+        indices = positions // self.up - self.buffer_start
+        window = indices[:, None] - np.arange(self.taps)[None, :]
+        output = np.einsum(
+            "nj,njc->nc", self.phases[positions % self.up], self.buffer[window]
+        )
+
+        self.produced = end
+        next_index = (end * self.down + self.half_len) // self.up
+        keep = max(0, next_index - self.taps + 1 - self.buffer_start)
+        self.buffer = self.buffer[keep:]
+        self.buffer_start += keep
+
+        return output
+
+
+def get_energy_spectrum(layout: WavLayout, wav_file) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Computes the energy of a WAV's channel average per frequency, summing Hann-windowed
+    FFTs over consecutive blocks of SPECTRUM_SIZE frames.
+
+    :param layout: The layout of the WAV.
+    :type layout: WavLayout
+    :param wav_file: The open WAV file.
+    :return: A (frequencies, energies) tuple.
+    :rtype: tuple
+    """
+
+    window = np.hanning(SPECTRUM_SIZE)
+    energies = np.zeros(SPECTRUM_SIZE // 2 + 1)
+    remainder = np.zeros(0)
+
+    for samples in layout.iter_frames(wav_file):
+        mono = np.concatenate([remainder, samples.mean(axis=1)])
+        count = len(mono) // SPECTRUM_SIZE
+        remainder = mono[count * SPECTRUM_SIZE :]
+        if count:
+            blocks = mono[: count * SPECTRUM_SIZE].reshape(count, SPECTRUM_SIZE)
+            energies += (np.abs(np.fft.rfft(blocks * window, axis=1)) ** 2).sum(axis=0)
+
+    if len(remainder):
+        block = np.pad(remainder, (0, SPECTRUM_SIZE - len(remainder)))
+        energies += np.abs(np.fft.rfft(block * window)) ** 2
+
+    return np.fft.rfftfreq(SPECTRUM_SIZE, 1 / layout.sample_rate), energies
+
+
+def _rescale_cue(data: bytes, ratio: float) -> bytes:
+    data = bytearray(data)
+    (count,) = struct.unpack_from("<I", data)
+    for i in range(count):
+        offset = 4 + i * CUE_POINT.size
+        if offset + CUE_POINT.size > len(data):
+            break
+        point, position, chunk, chunk_start, block_start, sample = (
+            CUE_POINT.unpack_from(data, offset)
+        )
+        CUE_POINT.pack_into(
+            data,
+            offset,
+            point,
+            round(position * ratio),
+            chunk,
+            chunk_start,
+            block_start,
+            round(sample * ratio),
+        )
+    return bytes(data)
+
+
+def _rescale_smpl(data: bytes, ratio: float) -> bytes:
+    data = bytearray(data)
+    header = list(SMPL_HEADER.unpack_from(data))
+    # nanoseconds per sample
+    header[2] = round(header[2] / ratio)
+    SMPL_HEADER.pack_into(data, 0, *header)
+
+    for i in range(header[7]):
+        offset = SMPL_HEADER.size + i * SMPL_LOOP.size
+        if offset + SMPL_LOOP.size > len(data):
+            break
+        loop = list(SMPL_LOOP.unpack_from(data, offset))
+        loop[2] = round(loop[2] * ratio)
+        loop[3] = round(loop[3] * ratio)
+        SMPL_LOOP.pack_into(data, offset, *loop)
+    return bytes(data)
+
+
+def wav_downsample(
+    input_file: Path, output_file: Path, max_energy_loss: float = 1e-4
+) -> bool:
+    """
+    Resamples a WAV to the lowest sample rate Source plays natively that keeps almost
+    all of its energy, i.e. whose content is band-limited below that rate's Nyquist
+    frequency. Cue and smpl loop points are moved to match.
+
+    :param input_file: The WAV file to downsample.
+    :type input_file: Path
+    :param output_file: The WAV file to write to.
+    :type output_file: Path
+    :param max_energy_loss: The largest fraction of the total energy that may lie
+        above the kept band.
+    :type max_energy_loss: float
+    :return: Whether the function completed successfully.
+    :rtype: bool
+    """
+
+    try:
+        with open(input_file, "rb") as wav_file:
+            layout = WavLayout(wav_file)
+            frequencies, energies = get_energy_spectrum(layout, wav_file)
+
+        total = energies.sum()
+        new_rate = layout.sample_rate
+        energy_loss = 0.0
+        for rate in SOURCE_SAMPLE_RATES:
+            if rate >= layout.sample_rate:
+                break
+            lost = energies[frequencies > rate / 2 * RESAMPLE_ROLLOFF].sum()
+            loss = lost / total if total > 0 else 0.0
+            if loss <= max_energy_loss:
+                new_rate, energy_loss = rate, float(loss)
+                break
+
+        report_logger(
+            "wav_downsample",
+            input_file,
+            sample_rate=layout.sample_rate,
+            new_sample_rate=new_rate,
+            energy_loss=energy_loss,
+        )
+
+        if new_rate == layout.sample_rate:
             fop_copy(src=input_file, dst=output_file, mode=1)
+            return True
+
+        resampler = PolyphaseResampler(
+            new_rate, layout.sample_rate, layout.channels, layout.frames
+        )
+        ratio = new_rate / layout.sample_rate
+
+        fmt = bytearray(layout.fmt)
+        WAV_FMT.pack_into(
+            fmt,
+            0,
+            layout.format_tag,
+            layout.channels,
+            new_rate,
+            new_rate * layout.block_align,
+            layout.block_align,
+            layout.bits,
+        )
+
+        chunks = {}
+        with open(input_file, "rb") as wav_file:
+            for chunk_id, rescale in ((b"cue ", _rescale_cue), (b"smpl", _rescale_smpl)):
+                chunk = layout.chunk(chunk_id)
+                if chunk is not None:
+                    wav_file.seek(chunk[1])
+                    chunks[chunk_id] = rescale(wav_file.read(chunk[2]), ratio)
+
+        write_wav(
+            output_file=output_file,
+            input_file=input_file,
+            layout=layout,
+            fmt=bytes(fmt),
+            transform=lambda samples: layout.encode(resampler.process(samples)),
+            size=resampler.total * layout.block_align,
+            chunks=chunks,
+        )
 
         return True
     except Exception as e:
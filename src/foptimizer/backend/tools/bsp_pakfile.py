@@ -0,0 +1,263 @@
+import functools
+import io
+import os
+import struct
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path, PurePosixPath
+
+from .asset_references import (
+    BSP_GAME_LUMP,
+    BSP_LUMP,
+    BSP_LUMP_GAME_LUMP,
+    BSP_LUMPS_OFFSET,
+    BSP_SIGNATURE,
+)
+from .audio_conversion import wav_stereo_to_mono
+from .fastdl import get_content_files
+from .image_conversion import fit_alpha, optimize_png, shrink_solid
+from .misc import exception_logger, report_logger
+
+
+BSP_LUMP_PAKFILE = 40
+BSP_LUMP_COUNT = 64
+# ident, version, the lump table, then the map revision
+BSP_HEADER_SIZE = BSP_LUMPS_OFFSET + BSP_LUMP_COUNT * BSP_LUMP.size + 4
+# version 21 onwards (e.g. Left 4 Dead 2) orders the lump table's fields differently
+BSP_MAX_VERSION = 20
+BSP_LUMP_ALIGNMENT = 4
+
+# the lossless loose-file optimizers each embedded entry is run through, in order
+PAKFILE_OPTIMIZERS = {
+    ".vtf": (functools.partial(fit_alpha, lossless=True), shrink_solid),
+    ".png": (functools.partial(optimize_png, lossless=True),),
+    ".wav": (functools.partial(wav_stereo_to_mono, remove=False, max_difference=0.0),),
+}
+
+
+def _optimize_entry_worker(entry_name: str, data: bytes):
+    try:
+        name = PurePosixPath(entry_name).name
+        with tempfile.TemporaryDirectory() as temp_dir:
+            src = Path(temp_dir) / name
+            src.write_bytes(data)
+            for i, tool in enumerate(PAKFILE_OPTIMIZERS[src.suffix.lower()]):
+                dst = Path(temp_dir) / str(i) / name
+                dst.parent.mkdir()
+                # a failed step is skipped, and the next works on the last good output
+                if tool(input_file=src, output_file=dst) and dst.is_file():
+                    src = dst
+            optimized = src.read_bytes()
+
+        return entry_name, optimized if len(optimized) < len(data) else None
+    except Exception as e:
+        return entry_name, e
+
+
+def read_bsp_lumps(bsp_path: Path) -> tuple[bytes, list[list]]:
+    """
+    Reads the header of a BSP.
+
+    :param bsp_path: The path of the BSP file.
+    :type bsp_path: Path
+    :return: A (header, lumps) tuple, where lumps holds each lump's [offset, length,
+        version, fourCC].
+    :rtype: tuple
+    """
+
+    with open(bsp_path, "rb") as f:
+        header = f.read(BSP_HEADER_SIZE)
+    if len(header) < BSP_HEADER_SIZE or header[:4] != BSP_SIGNATURE:
+        raise ValueError(f"{bsp_path} is not a BSP.")
+
+    version = struct.unpack_from("<i", header, 4)[0]
+    if version > BSP_MAX_VERSION:
+        raise ValueError(f"{bsp_path} is BSP version {version}, which is not supported.")
+
+    lumps = [
+        list(BSP_LUMP.unpack_from(header, BSP_LUMPS_OFFSET + i * BSP_LUMP.size))
+        for i in range(BSP_LUMP_COUNT)
+    ]
+    return header, lumps
+
+
+def _relocate_game_lump(data: bytes, delta: int) -> bytes:
+    # the game lump's directory holds file offsets, not offsets into the lump
+    data = bytearray(data)
+    count = struct.unpack_from("<i", data)[0]
+    for i in range(count):
+        offset = 4 + i * BSP_GAME_LUMP.size
+        lump_id, flags, version, file_offset, length = BSP_GAME_LUMP.unpack_from(
+            data, offset
+        )
+        if file_offset:
+            BSP_GAME_LUMP.pack_into(
+                data, offset, lump_id, flags, version, file_offset + delta, length
+            )
+    return bytes(data)
+
+
+def write_bsp_pakfile(bsp_path: Path, output_file: Path, pakfile: bytes) -> None:
+    """
+    Writes a copy of a BSP with a new pakfile lump in a single pass, moving the lumps
+    after it and fixing up the lump table and the game lump's file offsets.
+
+    :param bsp_path: The path of the BSP file.
+    :type bsp_path: Path
+    :param output_file: The BSP file to write to, which may be bsp_path.
+    :type output_file: Path
+    :param pakfile: The contents of the new pakfile lump.
+    :type pakfile: bytes
+    """
+
+    header, lumps = read_bsp_lumps(bsp_path)
+    order = sorted(
+        (i for i in range(BSP_LUMP_COUNT) if lumps[i][1] or i == BSP_LUMP_PAKFILE),
+        key=lambda i: lumps[i][0],
+    )
+
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    temp_file = output_file.with_name(output_file.name + ".tmp")
+    with open(bsp_path, "rb") as src, open(temp_file, "wb") as dst:
+        dst.write(bytes(BSP_HEADER_SIZE))
+        position = BSP_HEADER_SIZE
+        for i in order:
+            offset, length = lumps[i][:2]
+            if i == BSP_LUMP_PAKFILE:
+                data = pakfile
+            else:
+                src.seek(offset)
+                data = src.read(length)
+
+            position += dst.write(bytes(-position % BSP_LUMP_ALIGNMENT))
+            if i == BSP_LUMP_GAME_LUMP:
+                data = _relocate_game_lump(data, position - offset)
+
+            lumps[i][:2] = position, len(data)
+            position += dst.write(data)
+
+        header = bytearray(header)
+        for i, lump in enumerate(lumps):
+            BSP_LUMP.pack_into(header, BSP_LUMPS_OFFSET + i * BSP_LUMP.size, *lump)
+        dst.seek(0)
+        dst.write(header)
+    os.replace(temp_file, output_file)
+
+
+def optimize_bsp_pakfiles(
+    input_dir: Path, output_dir: Path, progress_window=None
+) -> bool:
+    """
+    Optimizes the VTFs, PNGs and WAVs embedded in every map's pakfile lump with the
+    same lossless tools used on loose files, in parallel, and removes embedded files
+    identical to the loose file at the same path. Only changed maps are written.
+
+    :param input_dir: The directory to search for BSP files.
+    :type input_dir: Path
+    :param output_dir: The directory to write changed maps to, which may be input_dir.
+    :type output_dir: Path
+    :return: Whether the function completed successfully.
+    :rtype: bool
+    """
+
+    try:
+        if not input_dir.is_dir():
+            if progress_window:
+                progress_window.error(
+                    "Optimize Map Pakfiles failed: Input folder was not a folder, or does "
+                    "not exist."
+                )
+            return False
+
+        bsp_paths = sorted(input_dir.rglob("*.bsp"))
+        total = len(bsp_paths)
+        if total == 0:
+            if progress_window:
+                progress_window.update(0, 0)
+            return True
+
+        loose_files = {
+            rel_path.lower(): path
+            for path, rel_path in get_content_files(input_dir).items()
+            if path.suffix.lower() != ".bsp"
+        }
+
+        processed = 0
+        with ProcessPoolExecutor() as executor:
+            for bsp_path in bsp_paths:
+                entries = []
+                try:
+                    _, lumps = read_bsp_lumps(bsp_path)
+                    offset, length = lumps[BSP_LUMP_PAKFILE][:2]
+                    with open(bsp_path, "rb") as f:
+                        f.seek(offset)
+                        pakfile = f.read(length)
+
+                    if pakfile:
+                        with zipfile.ZipFile(io.BytesIO(pakfile)) as zf:
+                            comment = zf.comment
+                            entries = [(info, zf.read(info)) for info in zf.infolist()]
+                except Exception as e:
+                    exception_logger(e)
+
+                futures = [
+                    executor.submit(_optimize_entry_worker, info.filename, data)
+                    for info, data in entries
+                    if PurePosixPath(info.filename).suffix.lower() in PAKFILE_OPTIMIZERS
+                ]
+                optimized = {}
+                for future in as_completed(futures):
+                    entry_name, data = future.result()
+                    if isinstance(data, Exception):
+                        exception_logger(data)
+                    elif data is not None:
+                        optimized[entry_name] = data
+
+                new_entries = []
+                deduplicated = 0
+                for info, data in entries:
+                    data = optimized.get(info.filename, data)
+                    loose_file = loose_files.get(
+                        info.filename.replace("\\", "/").strip("/").lower()
+                    )
+                    if (
+                        loose_file is not None
+                        and loose_file.stat().st_size == len(data)
+                        and loose_file.read_bytes() == data
+                    ):
+                        deduplicated += 1
+                        continue
+                    new_entries.append((info, data))
+
+                if optimized or deduplicated:
+                    new_pakfile = io.BytesIO()
+                    # stored, as the engine does not read compressed pakfile entries
+                    with zipfile.ZipFile(new_pakfile, "w", zipfile.ZIP_STORED) as zf:
+                        zf.comment = comment
+                        for info, data in new_entries:
+                            zf.writestr(
+                                zipfile.ZipInfo(info.filename, info.date_time), data
+                            )
+
+                    output_file = output_dir / bsp_path.relative_to(input_dir)
+                    write_bsp_pakfile(bsp_path, output_file, new_pakfile.getvalue())
+                    report_logger(
+                        "optimize_bsp_pakfiles",
+                        bsp_path,
+                        pakfile_size=len(pakfile),
+                        optimized_size=len(new_pakfile.getvalue()),
+                        optimized=len(optimized),
+                        deduplicated=deduplicated,
+                    )
+
+                processed += 1
+                if progress_window and (processed % 10 == 0 or processed == total):
+                    progress_window.update(processed, total)
+
+        return True
+    except Exception as e:
+        exception_logger(e)
+        if progress_window:
+            progress_window.error("Optimize Map Pakfiles failed with an unknown error.")
+        return False
@@ -1,114 +1,59 @@
 import hashlib
+import json
+import os
 import re
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
 from tkinter import filedialog
 from time import perf_counter
 
-from sourcepp import vpkpp
-
-from .misc import exception_logger, fop_copy
-
-
-VMT_PARAMS = (
-    "$basetexture",
-    "$basetexture2",
-    "$basetexture3",
-    "$basetexture4",
-    "$bumpmap",
-    "$bumpmap2",
-    "$ssbump",
-    "$normalmap",
-    "$normalmap2",
-    "$detail",
-    "$detail2",
-    "$lightwarptexture",
-    "$envmap",
-    "$envmapmask",
-    "$envmapmask2",
-    "$selfillummask",
-    "$phongexponenttexture",
-    "$phongwarptexture",
-    "$phongexponent2texture",
-    "$tintmasktexture",
-    "$ambientocclusiontexture",
-    "$blendmodulatetexture",
-    "$tooltexture",
-    "$fresnelrangestexture",
-    "$emissiveblendtexture",
-    "$emissiveblendbasetexture",
-    "$emissiveblendflowtexture",
-    "$fleshinteriortexture",
-    "$fleshinteriornoisetexture",
-    "$fleshbordertexture1d",
-    "$fleshcubetexture",
-    "$fleshnormaltexture",
-    "$fleshsubsurfacetexture",
-    "$displaceallowance",
-    "$parallaxmap",
-    "$masks1",
-    "$masks2",
-    "$maskstexture",
-    "$iris",
-    "$corneatexture",
-    "$fresneltexture",
-    "$warptexture",
-    "$flowmap",
-    "$blendmask",
-    "$painttexture",
-    "$detailblendmask",
-    "$reflecttexture",
-    "$refracttexture",
-    "$refracttinttexture",
-    "$bottommaterial",
-    "$underwateroverlay",
-    "$backlighttexture",
-    "$displacementmap",
-    "$ambientoccltexture",
-    "$specmasktexture",
-    "$fresnelwarptexture",
-    "$opacitytexture",
-    "$blendmap",
-    "$blendmap2",
-    "$texture2",
-    "%tooltexture",
-    "$flow_noise_texture",
-    "$paintsplatnormalmap",
-    "$paintsplatbubblelayout",
-    "$paintsplatbubble",
-    "$paintenvmap",
-    "$basenormalmap2",
-    "$basenormalmap3",
-    "$basenormalmap4",
-    "$dudvmap",
-    "$spitternoisetexture",
-    "$scenedepth",
-    "$ramptexture",
-    "$gradienttexture",
-    "$cloudalphatexture",
-    "$corecolortexture",
-    "$detail1",
-    "$detail2",
-    "$flowbounds",
-    "$masks",
-    "$selfillummap",
-    "$decaltexture",
-    "$lightmap",
-    "$compress",
-    "$stretch",
-    "$texture1",
-    "$texture3",
-    "$colorbar",
-    "$stripetexture",
+import numpy as np
+from sourcepp import vtfpp
+
+from .archives import is_archive_output
+from .asset_references import scan_model_and_map_references, scan_script_references
+from .audio_conversion import WavLayout
+from .hash_cache import HashCache
+from .keyvalues import ends_line, get_parameter_spans, splice_spans
+from .material_graph import VMT_PARAM_SET, VMT_PARAMS, MaterialGraph
+from .misc import exception_logger, fop_copy, report_logger
+from .sound_graph import (
+    LUA_STRING_REGEX,
+    SOUND_SUFFIXES,
+    is_script,
+    split_sound_reference,
 )
+from .vpk_index import VPKIndex
+
 
 VMT_REGEX = re.compile(
     r"\"?(" + "|".join(re.escape(p) for p in VMT_PARAMS) + r')\"?\s+\"([^"]+)\"',
     re.IGNORECASE,
 )
 
+HASH_DIGEST_SIZE = 16
+HASH_CHUNK_SIZE = 1024 * 1024
+PARTIAL_HASH_SIZE = 64 * 1024
+
+# smallest mip side length decoded for pixel hashes
+PIXEL_HASH_MIP_SIZE = 16
+# point sample, trilinear, clamp s/t/u, anisotropic, srgb, normal, no mip, no lod,
+# envmap, ssbump and border: the header flags which change how pixels are sampled
+SAMPLING_FLAGS = (
+    0x1 | 0x2 | 0x4 | 0x8 | 0x10 | 0x40 | 0x80 | 0x100 | 0x200 | 0x4000
+    | 0x2000000 | 0x8000000 | 0x20000000
+)
+VMT_REWRITE_CHUNK_SIZE = 32
+
+# chunks which change how a WAV plays back, unlike e.g. LIST or bext metadata
+WAV_PLAYBACK_CHUNKS = (b"fmt ", b"cue ", b"smpl")
+SOUND_REWRITE_CHUNK_SIZE = 32
+SOUND_REFERENCE_SUFFIXES = (".lua", ".txt", ".res", ".mdl")
+
 
-vpk_files = set()
+vmt_rewrites = {}
+sound_rewrites = {}
 
 
 def get_head_directories(input_dir: Path, target_dir: str) -> tuple[Path]:
@@ -144,47 +89,121 @@ def get_head_directories(input_dir: Path, target_dir: str) -> tuple[Path]:
         return tuple()
 
 
-def _hash_vtf_worker(vtf_path: Path):
+def _scan_sizes(input_dir: Path, suffix: str) -> dict:
+    sizes = {}
+    stack = [input_dir]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    stack.append(entry.path)
+                elif entry.is_file() and entry.name.lower().endswith(suffix):
+                    stat = entry.stat()
+                    sizes.setdefault(stat.st_size, []).append((Path(entry.path), stat))
+    return sizes
+
+
+def _full_hash(vtf_path: Path) -> str:
+    digest = hashlib.blake2b(digest_size=HASH_DIGEST_SIZE)
+    with open(vtf_path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _hash_kind(size: int, partial: bool) -> str:
+    # files small enough to be covered by their head and tail are hashed whole,
+    # so their partial hash is already final
+    if not partial or size <= 2 * PARTIAL_HASH_SIZE:
+        return "full"
+    return "partial"
+
+
+def _hash_vtf_worker(vtf_path: Path, size: int, partial: bool = True):
     try:
-        vtf_hash = hashlib.md5(vtf_path.read_bytes()).hexdigest()
-        return vtf_path, vtf_hash
+        if _hash_kind(size, partial) == "full":
+            return vtf_path, _full_hash(vtf_path)
+
+        digest = hashlib.blake2b(digest_size=HASH_DIGEST_SIZE)
+        with open(vtf_path, "rb") as f:
+            digest.update(f.read(PARTIAL_HASH_SIZE))
+            f.seek(-PARTIAL_HASH_SIZE, os.SEEK_END)
+            digest.update(f.read(PARTIAL_HASH_SIZE))
+        return vtf_path, digest.hexdigest()
     except Exception as e:
         return vtf_path, e
 
 
+def _group_hashes(executor, cache: HashCache, candidates: list, partial: bool) -> dict:
+    groups = {}
+    stats = {path: stat for path, stat in candidates}
+
+    futures = []
+    for path, stat in candidates:
+        kind = _hash_kind(stat.st_size, partial)
+        vtf_hash = cache.get(path, kind, stat)
+        if vtf_hash is None:
+            futures.append(executor.submit(_hash_vtf_worker, path, stat.st_size, partial))
+        else:
+            groups.setdefault((stat.st_size, vtf_hash, kind), []).append(path)
+
+    for future in as_completed(futures):
+        try:
+            vtf_path, vtf_hash = future.result()
+            if isinstance(vtf_hash, Exception):
+                raise vtf_hash
+
+            stat = stats[vtf_path]
+            kind = _hash_kind(stat.st_size, partial)
+            cache.put(vtf_path, kind, stat, vtf_hash)
+            groups.setdefault((stat.st_size, vtf_hash, kind), []).append(vtf_path)
+        except Exception as e:
+            print(f"Thread error: {e}")
+
+    return groups
+
+
 def get_duplicate_hash_vtfs(input_dir: Path) -> dict:
     """
-    Computes a dictionary of VTF filepaths and their MD5 hashes.
+    Computes a dictionary of duplicate VTF filepaths and their BLAKE2b hashes.
+
+    Files are grouped by size first, then only size collisions have the head and tail
+    of their contents hashed, and only files which still collide are hashed in full.
+    Hashes of unchanged files are reused from the persistent hash cache.
 
     :param input_dir: The absolute path of the directory to compute the duplicate hashes for.
     :type input_dir: Path
-    :return: A dictionary containing a VTF filepath keys and their MD5 hash values.
+    :return: A dictionary containing duplicate VTF filepath keys and their hash values.
     :rtype: dict
     """
     try:
-        vtf_paths = list(input_dir.rglob("*.vtf"))
-        hashes = {}
+        candidates = [
+            candidate
+            for group in _scan_sizes(input_dir, ".vtf").values()
+            if len(group) > 1
+            for candidate in group
+        ]
 
-        with ThreadPoolExecutor() as executor:
-            futures = {}
-            for path in vtf_paths:
-                vtf_hash = executor.submit(_hash_vtf_worker, path)
-                futures[vtf_hash] = path
+        stats = dict(candidates)
 
-            for future in as_completed(futures):
-                try:
-                    vtf_path, vtf_hash = future.result()
+        duplicates = {}
+        with HashCache() as cache, ThreadPoolExecutor() as executor:
+            partial_groups = _group_hashes(executor, cache, candidates, partial=True)
 
-                    if vtf_hash not in hashes:
-                        hashes[vtf_hash] = [vtf_path]
-                    else:
-                        hashes[vtf_hash].append(vtf_path)
+            full_candidates = []
+            for (_, vtf_hash, kind), paths in partial_groups.items():
+                if len(paths) < 2:
+                    continue
+                if kind == "full":
+                    for path in paths:
+                        duplicates[path] = vtf_hash
+                else:
+                    full_candidates.extend((path, stats[path]) for path in paths)
 
-                except Exception as e:
-                    print(f"Thread error: {e}")
+            full_groups = _group_hashes(executor, cache, full_candidates, partial=False)
+            cache.prune()
 
-        duplicates = {}
-        for vtf_hash, paths in hashes.items():
+        for (_, vtf_hash, _), paths in full_groups.items():
             if len(paths) > 1:
                 for path in paths:
                     duplicates[path] = vtf_hash
@@ -195,28 +214,262 @@ def get_duplicate_hash_vtfs(input_dir: Path) -> dict:
         return {}
 
 
-def get_vmt_dependencies(vmt_dir: Path) -> dict:
+class BKTree:
+    """
+    A Burkhard-Keller tree of 64-bit perceptual hashes for Hamming distance lookups.
+    """
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, phash: int, item) -> None:
+        node = (phash, item, {})
+        if self.root is None:
+            self.root = node
+            return
+
+        current = self.root
+        while True:
+            distance = (current[0] ^ phash).bit_count()
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def query(self, phash: int, max_distance: int) -> list:
+        """
+        Finds every item whose hash is within max_distance bits of phash.
+
+        :param phash: The hash to search around.
+        :type phash: int
+        :param max_distance: The maximum Hamming distance of a match.
+        :type max_distance: int
+        :return: A list of matching items.
+        :rtype: list
+        """
+
+        matches = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node_hash, item, children = stack.pop()
+            distance = (node_hash ^ phash).bit_count()
+            if distance <= max_distance:
+                matches.append(item)
+
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+
+        return matches
+
+
+def _difference_hash(rgba: np.ndarray) -> int:
+    luma = rgba[..., :3].astype(np.float64) @ np.array([0.299, 0.587, 0.114])
+    height, width = luma.shape
+
+    # box-average down to 9x8 so neighbouring columns can be compared
+    rows = np.arange(8) * height // 8
+    cols = np.arange(9) * width // 9
+    binned = np.add.reduceat(np.add.reduceat(luma, rows, axis=0), cols, axis=1)
+    counts = np.outer(np.diff(np.append(rows, height)), np.diff(np.append(cols, width)))
+    binned /= np.maximum(counts, 1)
+
+    bits = (binned[:, 1:] > binned[:, :-1]).ravel()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def _pixel_hash_worker(vtf_path: Path, full: bool = False):
+    try:
+        vtf = vtfpp.VTF(vtf_path)
+
+        mip = 0
+        if not full:
+            while (
+                mip + 1 < vtf.mip_count
+                and min(vtf.width_for_mip(mip + 1), vtf.height_for_mip(mip + 1))
+                >= PIXEL_HASH_MIP_SIZE
+            ):
+                mip += 1
+
+        digest = hashlib.blake2b(digest_size=HASH_DIGEST_SIZE)
+        for frame in range(vtf.frame_count):
+            for face in range(vtf.face_count):
+                for depth_slice in range(vtf.depth_for_mip(mip)):
+                    digest.update(
+                        vtf.get_image_data_as_rgba8888(
+                            mip=mip, frame=frame, face=face, slice=depth_slice
+                        )
+                    )
+
+        if full:
+            return vtf_path, digest.hexdigest()
+
+        rgba = np.frombuffer(
+            vtf.get_image_data_as_rgba8888(mip=mip), dtype=np.uint8
+        ).reshape(vtf.height_for_mip(mip), vtf.width_for_mip(mip), 4)
+
+        key = [
+            vtf.width,
+            vtf.height,
+            vtf.frame_count,
+            vtf.face_count,
+            vtf.depth,
+            vtf.flags & SAMPLING_FLAGS,
+            digest.hexdigest(),
+            _difference_hash(rgba),
+        ]
+        return vtf_path, json.dumps(key)
+    except Exception as e:
+        return vtf_path, e
+
+
+def _pixel_hashes(executor, cache: HashCache, candidates: list, full: bool) -> dict:
+    kind = "pixel_full" if full else "pixel"
+    results = {}
+
+    futures = []
+    for path, stat in candidates:
+        cached = cache.get(path, kind, stat)
+        if cached is None:
+            futures.append(executor.submit(_pixel_hash_worker, path, full))
+        else:
+            results[path] = cached
+
+    stats = dict(candidates)
+    for future in as_completed(futures):
+        try:
+            vtf_path, pixel_hash = future.result()
+            if isinstance(pixel_hash, Exception):
+                raise pixel_hash
+
+            cache.put(vtf_path, kind, stats[vtf_path], pixel_hash)
+            results[vtf_path] = pixel_hash
+        except Exception as e:
+            print(f"Process error: {e}")
+
+    return results
+
+
+def get_duplicate_pixel_vtfs(input_dir: Path, max_distance: int = None) -> dict:
+    """
+    Computes a dictionary of VTF filepaths which decode to the same pixels, regardless of
+    their format, version, thumbnail, reflectivity or non-sampling header flags.
+
+    Pixels are first hashed from a small mip, and only collisions are confirmed against
+    their full-resolution pixels. If max_distance is given, groups whose difference
+    hashes are within max_distance bits of each other are merged as near-duplicates.
+
+    :param input_dir: The absolute path of the directory to compute the duplicate hashes for.
+    :type input_dir: Path
+    :param max_distance: The maximum Hamming distance between two near-duplicates' 64-bit
+        perceptual hashes, or None to only find exact pixel duplicates.
+    :type max_distance: int
+    :return: A dictionary containing duplicate VTF filepath keys and their group hash
+        values, with each group's smallest file first.
+    :rtype: dict
+    """
+    try:
+        candidates = [
+            candidate for group in _scan_sizes(input_dir, ".vtf").values()
+            for candidate in group
+        ]
+        stats = dict(candidates)
+
+        with HashCache() as cache, ProcessPoolExecutor() as executor:
+            keys = {
+                path: tuple(json.loads(key))
+                for path, key in _pixel_hashes(
+                    executor, cache, candidates, full=False
+                ).items()
+            }
+
+            # everything but the perceptual hash must match for exact duplicates
+            buckets = {}
+            for path, key in keys.items():
+                buckets.setdefault(key[:-1], []).append(path)
+
+            collisions = [
+                (path, stats[path])
+                for paths in buckets.values()
+                if len(paths) > 1
+                for path in paths
+            ]
+            full_hashes = _pixel_hashes(executor, cache, collisions, full=True)
+
+        groups = {}
+        for path, key in keys.items():
+            groups.setdefault((key[:-1], full_hashes.get(path)), []).append(path)
+
+        # the smallest file of each group represents it
+        representatives = {}
+        for group_key, paths in groups.items():
+            paths.sort(key=lambda path: stats[path].st_size)
+            representatives[paths[0]] = group_key
+
+        if max_distance is not None:
+            tree = BKTree()
+            for path in representatives:
+                tree.add(keys[path][-1], path)
+
+            merged = set()
+            for path in sorted(representatives, key=lambda path: stats[path].st_size):
+                if path in merged:
+                    continue
+
+                group = groups[representatives[path]]
+                for match in tree.query(keys[path][-1], max_distance):
+                    # near-duplicates must still share dimensions and sampling flags
+                    if (
+                        match != path
+                        and match not in merged
+                        and keys[match][:6] == keys[path][:6]
+                    ):
+                        merged.add(match)
+                        group.extend(groups.pop(representatives[match]))
+
+        duplicates = {}
+        for group_key, paths in groups.items():
+            if len(paths) < 2:
+                continue
+
+            group_hash = hashlib.blake2b(
+                repr(group_key).encode(), digest_size=HASH_DIGEST_SIZE
+            ).hexdigest()
+            for path in paths:
+                duplicates[path] = group_hash
+
+        return duplicates
+    except Exception as e:
+        exception_logger(e)
+        return {}
+
+
+def get_vmt_dependencies(vmt_dir: Path, slots: bool = False) -> dict:
     """
     Computes all VMT parameters for each VMT path in the input directory.
 
     :param input_dir: The absolute path of the directory to compute the duplicate hashes for.
     :type input_dir: Path
-    :return: A dictionary containing a VMT filepath keys and their VMT parameter values.
+    :param slots: True if each value should be a (parameter, texture) tuple instead of
+        only the texture path.
+    :type slots: bool
+    :return: A dictionary containing a VMT filepath keys and their VMT parameter values,
+        as texture paths relative to materials/ without their extension.
     :rtype: dict
     """
 
     try:
+        graph = MaterialGraph.build(
+            input_dir=vmt_dir,
+            materials_roots=get_head_directories(input_dir=vmt_dir, target_dir="materials"),
+        )
+
         vmt_deps = {}
-        for vmt_path in vmt_dir.rglob("*.vmt"):
-            text = vmt_path.read_text(encoding="latin-1", errors="ignore")
-            matches = VMT_REGEX.findall(text)
-
-            for _, path in matches:
-                clean_path = path.replace("\\", "/").strip().lower()
-                if vmt_path in vmt_deps:
-                    vmt_deps[vmt_path].append(clean_path)
-                else:
-                    vmt_deps[vmt_path] = [clean_path]
+        for vmt_path in graph.materials:
+            deps = graph.dependencies(vmt_path)
+            if deps:
+                vmt_deps[vmt_path] = deps if slots else [texture for _, texture in deps]
 
         return vmt_deps
     except Exception as e:
@@ -224,8 +477,45 @@ def get_vmt_dependencies(vmt_dir: Path) -> dict:
         return {}
 
 
+def _init_rewrite_vmt_worker(rewrites: dict):
+    vmt_rewrites.clear()
+    vmt_rewrites.update(rewrites)
+
+
+def _rewrite_vmt_worker(vmt_path: Path):
+    try:
+        original = vmt_path.read_text(encoding="latin-1", errors="ignore")
+        content = original.replace("\\", "/")
+
+        replacements = []
+        for _, vtf_path, start, end in get_parameter_spans(content, VMT_PARAM_SET):
+            clean_vtf = vtf_path.strip().lower()
+
+            # as the regex loop this replaced, only quoted, unpadded values are rewritten
+            if content[start] != '"' or vtf_path != vtf_path.strip():
+                continue
+
+            if clean_vtf in vmt_rewrites:
+                new_vtf = f'"foptimizer_shared_duplicates/{vmt_rewrites[clean_vtf]}"'
+                # a trailing comment would hide anything else on a one-line VMT
+                if ends_line(content, end):
+                    new_vtf += f" // Original: {clean_vtf}"
+                replacements.append((start, end, new_vtf))
+
+        if replacements or content != original:
+            vmt_path.write_text(splice_spans(content, replacements), encoding="latin-1")
+
+        return True
+    except Exception as e:
+        return e
+
+
 def remove_duplicate_vtfs(
-    input_dir: Path, output_dir: Path, progress_window=None
+    input_dir: Path,
+    output_dir: Path,
+    pixel: bool = False,
+    max_distance: int = None,
+    progress_window=None,
 ) -> bool:
     """
     Scans for exactly identical duplicate VTF files, moves them to a shared directory,
@@ -236,6 +526,12 @@ def remove_duplicate_vtfs(
     :param output_dir: If specified, the absolute path of the
                        directory to copy the duplicate VTFs to.
     :type output_dir: Path
+    :param pixel: True if VTFs which decode to the same pixels should be treated as
+        duplicates instead of only byte-identical files.
+    :type pixel: bool
+    :param max_distance: If pixel is True, the maximum perceptual hash distance for
+        near-duplicates to also be merged, or None for exact pixel duplicates only.
+    :type max_distance: int
     :return: Whether the function completed successfully.
     :rtype: bool
     """
@@ -249,6 +545,15 @@ def remove_duplicate_vtfs(
                 )
             return False
 
+        # the input is changed in place and only removed files go to output_dir, so
+        # an archive output would hold those alone
+        if is_archive_output(output_dir):
+            if progress_window:
+                progress_window.error(
+                    "Remove Duplicate VTFs failed: Output must be a folder, not a .gma or .vpk."
+                )
+            return False
+
         materials_roots = get_head_directories(
             input_dir=input_dir, target_dir="materials"
         )
@@ -259,7 +564,12 @@ def remove_duplicate_vtfs(
                 )
             return False
 
-        duplicate_vtfs = get_duplicate_hash_vtfs(input_dir=input_dir)
+        if pixel:
+            duplicate_vtfs = get_duplicate_pixel_vtfs(
+                input_dir=input_dir, max_distance=max_distance
+            )
+        else:
+            duplicate_vtfs = get_duplicate_hash_vtfs(input_dir=input_dir)
 
         if output_dir != input_dir:
             for vtf, _ in duplicate_vtfs.items():
@@ -269,6 +579,10 @@ def remove_duplicate_vtfs(
                 fop_copy(src=vtf, dst=dst, mode=2)
             return True
 
+        graph = MaterialGraph.build(
+            input_dir=input_dir, materials_roots=materials_roots
+        )
+
         for materials_root in materials_roots:
             # standardize paths to be relative to materials_root
             duplicate_vtfs_clean = {}
@@ -299,79 +613,398 @@ def remove_duplicate_vtfs(
                         fop_copy(src=path, dst=shared_vtf, mode=2)
                     path.unlink()
 
-            # changing vtf references to shared directory
-            processed = 0
-            vmt_paths = list(materials_root.rglob("*.vmt"))
+            # changing vtf references to shared directory, only VMTs which reference a
+            # duplicate or contain backslashes to normalize need to be rewritten
+            vmt_paths = [
+                vmt_path
+                for vmt_path, entry in graph.materials.items()
+                if vmt_path.is_relative_to(materials_root)
+                and (
+                    entry["backslash"]
+                    or any(
+                        texture in duplicate_vtfs_clean
+                        for _, texture in entry["textures"]
+                    )
+                )
+            ]
             total = len(vmt_paths)
-            for vmt_path in vmt_paths:
-                content = vmt_path.read_text(
-                    encoding="latin-1", errors="ignore"
-                ).replace("\\", "/")
-                modified = False
-                matches = VMT_REGEX.findall(content)
-
-                for _, vtf_path in matches:
-                    clean_vtf = vtf_path.strip().lower()
-
-                    if clean_vtf in duplicate_vtfs_clean:
-                        new_vtf = f"foptimizer_shared_duplicates/{duplicate_vtfs_clean[clean_vtf]}"
-
-                        pattern = re.compile(f'"{re.escape(clean_vtf)}"', re.IGNORECASE)
-
-                        if pattern.search(content):
-                            content = pattern.sub(
-                                f'"{new_vtf}" // Original: {clean_vtf}',
-                                content,
-                                count=1,
-                            )
-                            modified = True
-
-                if modified or "\\" in vmt_path.read_text(
-                    encoding="latin-1", errors="ignore"
+
+            with ProcessPoolExecutor(
+                initializer=_init_rewrite_vmt_worker, initargs=(duplicate_vtfs_clean,)
+            ) as executor:
+                results = executor.map(
+                    _rewrite_vmt_worker, vmt_paths, chunksize=VMT_REWRITE_CHUNK_SIZE
+                )
+                for processed, (vmt_path, result) in enumerate(
+                    zip(vmt_paths, results), 1
                 ):
-                    vmt_path.write_text(content, encoding="latin-1")
+                    if isinstance(result, Exception):
+                        print(f"Error processing {vmt_path.name}: {result}")
+
+                    if progress_window and (processed % 10 == 0 or processed == total):
+                        progress_window.update(processed, total)
+
+        return True
+    except Exception as e:
+        exception_logger(e)
+        if progress_window:
+            progress_window.error("Remove Duplicate VTFs failed with an unknown error.")
+        return False
+
+
+def _sound_bucket_worker(sound_path: Path, size: int):
+    try:
+        if sound_path.suffix.lower() == ".wav":
+            try:
+                with open(sound_path, "rb") as wav_file:
+                    layout = WavLayout(wav_file)
+                return sound_path, ("wav", layout.chunk(b"data")[2])
+            except ValueError:
+                # e.g. ADPCM, which is compared byte for byte
+                pass
+        return sound_path, (sound_path.suffix.lower(), size)
+    except Exception as e:
+        return sound_path, e
+
+
+def _sound_hash_worker(sound_path: Path):
+    try:
+        if sound_path.suffix.lower() != ".wav":
+            return sound_path, _full_hash(sound_path)
+
+        digest = hashlib.blake2b(digest_size=HASH_DIGEST_SIZE)
+        with open(sound_path, "rb") as wav_file:
+            try:
+                layout = WavLayout(wav_file)
+            except ValueError:
+                return sound_path, _full_hash(sound_path)
+
+            for chunk_id in WAV_PLAYBACK_CHUNKS + (b"data",):
+                chunk = layout.chunk(chunk_id)
+                if chunk is None:
+                    continue
+
+                digest.update(chunk_id + chunk[2].to_bytes(4, "little"))
+                wav_file.seek(chunk[1])
+                remaining = chunk[2]
+                while remaining and (block := wav_file.read(min(remaining, HASH_CHUNK_SIZE))):
+                    digest.update(block)
+                    remaining -= len(block)
+        return sound_path, digest.hexdigest()
+    except Exception as e:
+        return sound_path, e
+
+
+def get_duplicate_sounds(input_dir: Path) -> dict:
+    """
+    Computes a dictionary of duplicate sound filepaths and their BLAKE2b hashes.
+
+    Sounds are grouped by extension and payload size first, then only collisions are
+    hashed. WAVs are compared by their samples, format and loop points, so copies which
+    only differ in metadata chunks, e.g. LIST or bext, are still duplicates. Hashes of
+    unchanged files are reused from the persistent hash cache.
+
+    :param input_dir: The absolute path of the directory to compute the duplicate hashes for.
+    :type input_dir: Path
+    :return: A dictionary containing duplicate sound filepath keys and their hash values,
+        with each group's smallest file first.
+    :rtype: dict
+    """
+    try:
+        sounds = [
+            candidate
+            for suffix in SOUND_SUFFIXES
+            for group in _scan_sizes(input_dir, suffix).values()
+            for candidate in group
+        ]
+        stats = dict(sounds)
+
+        with HashCache() as cache, ThreadPoolExecutor() as executor:
+            buckets = {}
+            for sound_path, key in executor.map(
+                lambda sound: _sound_bucket_worker(sound[0], sound[1].st_size), sounds
+            ):
+                if isinstance(key, Exception):
+                    exception_logger(key)
+                    continue
+                buckets.setdefault(key, []).append(sound_path)
+
+            groups = {}
+            futures = []
+            for paths in buckets.values():
+                if len(paths) < 2:
+                    continue
+                for path in paths:
+                    sound_hash = cache.get(path, "sound", stats[path])
+                    if sound_hash is None:
+                        futures.append(executor.submit(_sound_hash_worker, path))
+                    else:
+                        groups.setdefault((path.suffix.lower(), sound_hash), []).append(path)
+
+            for future in as_completed(futures):
+                sound_path, sound_hash = future.result()
+                if isinstance(sound_hash, Exception):
+                    exception_logger(sound_hash)
+                    continue
+
+                cache.put(sound_path, "sound", stats[sound_path], sound_hash)
+                groups.setdefault((sound_path.suffix.lower(), sound_hash), []).append(
+                    sound_path
+                )
+            cache.prune()
+
+        duplicates = {}
+        for (_, sound_hash), paths in groups.items():
+            if len(paths) < 2:
+                continue
+            for path in sorted(paths, key=lambda path: (stats[path].st_size, path)):
+                duplicates[path] = sound_hash
+
+        return duplicates
+    except Exception as e:
+        exception_logger(e)
+        return {}
+
+
+def _init_rewrite_sound_worker(rewrites: dict):
+    sound_rewrites.clear()
+    sound_rewrites.update(rewrites)
+
+
+def _rewrite_sound_worker(script_path: Path):
+    try:
+        content = script_path.read_text(encoding="latin-1")
+
+        replacements = []
+        if script_path.suffix.lower() == ".lua":
+            # only string literals which are a whole sound path are safe to replace
+            for match in LUA_STRING_REGEX.finditer(content):
+                group = 1 if match.group(1) is not None else 2
+                prefix, key = split_sound_reference(match.group(group))
+                if key in sound_rewrites:
+                    replacements.append(
+                        (match.start(group), match.end(group), prefix + sound_rewrites[key])
+                    )
+        else:
+            for _, value, start, end in get_parameter_spans(content, {"wave"}):
+                prefix, key = split_sound_reference(value)
+                if key in sound_rewrites:
+                    replacements.append((start, end, f'"{prefix}{sound_rewrites[key]}"'))
+
+        if replacements:
+            script_path.write_text(splice_spans(content, replacements), encoding="latin-1")
+
+        return len(replacements)
+    except Exception as e:
+        return e
+
+
+def remove_duplicate_sounds(
+    input_dir: Path,
+    output_dir: Path,
+    progress_window=None,
+) -> bool:
+    """
+    Scans for duplicate sound files, moves them to a shared directory, removes the
+    originals, and redirects soundscript waves and Lua string literals to the shared
+    copies. Duplicates still mentioned anywhere that could not be rewritten, e.g. in a
+    built Lua string, a map's entities or a model's events, are kept and reported.
+
+    :param input_dir: The absolute path of the directory to remove the duplicate sounds from.
+    :type input_dir: Path
+    :param output_dir: If specified, the absolute path of the
+                       directory to copy the duplicate sounds to.
+    :type output_dir: Path
+    :return: Whether the function completed successfully.
+    :rtype: bool
+    """
+
+    try:
+        if not input_dir.is_dir():
+            if progress_window:
+                progress_window.error(
+                    "Remove Duplicate Sounds failed: "
+                    "Input folder was not a folder, or does not exist."
+                )
+            return False
+
+        # the input is changed in place and only removed files go to output_dir, so
+        # an archive output would hold those alone
+        if is_archive_output(output_dir):
+            if progress_window:
+                progress_window.error(
+                    "Remove Duplicate Sounds failed: Output must be a folder, not a .gma or .vpk."
+                )
+            return False
+
+        sound_roots = get_head_directories(input_dir=input_dir, target_dir="sound")
+        if not sound_roots:
+            if progress_window:
+                progress_window.error(
+                    "Remove Duplicate Sounds failed: No 'sound/' subfolders found in input folder."
+                )
+            return False
+
+        duplicate_sounds = {
+            path: sound_hash
+            for path, sound_hash in get_duplicate_sounds(input_dir=input_dir).items()
+            if any(path.is_relative_to(sound_root) for sound_root in sound_roots)
+        }
+
+        if output_dir != input_dir:
+            for sound in duplicate_sounds:
+                rel_path = sound.relative_to(input_dir)
+                dst = output_dir / rel_path
+                dst.parent.mkdir(parents=True, exist_ok=True)
+                fop_copy(src=sound, dst=dst, mode=2)
+            return True
+
+        # sound keys relative to sound/ and their shared replacements
+        rewrites = {}
+        for path, sound_hash in duplicate_sounds.items():
+            sound_root = next(root for root in sound_roots if path.is_relative_to(root))
+            key = path.relative_to(sound_root).as_posix().lower()
+            rewrites[key] = (
+                f"foptimizer_shared_duplicates/{sound_hash}{path.suffix.lower()}"
+            )
+
+        script_paths = [
+            path
+            for path in input_dir.rglob("*")
+            if path.is_file()
+            and (path.suffix.lower() == ".lua" or is_script(path, input_dir))
+        ]
+        total = len(script_paths)
+
+        with ProcessPoolExecutor(
+            initializer=_init_rewrite_sound_worker, initargs=(rewrites,)
+        ) as executor:
+            results = executor.map(
+                _rewrite_sound_worker, script_paths, chunksize=SOUND_REWRITE_CHUNK_SIZE
+            )
+            for processed, (script_path, result) in enumerate(
+                zip(script_paths, results), 1
+            ):
+                if isinstance(result, Exception):
+                    print(f"Error processing {script_path.name}: {result}")
+                elif result:
+                    report_logger(
+                        "remove_duplicate_sounds", script_path, rewritten=result
+                    )
 
-                processed += 1
                 if progress_window and (processed % 10 == 0 or processed == total):
                     progress_window.update(processed, total)
 
+        # whatever still mentions a duplicate's old path could not be rewritten
+        unresolved = scan_script_references(
+            input_dir, rewrites, suffixes=SOUND_REFERENCE_SUFFIXES, locate=True
+        )
+        for map_path, references in scan_model_and_map_references(input_dir).items():
+            for _, value in references["entities"]:
+                _, key = split_sound_reference(value)
+                if key in rewrites:
+                    unresolved.setdefault(key, []).append(map_path)
+
+        for path, sound_hash in duplicate_sounds.items():
+            sound_root = next(root for root in sound_roots if path.is_relative_to(root))
+            key = path.relative_to(sound_root).as_posix().lower()
+
+            shared_sound = sound_root / rewrites[key]
+            if path == shared_sound:
+                continue
+            if not shared_sound.exists():
+                shared_sound.parent.mkdir(parents=True, exist_ok=True)
+                fop_copy(src=path, dst=shared_sound, mode=2)
+
+            if key in unresolved:
+                report_logger(
+                    "remove_duplicate_sounds",
+                    path,
+                    kept=True,
+                    unrewritten_references=sorted(map(str, unresolved[key])),
+                )
+            else:
+                path.unlink()
+
         return True
     except Exception as e:
         exception_logger(e)
         if progress_window:
-            progress_window.error("Remove Duplicate VTFs failed with an unknown error.")
+            progress_window.error("Remove Duplicate Sounds failed with an unknown error.")
         return False
 
 
-def _remove_vpk_files_worker(f_path: Path, input_dir: Path, output_dir: Path):
+def _crc32_file(path: Path) -> int:
+    crc = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def _remove_vpk_files_worker(
+    f_path: Path, input_dir: Path, output_dir: Path, index: VPKIndex
+):
     try:
         if not f_path.is_file():
             return None
 
         rel_path = f_path.relative_to(input_dir)
-        match_found = False
+        contents = index.contents(Path(str(rel_path).lower()).parts)
+        if not contents:
+            return True
 
-        for i in range(len(rel_path.parts)):
-            suffix_path = "/".join(rel_path.parts[i:]).lower()
-            if suffix_path in vpk_files:
-                match_found = True
-                break
+        # only files identical to a packed file are base content, the rest are
+        # deliberate overrides
+        size = f_path.stat().st_size
+        if size not in {length for _, length in contents}:
+            return True
+        if (_crc32_file(f_path), size) not in contents:
+            return True
 
-        if match_found:
-            if output_dir != input_dir:
-                dst = output_dir / rel_path
-                dst.parent.mkdir(parents=True, exist_ok=True)
-                fop_copy(src=f_path, dst=dst, mode=1)
-            else:
-                f_path.unlink()
+        if output_dir != input_dir:
+            dst = output_dir / rel_path
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            fop_copy(src=f_path, dst=dst, mode=1)
+        else:
+            f_path.unlink()
         return True
     except Exception as e:
         return e
 
 
+def _ask_vpk_dirs() -> list[Path]:
+    vpk_dirs = []
+    title = "Select Game Directory"
+    while vpk_dir := filedialog.askdirectory(title=title):
+        vpk_dirs.append(Path(vpk_dir))
+        title = "Select Another Game Directory to Mount (Cancel to Finish)"
+    return vpk_dirs
+
+
 def remove_vpk_files(
-    input_dir: Path, output_dir: Path, vpk_dir: Path = None, progress_window=None
-):
+    input_dir: Path,
+    output_dir: Path,
+    vpk_dirs: list[Path] = None,
+    progress_window=None,
+) -> bool:
+    """
+    Removes files which are identical to files already packed in the VPKs of one or
+    more mounted games, e.g. HL2, EP2, CSS and TF2 together. A file only counts as
+    identical when its size and CRC32 match the packed entry.
+
+    :param input_dir: The directory to remove base game content from.
+    :type input_dir: Path
+    :param output_dir: The directory to copy base game content to, or input_dir to
+        delete it instead.
+    :type output_dir: Path
+    :param vpk_dirs: The game directories to search for *_dir.vpk files. If None, the
+        user is asked to select them.
+    :type vpk_dirs: list[Path]
+    :return: Whether the function completed successfully.
+    :rtype: bool
+    """
+
     try:
         if not input_dir.is_dir():
             if progress_window:
@@ -381,25 +1014,30 @@ def remove_vpk_files(
                 )
             return False
 
-        if not vpk_dir:
-            vpk_dir = filedialog.askdirectory(title="Select Game Directory")
-            if not vpk_dir:
+        # the input is changed in place and only removed files go to output_dir, so
+        # an archive output would hold those alone
+        if is_archive_output(output_dir):
+            if progress_window:
+                progress_window.error(
+                    "Remove VPK files failed: Output must be a folder, not a .gma or .vpk."
+                )
+            return False
+
+        if not vpk_dirs:
+            vpk_dirs = _ask_vpk_dirs()
+            if not vpk_dirs:
                 if progress_window:
                     progress_window.error(
                         "Remove VPK files failed: No game folder was selected by the user."
                     )
                 return False
 
-        vpk_dir = Path(vpk_dir)
-
-        vpk_files.clear()
-        for vpk_file in vpk_dir.rglob("*_dir.vpk"):
-            vpkpp.VPK.open(
-                str(vpk_file),
-                lambda path, _: vpk_files.add(path.lower().replace("\\", "/")),
-            )
-
-        if not vpk_files:
+        vpk_paths = [
+            vpk_path
+            for vpk_dir in vpk_dirs
+            for vpk_path in Path(vpk_dir).rglob("*_dir.vpk")
+        ]
+        if not vpk_paths:
             if progress_window:
                 progress_window.error(
                     "Remove VPK files failed: No VPKs were found in the game directory."
@@ -409,11 +1047,11 @@ def remove_vpk_files(
         all_files = [f for f in input_dir.rglob("*") if f.is_file()]
         total = len(all_files)
 
-        with ThreadPoolExecutor() as executor:
+        with VPKIndex.load(vpk_paths) as index, ThreadPoolExecutor() as executor:
             futures = {}
             for f in all_files:
                 future = executor.submit(
-                    _remove_vpk_files_worker, f, input_dir, output_dir
+                    _remove_vpk_files_worker, f, input_dir, output_dir, index
                 )
                 futures[future] = f
 
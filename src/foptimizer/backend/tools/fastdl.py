@@ -0,0 +1,300 @@
+import bz2
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from .archives import is_archive_output
+from .asset_references import scan_model_and_map_references, scan_script_references
+from .deduplication import get_head_directories
+from .hash_cache import HashCache
+from .material_graph import MaterialGraph
+from .misc import exception_logger, report_logger
+from .remove_redundancies import get_used_materials, get_used_sounds
+from .sound_graph import SOUND_SUFFIXES
+
+
+# the folders clients download content from
+FASTDL_DIRS = ("maps", "materials", "models", "particles", "resource", "sound")
+FASTDL_MANIFEST_NAME = ".fastdl_manifest.json"
+FASTDL_MANIFEST_VERSION = 1
+RESOURCE_LIST_NAME = "fastdl_resources.lua"
+
+HASH_DIGEST_SIZE = 16
+# read and fed to the compressor at a time, so large files are never held whole
+COMPRESS_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def _hash_file(path: Path) -> str:
+    digest = hashlib.blake2b(digest_size=HASH_DIGEST_SIZE)
+    with open(path, "rb") as f:
+        while chunk := f.read(COMPRESS_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _compress_worker(src: Path, dst: Path, src_hash: str | None, current_hash: str | None):
+    try:
+        if src_hash is None:
+            src_hash = _hash_file(src)
+        if src_hash == current_hash and dst.is_file():
+            return src, src_hash, None
+
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        temp_dst = dst.with_name(dst.name + ".tmp")
+        # a single stream, as the engine's decompressor stops after the first one
+        compressor = bz2.BZ2Compressor(9)
+        with open(src, "rb") as f_in, open(temp_dst, "wb") as f_out:
+            while chunk := f_in.read(COMPRESS_CHUNK_SIZE):
+                f_out.write(compressor.compress(chunk))
+            f_out.write(compressor.flush())
+        os.replace(temp_dst, dst)
+
+        return src, src_hash, dst.stat().st_size
+    except Exception as e:
+        return src, e, None
+
+
+def get_content_files(input_dir: Path) -> dict:
+    """
+    Finds every file clients can download, i.e. those inside the maps, materials,
+    models, particles, resource and sound folders of every content root in a
+    directory tree.
+
+    :param input_dir: The directory to search.
+    :type input_dir: Path
+    :return: A dictionary of file paths and their paths relative to their content root,
+        e.g. "materials/models/crate.vtf".
+    :rtype: dict
+    """
+
+    files = {}
+    for content_dir in FASTDL_DIRS:
+        for head in get_head_directories(input_dir=input_dir, target_dir=content_dir):
+            # e.g. materials/models/ is not a models folder of its own
+            parents = head.relative_to(input_dir).parts[:-1]
+            if any(part.lower() in FASTDL_DIRS for part in parents):
+                continue
+
+            for path in head.rglob("*"):
+                if path.is_file() and path.suffix.lower() != ".bz2":
+                    files[path] = path.relative_to(head.parent).as_posix()
+    return files
+
+
+def get_resource_files(input_dir: Path, files: dict) -> list[str]:
+    """
+    Computes the resource.AddFile list of a directory tree: the models referenced by a
+    map or script, the materials and textures those models, the maps and scripts use,
+    every used sound, and all particles and resource files. Maps themselves are sent by
+    the server, and a model or material already sends its same-named companion files.
+
+    :param input_dir: The directory to list the referenced files of.
+    :type input_dir: Path
+    :param files: The content files of input_dir, from get_content_files.
+    :type files: dict
+    :return: The sorted relative paths to pass to resource.AddFile.
+    :rtype: list
+    """
+
+    keys = {path: rel_path.lower() for path, rel_path in files.items()}
+    references = scan_model_and_map_references(input_dir)
+
+    model_keys = {key for key in keys.values() if key.endswith(".mdl")}
+    used_models = {
+        model for file_references in references.values()
+        for model in file_references["models"]
+    }
+    used_models.update(scan_script_references(input_dir, model_keys - used_models))
+
+    # only the materials of used models are needed
+    used_references = {
+        path: file_references
+        for path, file_references in references.items()
+        if path.suffix.lower() == ".bsp" or keys.get(path) in used_models
+    }
+    graph = MaterialGraph.build(
+        input_dir=input_dir,
+        materials_roots=get_head_directories(input_dir=input_dir, target_dir="materials"),
+    )
+    used_vmts, used_vtfs, _ = get_used_materials(input_dir, graph, used_references)
+
+    sound_keys = {
+        path: key.removeprefix("sound/")
+        for path, key in keys.items()
+        if key.startswith("sound/") and path.suffix.lower() in SOUND_SUFFIXES
+    }
+    used_sounds = get_used_sounds(input_dir, sound_keys.values()) or set()
+
+    resources = set()
+    vmt_keys = set()
+    for path, rel_path in files.items():
+        key = keys[path]
+        if key.startswith(("particles/", "resource/")):
+            resources.add(rel_path)
+        elif key in used_models:
+            resources.add(rel_path)
+        elif path in used_vmts:
+            resources.add(rel_path)
+            vmt_keys.add(key.removesuffix(".vmt"))
+        elif path in sound_keys and sound_keys[path] in used_sounds:
+            resources.add(rel_path)
+
+    for path, rel_path in files.items():
+        key = keys[path]
+        if (
+            path.suffix.lower() == ".vtf"
+            and graph.relative_key(path) in used_vtfs
+            and key.removesuffix(".vtf") not in vmt_keys
+        ):
+            resources.add(rel_path)
+
+    return sorted(resources)
+
+
+def build_fastdl(input_dir: Path, output_dir: Path, progress_window=None) -> bool:
+    """
+    Mirrors a directory tree's downloadable content to output_dir as bzip2 files in
+    parallel, and writes a resource.AddFile list of only its referenced files. Files
+    whose content hash matches the one they were last compressed from are skipped.
+    When content roots share a file path, only the first is mirrored and the others
+    are listed in report.log.
+
+    :param input_dir: The directory of the content to serve.
+    :type input_dir: Path
+    :param output_dir: The directory of the FastDL mirror. If it is input_dir, each
+        .bz2 file is written beside its source.
+    :type output_dir: Path
+    :return: Whether the function completed successfully.
+    :rtype: bool
+    """
+
+    try:
+        if not input_dir.is_dir():
+            if progress_window:
+                progress_window.error(
+                    "Build FastDL failed: Input folder was not a folder, or does not exist."
+                )
+            return False
+
+        if is_archive_output(output_dir):
+            if progress_window:
+                progress_window.error(
+                    "Build FastDL failed: Output must be a folder, not a .gma or .vpk."
+                )
+            return False
+
+        files = get_content_files(input_dir)
+        if not files:
+            if progress_window:
+                progress_window.error(
+                    "Build FastDL failed: No content folders, e.g. 'materials/', found."
+                )
+            return False
+
+        output_dir.mkdir(parents=True, exist_ok=True)
+        manifest_path = output_dir / FASTDL_MANIFEST_NAME
+        manifest = {}
+        try:
+            if manifest_path.is_file():
+                data = json.loads(manifest_path.read_text(encoding="utf-8"))
+                if data.get("version") == FASTDL_MANIFEST_VERSION:
+                    manifest = data["files"]
+        except Exception as e:
+            exception_logger(e)
+
+        # the mirror is laid out like a content root, unless .bz2 files go beside sources
+        if output_dir == input_dir:
+            mirror_paths = {
+                path: path.relative_to(input_dir).as_posix() for path in files
+            }
+        else:
+            mirror_paths = dict(files)
+
+            # content roots sharing a path would write the same .bz2, so only the
+            # first is mirrored and the others are reported
+            owners = {}
+            for path in sorted(files):
+                key = files[path].lower()
+                if key in owners:
+                    report_logger(
+                        "build_fastdl",
+                        path,
+                        collides_with=str(owners[key]),
+                        mirrored=False,
+                    )
+                    del mirror_paths[path]
+                else:
+                    owners[key] = path
+
+        total = len(mirror_paths)
+        processed = 0
+        # the largest files start first, so one does not hold up the end of the run
+        ordered = sorted(
+            mirror_paths, key=lambda path: path.stat().st_size, reverse=True
+        )
+
+        with HashCache() as cache, ProcessPoolExecutor() as executor:
+            futures = []
+            for path in ordered:
+                rel_path = mirror_paths[path]
+                dst = output_dir / f"{rel_path}.bz2"
+                src_hash = cache.get(path, "full", path.stat())
+                if src_hash is not None and src_hash == manifest.get(rel_path):
+                    if dst.is_file():
+                        processed += 1
+                        continue
+
+                futures.append(
+                    executor.submit(
+                        _compress_worker, path, dst, src_hash, manifest.get(rel_path)
+                    )
+                )
+
+            for future in as_completed(futures):
+                src, src_hash, size = future.result()
+                if isinstance(src_hash, Exception):
+                    exception_logger(src_hash)
+                else:
+                    cache.put(src, "full", src.stat(), src_hash)
+                    manifest[mirror_paths[src]] = src_hash
+                    if size is not None:
+                        report_logger(
+                            "build_fastdl",
+                            src,
+                            size=src.stat().st_size,
+                            compressed_size=size,
+                        )
+
+                processed += 1
+                if progress_window and (processed % 10 == 0 or processed == total):
+                    progress_window.update(processed, total)
+
+        # compressed copies of files which no longer exist are removed
+        current = set(mirror_paths.values())
+        for rel_path in [rel_path for rel_path in manifest if rel_path not in current]:
+            (output_dir / f"{rel_path}.bz2").unlink(missing_ok=True)
+            del manifest[rel_path]
+
+        temp_path = manifest_path.with_name(manifest_path.name + ".tmp")
+        temp_path.write_text(
+            json.dumps({"version": FASTDL_MANIFEST_VERSION, "files": manifest}),
+            encoding="utf-8",
+        )
+        os.replace(temp_path, manifest_path)
+
+        resources = get_resource_files(input_dir, files)
+        (output_dir / RESOURCE_LIST_NAME).write_text(
+            "".join(f'resource.AddFile("{rel_path}")\n' for rel_path in resources),
+            encoding="utf-8",
+        )
+
+        if progress_window:
+            progress_window.update(total, total)
+        return True
+    except Exception as e:
+        exception_logger(e)
+        if progress_window:
+            progress_window.error("Build FastDL failed with an unknown error.")
+        return False
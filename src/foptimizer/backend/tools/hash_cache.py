@@ -0,0 +1,138 @@
+import os
+import sqlite3
+import sys
+from pathlib import Path
+
+from .misc import exception_logger
+
+
+HASH_CACHE_PATH = Path("hash_cache.sqlite3")
+
+
+class HashCache:
+    """
+    A persistent store of content hashes, keyed by path and hash kind, which are only
+    trusted while a file's size, modification time and inode are unchanged. The inode
+    is not compared on Windows.
+    """
+
+    def __init__(self, db_path: Path = HASH_CACHE_PATH):
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            "path TEXT NOT NULL, kind TEXT NOT NULL, size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, inode INTEGER NOT NULL, digest TEXT NOT NULL, "
+            "PRIMARY KEY (path, kind))"
+        )
+
+        self.entries = {
+            (path, kind): (size, mtime_ns, inode, digest)
+            for path, kind, size, mtime_ns, inode, digest in self.connection.execute(
+                "SELECT path, kind, size, mtime_ns, inode, digest FROM hashes"
+            )
+        }
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @staticmethod
+    def _key(path: Path) -> str:
+        return os.path.abspath(path)
+
+    @staticmethod
+    def _signature(stat: os.stat_result) -> tuple[int, int, int]:
+        # DirEntry.stat() leaves st_ino as 0 on Windows while Path.stat() does not, so
+        # the inode is left out there for both kinds of stat to match the same entry
+        inode = 0 if sys.platform == "win32" else stat.st_ino
+        return stat.st_size, stat.st_mtime_ns, inode
+
+    def get(self, path: Path, kind: str, stat: os.stat_result) -> str | None:
+        """
+        Looks up the cached hash of a file.
+
+        :param path: The path of the file.
+        :type path: Path
+        :param kind: The kind of hash, e.g. "full" or "partial".
+        :type kind: str
+        :param stat: The current stat result of the file.
+        :type stat: os.stat_result
+        :return: The cached digest, or None if missing or the file has changed.
+        :rtype: str | None
+        """
+
+        entry = self.entries.get((self._key(path), kind))
+        if entry is None:
+            return None
+
+        size, mtime_ns, inode, digest = entry
+        if (size, mtime_ns, inode) != self._signature(stat):
+            return None
+        return digest
+
+    def put(self, path: Path, kind: str, stat: os.stat_result, digest: str) -> None:
+        """
+        Stores the hash of a file, replacing any previous hash of the same kind.
+
+        :param path: The path of the file.
+        :type path: Path
+        :param kind: The kind of hash, e.g. "full" or "partial".
+        :type kind: str
+        :param stat: The stat result of the file the hash was computed from.
+        :type stat: os.stat_result
+        :param digest: The hash to store.
+        :type digest: str
+        """
+
+        key = self._key(path)
+        entry = (*self._signature(stat), digest)
+        self.entries[(key, kind)] = entry
+        self.pending.append((key, kind, *entry))
+
+    def prune(self) -> int:
+        """
+        Removes the hashes of files which no longer exist and compacts the store.
+
+        :return: The number of removed paths.
+        :rtype: int
+        """
+
+        self.flush()
+
+        stale = {path for path, _ in self.entries if not os.path.exists(path)}
+        if stale:
+            self.connection.executemany(
+                "DELETE FROM hashes WHERE path = ?", ((path,) for path in stale)
+            )
+            self.connection.commit()
+            self.connection.execute("VACUUM")
+            self.entries = {
+                key: entry for key, entry in self.entries.items() if key[0] not in stale
+            }
+
+        return len(stale)
+
+    def flush(self) -> None:
+        """
+        Writes all stored hashes to disk.
+        """
+
+        if self.pending:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO hashes "
+                "(path, kind, size, mtime_ns, inode, digest) VALUES (?, ?, ?, ?, ?, ?)",
+                self.pending,
+            )
+            self.connection.commit()
+            self.pending = []
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        except Exception as e:
+            exception_logger(e)
+        finally:
+            self.connection.close()
@@ -1,12 +1,19 @@
-import io
+import os
+import shutil
+import struct
 import subprocess
 import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
 import numpy as np
 from sourcepp import vtfpp
 
-from .misc import exception_logger, fop_copy
+from .deduplication import get_head_directories
+from .material_graph import MaterialGraph
+from .misc import SUBPROCESS_FLAGS, exception_logger, fop_copy, report_logger
+from .png_recompress import recompress_png
 
 if getattr(sys, "frozen", False):
     BASE_DIR = Path(sys.executable).parent
@@ -20,17 +27,163 @@ FOPTIMIZER_SHRINK_INDEX = 20
 SUPPORTED_FORMATS = (
     ("DXT5", "DXT3", "DXT1_ONE_BIT_ALPHA"),
     ("BGRA8888", "RGBA8888", "ABGR8888", "ARGB8888", "BGRX8888"),
+    ("BGR888", "RGB888"),
 )
 
+VTF_HEADER = struct.Struct("<4s2I I 2H I 2H 4x 3f 4x f i B i 2B H")
+VTF_ENVMAP_FLAG = 0x4000
+# decoded RGBA copies a VTF worker may hold at once (raw, RGBA8888, converted)
+VTF_WORKER_COPIES = 3
+FILE_MEMORY_FACTOR = 4
+
+LOSSY_MIN_SSIM = 0.98
+LOSSY_MIN_PSNR = 40.0
+METRIC_SIZE = 256
+METRIC_BLOCK = 8
+
+ALPHA_AWARE_SHADERS = (
+    "lightmappedgeneric",
+    "vertexlitgeneric",
+    "unlitgeneric",
+    "worldvertextransition",
+)
+
+# parameters which make the shaders above read the alpha channel of a texture slot,
+# textures in any other slot (or under any other shader) always have their alpha kept
+ALPHA_READERS = {
+    "$basetexture": (
+        "$translucent",
+        "$alphatest",
+        "$additive",
+        "$vertexalpha",
+        "$decal",
+        "$distancealpha",
+        "$selfillum",
+        "$basealphaenvmapmask",
+        "$basemapalphaphongmask",
+        "$blendtintbybasealpha",
+        "$desaturatewithbasealpha",
+    ),
+    "$bumpmap": ("$normalmapalphaenvmapmask", "$phong"),
+    "$normalmap": ("$normalmapalphaenvmapmask", "$phong"),
+}
+
+# layout: (bytes per pixel, (r, g, b) byte indices, alpha byte index)
+GRAYSCALE_LAYOUTS = {
+    "BGRA8888": (4, (2, 1, 0), 3),
+    "RGBA8888": (4, (0, 1, 2), 3),
+    "ABGR8888": (4, (3, 2, 1), 0),
+    "ARGB8888": (4, (1, 2, 3), 0),
+    "BGRX8888": (4, (2, 1, 0), None),
+    "BGR888": (3, (2, 1, 0), None),
+    "RGB888": (3, (0, 1, 2), None),
+}
+
+
+def estimate_file_memory(input_file: Path) -> int:
+    """
+    Estimates the peak memory a worker needs to process a file from its size.
+
+    :param input_file: The path of the file to estimate for.
+    :type input_file: Path
+    :return: The estimated peak memory in bytes.
+    :rtype: int
+    """
 
-def fit_alpha(input_file: Path, output_file: Path, lossless: bool) -> bool:
+    try:
+        return input_file.stat().st_size * FILE_MEMORY_FACTOR
+    except OSError:
+        return 0
+
+
+def estimate_entry_memory(length: int) -> int:
+    """
+    Estimates the peak memory a worker needs to process an archive entry from its length.
+
+    :param length: The length of the entry in bytes.
+    :type length: int
+    :return: The estimated peak memory in bytes.
+    :rtype: int
+    """
+
+    # the entry is held in memory as well as processed
+    return length * (FILE_MEMORY_FACTOR + 1)
+
+
+def estimate_vtf_entry_memory(length: int) -> int:
+    """
+    Estimates the peak memory a worker needs to process an archived VTF image from its
+    length alone, as its header cannot be read without reading the whole entry. Assumes
+    the worst case of DXT1, which packs the most pixels into each byte.
+
+    :param length: The length of the entry in bytes.
+    :type length: int
+    :return: The estimated peak memory in bytes.
+    :rtype: int
+    """
+
+    # DXT1 is half a byte per pixel, and mips add a third to the top mip
+    pixels = length * 2 * 3 // 4
+    rgba_bytes = pixels * 4 * 4 // 3
+    normal_bytes = pixels * 4 * 8 * 2
+
+    return rgba_bytes * VTF_WORKER_COPIES + normal_bytes + length
+
+
+def estimate_vtf_memory(input_file: Path) -> int:
+    """
+    Estimates the peak memory a worker needs to process a VTF image from the dimensions,
+    frames, faces and depth in its header, without loading its image data.
+
+    :param input_file: The path of the VTF to estimate for.
+    :type input_file: Path
+    :return: The estimated peak memory in bytes.
+    :rtype: int
+    """
+
+    try:
+        with open(input_file, "rb") as f:
+            header = f.read(VTF_HEADER.size)
+
+        if len(header) < VTF_HEADER.size or header[:4] != b"VTF\x00":
+            return estimate_file_memory(input_file)
+
+        fields = VTF_HEADER.unpack(header)
+        minor_version = fields[2]
+        width, height, flags, frames = fields[4], fields[5], fields[6], fields[7]
+        depth = fields[-1] if minor_version >= 2 else 1
+        faces = 6 if flags & VTF_ENVMAP_FLAG else 1
+
+        pixels = width * height
+        # every mip adds up to a third of the top mip
+        rgba_bytes = pixels * max(1, frames) * faces * max(1, depth) * 4 * 4 // 3
+        # is_normal_vtf expands one frame to float64 RGBA, plus a temporary
+        normal_bytes = pixels * 4 * 8 * 2
+
+        return rgba_bytes * VTF_WORKER_COPIES + normal_bytes
+    except Exception:
+        return estimate_file_memory(input_file)
+
+
+def fit_alpha(
+    input_file: Path,
+    output_file: Path,
+    lossless: bool,
+    min_ssim: float = LOSSY_MIN_SSIM,
+    min_psnr: float = LOSSY_MIN_PSNR,
+) -> bool:
     """
     Encodes the best alpha format for a supported encoding-encoded VTF image losslessly.
+    If lossless is False, uncompressed VTF images are also trial-encoded to DXT.
 
     :param input_file: The path of the VTF to determine the optimal alpha format for.
     :type input_file: Path
     :param output_file: The path of the VTF file to write to.
     :type output_file: Path
+    :param min_ssim: The minimum SSIM a lossy DXT encode must reach to be kept.
+    :type min_ssim: float
+    :param min_psnr: The minimum PSNR (dB) a lossy DXT encode must reach to be kept.
+    :type min_psnr: float
     :return: Whether the function completed successfully.
     :rtype: bool
     """
@@ -39,12 +192,27 @@ def fit_alpha(input_file: Path, output_file: Path, lossless: bool) -> bool:
         vtf = vtfpp.VTF(input_file)
 
         format_name = vtf.format.name
+        if (
+            not lossless
+            and format_name in SUPPORTED_FORMATS[1] + SUPPORTED_FORMATS[2]
+            and fit_lossy(
+                input_file=input_file,
+                output_file=output_file,
+                min_ssim=min_ssim,
+                min_psnr=min_psnr,
+            )
+        ):
+            return True
+
         if format_name in SUPPORTED_FORMATS[0]:
             return fit_dxt(
                 input_file=input_file, output_file=output_file, lossless=lossless
             )
         elif format_name in SUPPORTED_FORMATS[1]:
             return fit_8888(input_file=input_file, output_file=output_file)
+        elif format_name in SUPPORTED_FORMATS[2]:
+            if not fit_grayscale(input_file=input_file, output_file=output_file):
+                vtf.bake_to_file(output_file)
         else:
             vtf.bake_to_file(output_file)
         return True
@@ -72,6 +240,9 @@ def fit_8888(input_file: Path, output_file: Path) -> bool:
             fop_copy(src=input_file, dst=output_file, mode=1)
             return True
 
+        if fit_grayscale(input_file=input_file, output_file=output_file):
+            return True
+
         alpha_8888 = {
             "BGRA8888": "BGR888",
             "RGBA8888": "RGB888",
@@ -163,6 +334,422 @@ def fit_8888(input_file: Path, output_file: Path) -> bool:
         return False
 
 
+def get_subresources(vtf: vtfpp.VTF) -> list[tuple[int, int, int, int]]:
+    """
+    Lists every subresource stored in a VTF image.
+
+    :param vtf: The VTF image to list the subresources of.
+    :type vtf: vtfpp.VTF
+    :return: A list of (mip, frame, face, slice) tuples.
+    :rtype: list
+    """
+
+    return [
+        (mip, frame, face, depth_slice)
+        for mip in range(vtf.mip_count)
+        for frame in range(vtf.frame_count)
+        for face in range(vtf.face_count)
+        for depth_slice in range(vtf.depth_for_mip(mip))
+    ]
+
+
+def fit_grayscale(input_file: Path, output_file: Path) -> bool:
+    """
+    Encodes an uncompressed VTF image whose colour channels are identical across every
+    subresource as I8, or as IA88 if it has a used alpha channel, losslessly.
+
+    :param input_file: The path of the VTF to check for grayscale data.
+    :type input_file: Path
+    :param output_file: The path of the VTF file to write to.
+    :type output_file: Path
+    :return: Whether the VTF image was grayscale and written to output_file.
+    :rtype: bool
+    """
+
+    vtf = vtfpp.VTF(input_file)
+
+    layout = GRAYSCALE_LAYOUTS.get(vtf.format.name)
+    if layout is None:
+        return False
+
+    bpp, (r, g, b), alpha_idx = layout
+    planes = {}
+    has_alpha = False
+
+    for mip, frame, face, depth_slice in get_subresources(vtf):
+        pixels = np.frombuffer(
+            vtf.get_image_data_raw(mip=mip, frame=frame, face=face, slice=depth_slice),
+            dtype=np.uint8,
+        ).reshape(-1, bpp)
+
+        if not (
+            np.array_equal(pixels[:, r], pixels[:, g])
+            and np.array_equal(pixels[:, g], pixels[:, b])
+        ):
+            return False
+
+        if alpha_idx is not None:
+            has_alpha = has_alpha or bool(np.any(pixels[:, alpha_idx] < 255))
+            planes[(mip, frame, face, depth_slice)] = pixels[:, [r, alpha_idx]]
+        else:
+            planes[(mip, frame, face, depth_slice)] = pixels[:, [r]]
+
+    # vtfpp's own I8 conversion weighs channels into luminance, which rounds
+    # grey values off by one, so the channels are written back directly instead
+    if has_alpha:
+        target_format = vtfpp.ImageFormat.IA88
+    else:
+        target_format = vtfpp.ImageFormat.I8
+        planes = {sub: plane[:, 0] for sub, plane in planes.items()}
+
+    vtf.set_format(target_format)
+
+    for (mip, frame, face, depth_slice), plane in planes.items():
+        written = vtf.set_image(
+            image_data=np.ascontiguousarray(plane).tobytes(),
+            format=target_format,
+            width=vtf.width_for_mip(mip),
+            height=vtf.height_for_mip(mip),
+            filter=vtfpp.ImageConversion.ResizeFilter.NICE,
+            mip=mip,
+            frame=frame,
+            face=face,
+            slice=depth_slice,
+        )
+        if not written:
+            return False
+
+    vtf.bake_to_file(output_file)
+    return True
+
+
+def downsample_rgba(pixels: np.ndarray, max_size: int = METRIC_SIZE) -> np.ndarray:
+    """
+    Box-filters an image down until neither side is larger than max_size.
+
+    :param pixels: The (height, width, channels) image to downsample.
+    :type pixels: np.ndarray
+    :param max_size: The maximum side length of the downsampled image.
+    :type max_size: int
+    :return: The downsampled image as float64.
+    :rtype: np.ndarray
+    """
+
+    height, width, channels = pixels.shape
+    factor = max(1, -(-max(height, width) // max_size))
+    factor_y = min(factor, height)
+    factor_x = min(factor, width)
+    height -= height % factor_y
+    width -= width % factor_x
+
+    return (
+        pixels[:height, :width]
+        .reshape(height // factor_y, factor_y, width // factor_x, factor_x, channels)
+        .mean(axis=(1, 3), dtype=np.float64)
+    )
+
+
+def compute_psnr(original: np.ndarray, encoded: np.ndarray) -> float:
+    """
+    Computes the peak signal-to-noise ratio between two 8-bit images.
+
+    :param original: The reference image.
+    :type original: np.ndarray
+    :param encoded: The image to compare against the reference.
+    :type encoded: np.ndarray
+    :return: The PSNR in decibels, or infinity for identical images.
+    :rtype: float
+    """
+
+    mse = np.mean((original.astype(np.float64) - encoded) ** 2)
+    if mse == 0:
+        return float("inf")
+    return float(10 * np.log10(255.0**2 / mse))
+
+
+def compute_block_ssim(
+    original: np.ndarray, encoded: np.ndarray, block: int = METRIC_BLOCK
+) -> float:
+    """
+    Computes the mean structural similarity between two 8-bit images over
+    non-overlapping square blocks, averaged across channels.
+
+    :param original: The (height, width, channels) reference image.
+    :type original: np.ndarray
+    :param encoded: The (height, width, channels) image to compare against the reference.
+    :type encoded: np.ndarray
+    :param block: The side length of each block.
+    :type block: int
+    :return: The mean SSIM, 1.0 for identical images.
+    :rtype: float
+    """
+
+    height, width, channels = original.shape
+    block = max(1, min(block, height, width))
+    height -= height % block
+    width -= width % block
+
+    def to_blocks(image):
+        return (
+            image[:height, :width]
+            .astype(np.float64)
+            .reshape(height // block, block, width // block, block, channels)
+            .transpose(0, 2, 4, 1, 3)
+            .reshape(-1, block * block)
+        )
+
+    x = to_blocks(original)
+    y = to_blocks(encoded)
+
+    mu_x = x.mean(axis=1)
+    mu_y = y.mean(axis=1)
+    var_x = x.var(axis=1)
+    var_y = y.var(axis=1)
+    cov = ((x - mu_x[:, None]) * (y - mu_y[:, None])).mean(axis=1)
+
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+    ssim = ((2 * mu_x * mu_y + c1) * (2 * cov + c2)) / (
+        (mu_x**2 + mu_y**2 + c1) * (var_x + var_y + c2)
+    )
+    return float(ssim.mean())
+
+
+def fit_lossy(
+    input_file: Path,
+    output_file: Path,
+    min_ssim: float = LOSSY_MIN_SSIM,
+    min_psnr: float = LOSSY_MIN_PSNR,
+) -> bool:
+    """
+    Trial-encodes an uncompressed VTF image to DXT1 (or DXT5 if it has a used alpha channel)
+    and writes it if the encode is smaller and measures as similar enough to the original.
+
+    :param input_file: The path of the VTF to trial-encode.
+    :type input_file: Path
+    :param output_file: The path of the VTF file to write to.
+    :type output_file: Path
+    :param min_ssim: The minimum block SSIM the encode must reach, from 0 to 1.
+    :type min_ssim: float
+    :param min_psnr: The minimum PSNR (dB) the encode must reach.
+    :type min_psnr: float
+    :return: Whether the encode was accepted and written to output_file. False if it
+        failed too, so the caller falls back to a lossless fit.
+    :rtype: bool
+    """
+
+    try:
+        vtf = vtfpp.VTF(input_file)
+        original_format = vtf.format.name
+
+        # metrics are only measured on the top mip, downsampled, to keep them cheap
+        subresources = [sub for sub in get_subresources(vtf) if sub[0] == 0]
+        shape = (vtf.height, vtf.width, 4)
+
+        originals = {}
+        translucent = False
+        for mip, frame, face, depth_slice in subresources:
+            rgba = np.frombuffer(
+                vtf.get_image_data_as_rgba8888(
+                    mip=mip, frame=frame, face=face, slice=depth_slice
+                ),
+                dtype=np.uint8,
+            ).reshape(shape)
+            translucent = translucent or bool(np.any(rgba[..., 3] < 255))
+            originals[(mip, frame, face, depth_slice)] = downsample_rgba(rgba)
+
+        target_format = (
+            vtfpp.ImageFormat.DXT5 if translucent else vtfpp.ImageFormat.DXT1
+        )
+        vtf.set_format(target_format)
+
+        channels = 4 if translucent else 3
+        psnr = float("inf")
+        ssim = 1.0
+        for (mip, frame, face, depth_slice), original in originals.items():
+            encoded = downsample_rgba(
+                np.frombuffer(
+                    vtf.get_image_data_as_rgba8888(
+                        mip=mip, frame=frame, face=face, slice=depth_slice
+                    ),
+                    dtype=np.uint8,
+                ).reshape(shape)
+            )
+            original, encoded = original[..., :channels], encoded[..., :channels]
+            psnr = min(psnr, compute_psnr(original, encoded))
+            ssim = min(ssim, compute_block_ssim(original, encoded))
+
+        encoded_vtf = vtf.bake()
+        accepted = (
+            ssim >= min_ssim
+            and psnr >= min_psnr
+            and len(encoded_vtf) < input_file.stat().st_size
+        )
+
+        if accepted:
+            output_file.write_bytes(encoded_vtf)
+
+        report_logger(
+            "fit_alpha",
+            input_file,
+            original_format=original_format,
+            target_format=target_format.name,
+            psnr=round(psnr, 2) if psnr != float("inf") else None,
+            ssim=round(ssim, 4),
+            original_size=input_file.stat().st_size,
+            encoded_size=len(encoded_vtf),
+            accepted=accepted,
+        )
+        return accepted
+    except Exception as e:
+        exception_logger(e)
+        return False
+
+
+def strip_alpha(input_file: Path, output_file: Path) -> bool:
+    """
+    Re-encodes a VTF image without its alpha channel, as DXT1 or BGR888.
+
+    :param input_file: The path of the VTF to strip the alpha channel from.
+    :type input_file: Path
+    :param output_file: The path of the VTF file to write to.
+    :type output_file: Path
+    :return: Whether the function completed successfully.
+    :rtype: bool
+    """
+
+    try:
+        vtf = vtfpp.VTF(input_file)
+
+        format_name = vtf.format.name
+        if format_name in SUPPORTED_FORMATS[0]:
+            vtf.set_format(vtfpp.ImageFormat.DXT1)
+        elif format_name in SUPPORTED_FORMATS[1]:
+            vtf.set_format(vtfpp.ImageFormat.BGR888)
+        else:
+            fop_copy(src=input_file, dst=output_file, mode=1)
+            return True
+
+        vtf.compute_transparency_flags()
+        vtf.bake_to_file(output_file)
+        return True
+    except Exception as e:
+        exception_logger(e)
+        return False
+
+
+def _is_vmt_flag_set(value: str | None) -> bool:
+    if value is None:
+        return False
+    try:
+        return float(value) != 0
+    except ValueError:
+        return value.lower() not in ("", "false")
+
+
+def fit_material_alpha(input_dir: Path, output_dir: Path, progress_window=None) -> bool:
+    """
+    Strips the alpha channel of every VTF image whose referencing VMTs never read it,
+    based on each material's shader, parameter slot, and flags.
+
+    :param input_dir: The directory to strip unread alpha channels in.
+    :type input_dir: Path
+    :param output_dir: The directory to write the VTFs to.
+    :type output_dir: Path
+    :return: Whether the function completed successfully.
+    :rtype: bool
+    """
+
+    try:
+        if not input_dir.is_dir():
+            if progress_window:
+                progress_window.error(
+                    "Strip Unread Alpha failed: "
+                    "Input folder was not a folder, or does not exist."
+                )
+            return False
+
+        materials_roots = get_head_directories(
+            input_dir=input_dir, target_dir="materials"
+        )
+        if not materials_roots:
+            if progress_window:
+                progress_window.error(
+                    "Strip Unread Alpha failed: No 'materials/' subfolders found."
+                )
+            return False
+
+        graph = MaterialGraph.build(
+            input_dir=input_dir, materials_roots=materials_roots
+        )
+
+        references = {}
+        for vmt_path in graph.materials:
+            # patch VMTs are judged by the shader and flags they end up with
+            shader, params, textures = graph.resolve(vmt_path)
+            material = graph.relative_key(vmt_path, ".vmt")
+
+            for slot, texture in textures.items():
+                reads_alpha = (
+                    shader not in ALPHA_AWARE_SHADERS
+                    or slot not in ALPHA_READERS
+                    or material is None
+                    or any(
+                        _is_vmt_flag_set(params.get(flag))
+                        for flag in ALPHA_READERS[slot]
+                    )
+                )
+                references.setdefault(texture, []).append(
+                    {"material": material, "slot": slot, "reads_alpha": reads_alpha}
+                )
+
+        vtf_files = list(input_dir.rglob("*.vtf"))
+        total = len(vtf_files)
+
+        with ProcessPoolExecutor() as executor:
+            futures = {}
+            for vtf_path in vtf_files:
+                dst = output_dir / vtf_path.relative_to(input_dir)
+                refs = references.get(graph.relative_key(vtf_path))
+
+                unread = bool(refs) and not any(ref["reads_alpha"] for ref in refs)
+                if refs:
+                    report_logger(
+                        "fit_material_alpha",
+                        vtf_path,
+                        stripped=unread,
+                        references=refs,
+                    )
+
+                if unread:
+                    dst.parent.mkdir(parents=True, exist_ok=True)
+                    futures[executor.submit(strip_alpha, vtf_path, dst)] = vtf_path
+                elif output_dir != input_dir:
+                    dst.parent.mkdir(parents=True, exist_ok=True)
+                    fop_copy(src=vtf_path, dst=dst, mode=2)
+
+            processed = total - len(futures)
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Error processing {futures[future].name}: {e}")
+
+                processed += 1
+                if progress_window and (processed % 10 == 0 or processed == total):
+                    progress_window.update(processed, total)
+
+        if progress_window:
+            progress_window.update(total, total)
+
+        return True
+    except Exception as e:
+        exception_logger(e)
+        if progress_window:
+            progress_window.error("Strip Unread Alpha failed with an unknown error.")
+        return False
+
+
 def fit_dxt(input_file: Path, output_file: Path, lossless: bool) -> bool:
     """
     Encodes the best alpha format for a DXT-encoded VTF image "losslessly."
@@ -341,6 +928,160 @@ def resize_vtf(
         return False
 
 
+def _png_batches(input_files: list[Path], output_files: list[Path]) -> list[list]:
+    # oxipng writes every output to one folder under its input's name, so a batch
+    # shares its input and output folders, and renamed outputs are run one at a time.
+    # Batches are already sized by handle_batch_parallel
+    groups = {}
+    for input_file, output_file in zip(input_files, output_files):
+        key = (input_file.parent, output_file.parent, input_file.name == output_file.name)
+        groups.setdefault(key, []).append((input_file, output_file))
+
+    batches = []
+    for (_, _, same_name), pairs in groups.items():
+        batches.extend([pairs] if same_name else [[pair] for pair in pairs])
+    return batches
+
+
+def find_png_tool(lossless: bool = True) -> str | None:
+    """
+    Finds the external PNG optimizer for a mode: the bundled oxipng or pngquant on
+    Windows, or one on the PATH elsewhere.
+
+    :param lossless: True for oxipng, False for pngquant.
+    :type lossless: bool
+    :return: The path of the executable, or None if it is unavailable.
+    :rtype: str | None
+    """
+
+    bundled = OXIPNG_EXE if lossless else PNGQUANT_EXE
+    if sys.platform == "win32" and bundled.is_file():
+        return str(bundled)
+    return shutil.which(bundled.stem)
+
+
+def _recompress_png_batch(pairs: list[tuple[Path, Path]], level: int) -> None:
+    for input_file, output_file in pairs:
+        data = input_file.read_bytes()
+        recompressed = recompress_png(data, level)
+        if len(recompressed) < len(data):
+            output_file.write_bytes(recompressed)
+
+
+def _run_png_batch(
+    pairs: list[tuple[Path, Path]], level: int, lossless: bool, tool: str
+) -> None:
+    in_place = pairs[0][0] == pairs[0][1]
+    input_files = [str(input_file) for input_file, _ in pairs]
+
+    if lossless:
+        command = [
+            tool,
+            "--opt",
+            str(round(6 / 100 * level)),
+            "--preserve",
+            "--strip",
+            "safe",
+            # the process pool already runs one batch per core
+            "--threads",
+            "1",
+        ]
+        if len(pairs) == 1 and not in_place:
+            command += ["--out", str(pairs[0][1])]
+        elif not in_place:
+            command += ["--dir", str(pairs[0][1].parent)]
+    else:
+        command = [
+            tool,
+            "--force",
+            "--skip-if-larger",
+            "--ext",
+            ".png",
+            "--speed",
+            str(max(1, 11 - round(10 / 100 * level))),
+            "--quality",
+            f"0-{max(1, int(level))}",
+            "--strip",
+        ]
+
+    # files which could not be optimized leave no output, e.g. when pngquant cannot
+    # meet the quality, so the exit code is not treated as failure
+    if lossless or in_place:
+        subprocess.run(
+            command + input_files,
+            capture_output=True,
+            text=True,
+            creationflags=SUBPROCESS_FLAGS,
+        )
+        return
+
+    # pngquant writes beside its inputs, so it overwrites copies in a temporary
+    # folder, which is beside the outputs so they can be moved into place
+    with tempfile.TemporaryDirectory(dir=pairs[0][1].parent) as temp_dir:
+        copies = []
+        for input_file, _ in pairs:
+            copy = Path(temp_dir) / input_file.name
+            shutil.copyfile(input_file, copy)
+            copies.append(str(copy))
+
+        subprocess.run(
+            command + copies,
+            capture_output=True,
+            text=True,
+            creationflags=SUBPROCESS_FLAGS,
+        )
+
+        for copy, (_, output_file) in zip(copies, pairs):
+            os.replace(copy, output_file)
+
+
+def optimize_pngs(
+    input_files: list[Path],
+    output_files: list[Path],
+    level: int = 100,
+    lossless: bool = True,
+) -> bool:
+    """
+    Optimizes many PNG images, passing those sharing a folder to one oxipng or pngquant
+    process, so callers keep batches short of the command line limit. Without the external tool, the PNGs are losslessly recompressed
+    in process instead, including when lossy quantization was asked for. Any output
+    which is missing or no smaller than its input is restored from the untouched input
+    afterwards.
+
+    :param input_files: The paths of the PNG files to optimize.
+    :type input_files: list[Path]
+    :param output_files: The paths of the optimized PNG files to write to, in the same
+        order as input_files.
+    :type output_files: list[Path]
+    :param level: The normalized "intensity" of compression and comparisons.
+    0 => fastest, largest filesizes. 100 => slowest, smallest filesizes.
+    :type level: int
+    :return: Whether the function completed successfully.
+    :rtype: bool
+    """
+    try:
+        tool = find_png_tool(lossless)
+        for pairs in _png_batches(input_files, output_files):
+            if tool:
+                _run_png_batch(pairs, level, lossless, tool)
+            else:
+                _recompress_png_batch(pairs, level)
+
+            for input_file, output_file in pairs:
+                if input_file == output_file:
+                    continue
+                if (
+                    not output_file.is_file()
+                    or input_file.stat().st_size <= output_file.stat().st_size
+                ):
+                    fop_copy(src=input_file, dst=output_file, mode=1)
+
+        return True
+    except Exception as e:
+        exception_logger(e)
+        return False
+
+
 def optimize_png(
     input_file: Path, output_file: Path, level: int = 100, lossless: bool = True
 ) -> bool:
@@ -357,59 +1098,8 @@ def optimize_png(
     :return: Whether the function completed successfully.
     :rtype: bool
     """
-    try:
-        input_file_cache = io.BytesIO(input_file.read_bytes())
-        input_file_size = input_file.stat().st_size
-        
-        if lossless:
-            command = [
-                str(OXIPNG_EXE),
-                input_file,
-                "--out",
-                output_file,
-                "--opt",
-                str(round(6 / 100 * level)),
-                "--preserve",
-                "--strip",
-                "safe",
-            ]
-            subprocess.run(
-                command,
-                check=True,
-                capture_output=True,
-                text=True,
-                creationflags=subprocess.CREATE_NO_WINDOW,
-            )
-
-        else:
-            command = [
-                str(PNGQUANT_EXE),
-                input_file,
-                "-f",
-                "-o",
-                output_file,
-                "--speed",
-                str(max(1, 11 - round(10 / 100 * level))),
-                "--quality",
-                f"0-{max(1, int(level))}",
-                "--strip",
-            ]
-            subprocess.run(
-                command,
-                check=True,
-                capture_output=True,
-                text=True,
-                creationflags=subprocess.CREATE_NO_WINDOW,
-            )
 
-        if input_file_size <= output_file.stat().st_size:
-            with open(output_file, 'wb') as f_out:
-                f_out.write(input_file_cache.getvalue())
-
-        return True
-    except Exception as e:
-        exception_logger(e)
-        return False
+    return optimize_pngs([input_file], [output_file], level=level, lossless=lossless)
 
 
 def halve_normal(input_file: Path, output_file: Path) -> bool:
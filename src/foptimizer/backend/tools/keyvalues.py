@@ -0,0 +1,142 @@
+import re
+
+
+# whitespace and // comments are skipped, every other match is one token. Only a
+# token starting with [ is a conditional, as the engine reads e.g. $color[0] as one
+KEYVALUES_TOKEN_REGEX = re.compile(
+    r"""
+    \s+
+    | //[^\n]*
+    | (?P<quoted>"[^"]*"?)
+    | (?P<open>\{)
+    | (?P<close>\})
+    | (?P<conditional>\[[^\]\n]*\]?)
+    | (?P<bare>(?:[^\s"{}\[/]|/(?!/))(?:[^\s"{}/]|/(?!/))*)
+    """,
+    re.VERBOSE,
+)
+
+
+def tokenize_keyvalues(text: str) -> list[tuple[str, str, int, int]]:
+    """
+    Splits KeyValues text (VMTs, soundscripts etc.) into tokens, skipping whitespace
+    and comments.
+
+    :param text: The KeyValues text to tokenize.
+    :type text: str
+    :return: A list of (kind, value, start, end) tuples, where kind is "string", "{",
+        "}" or "conditional", value is the unquoted token text and start/end span the
+        token in text, including any quotes.
+    :rtype: list
+    """
+
+    tokens = []
+    for match in KEYVALUES_TOKEN_REGEX.finditer(text):
+        kind = match.lastgroup
+        if kind is None:
+            continue
+
+        token = match.group()
+        if kind == "quoted":
+            kind = "string"
+            token = token[1:-1] if len(token) > 1 and token.endswith('"') else token[1:]
+        elif kind == "bare":
+            kind = "string"
+        elif kind == "open":
+            kind = "{"
+        elif kind == "close":
+            kind = "}"
+
+        tokens.append((kind, token, match.start(), match.end()))
+
+    return tokens
+
+
+def get_key_values(text: str) -> list[tuple[str, str, int, int]]:
+    """
+    Finds every key-value pair in KeyValues text at any nesting depth, e.g. inside
+    proxies or patch replace/insert blocks. Keys opening a block are skipped.
+
+    :param text: The KeyValues text to search.
+    :type text: str
+    :return: A list of (key, value, start, end) tuples, with start/end spanning the
+        value token in text, including any quotes.
+    :rtype: list
+    """
+
+    pairs = []
+    key = None
+    for kind, value, start, end in tokenize_keyvalues(text):
+        if kind == "conditional":
+            continue
+
+        if kind != "string":
+            key = None
+        elif key is None:
+            key = value
+        else:
+            pairs.append((key, value, start, end))
+            key = None
+
+    return pairs
+
+
+def get_parameter_spans(text: str, params: set) -> list[tuple[str, str, int, int]]:
+    """
+    Finds every key-value pair in KeyValues text whose key is one of params.
+
+    :param text: The KeyValues text to search.
+    :type text: str
+    :param params: A set of lowercase keys to find the values of.
+    :type params: set
+    :return: A list of (key, value, start, end) tuples, with the key lowercased and
+        start/end spanning the value token in text, including any quotes.
+    :rtype: list
+    """
+
+    return [
+        (key.lower(), value, start, end)
+        for key, value, start, end in get_key_values(text)
+        if key.lower() in params
+    ]
+
+
+def ends_line(text: str, end: int) -> bool:
+    """
+    Checks whether only whitespace or a comment follow a position on its line, so that
+    a comment can be appended after it without hiding anything.
+
+    :param text: The text to check.
+    :type text: str
+    :param end: The position to check after.
+    :type end: int
+    :return: Whether the rest of the line is empty.
+    :rtype: bool
+    """
+
+    line_end = text.find("\n", end)
+    rest = (text[end:] if line_end == -1 else text[end:line_end]).strip()
+    return not rest or rest.startswith("//")
+
+
+def splice_spans(text: str, replacements: list[tuple[int, int, str]]) -> str:
+    """
+    Replaces non-overlapping spans of text in a single pass.
+
+    :param text: The text to splice.
+    :type text: str
+    :param replacements: A list of (start, end, replacement) tuples.
+    :type replacements: list
+    :return: The spliced text.
+    :rtype: str
+    """
+
+    parts = []
+    position = 0
+    for start, end, replacement in sorted(replacements):
+        parts.append(text[position:start])
+        parts.append(replacement)
+        position = end
+    parts.append(text[position:])
+
+    return "".join(parts)
@@ -0,0 +1,339 @@
+import os
+from pathlib import Path
+
+from .keyvalues import get_key_values, tokenize_keyvalues
+from .parse_cache import parse_incrementally
+
+
+MATERIAL_GRAPH_PATH = Path("material_graph.json")
+MATERIAL_GRAPH_VERSION = 2
+
+VMT_PARAMS = (
+    "$basetexture",
+    "$basetexture2",
+    "$basetexture3",
+    "$basetexture4",
+    "$bumpmap",
+    "$bumpmap2",
+    "$ssbump",
+    "$normalmap",
+    "$normalmap2",
+    "$detail",
+    "$detail2",
+    "$lightwarptexture",
+    "$envmap",
+    "$envmapmask",
+    "$envmapmask2",
+    "$selfillummask",
+    "$phongexponenttexture",
+    "$phongwarptexture",
+    "$phongexponent2texture",
+    "$tintmasktexture",
+    "$ambientocclusiontexture",
+    "$blendmodulatetexture",
+    "$tooltexture",
+    "$fresnelrangestexture",
+    "$emissiveblendtexture",
+    "$emissiveblendbasetexture",
+    "$emissiveblendflowtexture",
+    "$fleshinteriortexture",
+    "$fleshinteriornoisetexture",
+    "$fleshbordertexture1d",
+    "$fleshcubetexture",
+    "$fleshnormaltexture",
+    "$fleshsubsurfacetexture",
+    "$displaceallowance",
+    "$parallaxmap",
+    "$masks1",
+    "$masks2",
+    "$maskstexture",
+    "$iris",
+    "$corneatexture",
+    "$fresneltexture",
+    "$warptexture",
+    "$flowmap",
+    "$blendmask",
+    "$painttexture",
+    "$detailblendmask",
+    "$reflecttexture",
+    "$refracttexture",
+    "$refracttinttexture",
+    "$bottommaterial",
+    "$underwateroverlay",
+    "$backlighttexture",
+    "$displacementmap",
+    "$ambientoccltexture",
+    "$specmasktexture",
+    "$fresnelwarptexture",
+    "$opacitytexture",
+    "$blendmap",
+    "$blendmap2",
+    "$texture2",
+    "%tooltexture",
+    "$flow_noise_texture",
+    "$paintsplatnormalmap",
+    "$paintsplatbubblelayout",
+    "$paintsplatbubble",
+    "$paintenvmap",
+    "$basenormalmap2",
+    "$basenormalmap3",
+    "$basenormalmap4",
+    "$dudvmap",
+    "$spitternoisetexture",
+    "$scenedepth",
+    "$ramptexture",
+    "$gradienttexture",
+    "$cloudalphatexture",
+    "$corecolortexture",
+    "$detail1",
+    "$detail2",
+    "$flowbounds",
+    "$masks",
+    "$selfillummap",
+    "$decaltexture",
+    "$lightmap",
+    "$compress",
+    "$stretch",
+    "$texture1",
+    "$texture3",
+    "$colorbar",
+    "$stripetexture",
+)
+
+VMT_PARAM_SET = frozenset(param.lower() for param in VMT_PARAMS)
+
+
+def material_key(path: str, suffix: str = ".vtf") -> str:
+    """
+    Normalizes a material or texture reference to a lowercase path relative to
+    materials/, without its extension.
+
+    :param path: The reference to normalize, e.g. a VMT parameter value.
+    :type path: str
+    :param suffix: The extension to remove.
+    :type suffix: str
+    :return: The normalized reference.
+    :rtype: str
+    """
+
+    clean = path.replace("\\", "/").strip().lower()
+    clean = clean.removeprefix("materials/")
+    return clean.removesuffix(suffix)
+
+
+def parse_vmt(text: str) -> dict:
+    """
+    Parses the shader, included material, parameters and texture references of a VMT.
+
+    :param text: The contents of the VMT.
+    :type text: str
+    :return: A dictionary with "shader", "include", "params" and "textures" keys, where
+        textures is a list of [parameter, texture] pairs normalized by material_key.
+    :rtype: dict
+    """
+
+    tokens = tokenize_keyvalues(text)
+    shader = next((value for kind, value, _, _ in tokens if kind == "string"), "")
+
+    include = None
+    params = {}
+    textures = []
+    for key, value, _, _ in get_key_values(text):
+        key = key.lower()
+        if key == "include":
+            include = material_key(value, ".vmt")
+        elif key[:1] in ("$", "%"):
+            params[key] = value.strip()
+            if key in VMT_PARAM_SET:
+                textures.append([key, material_key(value)])
+
+    return {
+        "shader": shader.lower(),
+        "include": include,
+        "params": params,
+        "textures": textures,
+    }
+
+
+def _parse_vmt_worker(vmt_path: Path):
+    try:
+        text = vmt_path.read_text(encoding="latin-1", errors="ignore")
+        entry = parse_vmt(text)
+        entry["backslash"] = "\\" in text
+        return entry
+    except Exception as e:
+        return e
+
+
+def _scan_vmts(input_dir: Path) -> list[tuple[Path, os.stat_result]]:
+    found = []
+    stack = [input_dir]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    stack.append(entry.path)
+                elif entry.is_file() and entry.name.lower().endswith(".vmt"):
+                    found.append((Path(entry.path), entry.stat()))
+    return found
+
+
+class MaterialGraph:
+    """
+    An index of every VMT in a directory tree: each material's shader, parameters and
+    texture references, and the materials and parameter slots referencing each texture.
+    """
+
+    def __init__(self, materials: dict, materials_roots: tuple[Path]):
+        self.materials = materials
+        self.materials_roots = tuple(materials_roots)
+
+        self.material_paths = {}
+        self.texture_refs = {}
+        for vmt_path, entry in materials.items():
+            key = self.relative_key(vmt_path, ".vmt")
+            if key is not None:
+                self.material_paths.setdefault(key, vmt_path)
+
+            for slot, texture in entry["textures"]:
+                self.texture_refs.setdefault(texture, []).append((vmt_path, slot))
+
+    @classmethod
+    def build(
+        cls,
+        input_dir: Path,
+        materials_roots: tuple[Path],
+        cache_path: Path = MATERIAL_GRAPH_PATH,
+    ) -> "MaterialGraph":
+        """
+        Builds the graph of every VMT under a directory, only re-parsing VMTs whose size or
+        modification time changed since the graph was last persisted to cache_path.
+
+        :param input_dir: The directory to index the VMTs of.
+        :type input_dir: Path
+        :param materials_roots: The materials/ directories that references are relative to.
+        :type materials_roots: tuple[Path]
+        :param cache_path: The path of the persisted graph.
+        :type cache_path: Path
+        :return: The material graph.
+        :rtype: MaterialGraph
+        """
+
+        materials = parse_incrementally(
+            input_dir=input_dir,
+            cache_path=cache_path,
+            version=MATERIAL_GRAPH_VERSION,
+            scan=_scan_vmts,
+            worker=_parse_vmt_worker,
+        )
+        return cls(materials, materials_roots)
+
+    def relative_key(self, path: Path, suffix: str = ".vtf") -> str | None:
+        """
+        Computes the material_key of a file inside one of the graph's materials roots.
+
+        :param path: The path of the VMT or VTF.
+        :type path: Path
+        :param suffix: The extension to remove.
+        :type suffix: str
+        :return: The normalized key, or None if the file is outside every materials root.
+        :rtype: str | None
+        """
+
+        for materials_root in self.materials_roots:
+            if path.is_relative_to(materials_root):
+                return material_key(path.relative_to(materials_root).as_posix(), suffix)
+        return None
+
+    def dependencies(self, vmt_path: Path) -> list[tuple[str, str]]:
+        """
+        Lists the textures a VMT references directly.
+
+        :param vmt_path: The path of the VMT.
+        :type vmt_path: Path
+        :return: A list of (parameter, texture) tuples.
+        :rtype: list
+        """
+
+        entry = self.materials.get(vmt_path)
+        if entry is None:
+            return []
+        return [(slot, texture) for slot, texture in entry["textures"]]
+
+    def references(self, texture: str) -> list[tuple[Path, str]]:
+        """
+        Lists the materials and parameter slots referencing a texture directly.
+
+        :param texture: The texture, normalized by material_key.
+        :type texture: str
+        :return: A list of (VMT path, parameter) tuples.
+        :rtype: list
+        """
+
+        return self.texture_refs.get(texture, [])
+
+    def is_referenced(self, texture: str) -> bool:
+        return texture in self.texture_refs
+
+    def resolve(self, vmt_path: Path) -> tuple[str, dict, dict]:
+        """
+        Resolves a VMT's effective shader, parameters and textures, following patch
+        VMTs through the materials they include.
+
+        :param vmt_path: The path of the VMT.
+        :type vmt_path: Path
+        :return: A (shader, parameters, textures) tuple, where textures maps each
+            parameter slot to its texture. The shader is "patch" if an included material
+            could not be found.
+        :rtype: tuple
+        """
+
+        chain = []
+        current = vmt_path
+        while current is not None and current not in chain:
+            chain.append(current)
+            include = self.materials[current]["include"]
+            current = self.material_paths.get(include) if include else None
+
+        base = self.materials[chain[-1]]
+        shader = base["shader"] if not base["include"] else "patch"
+        params = {}
+        textures = {}
+        for path in reversed(chain):
+            params.update(self.materials[path]["params"])
+            textures.update(self.materials[path]["textures"])
+
+        return shader, params, textures
+
+    def reachable(self, roots: set) -> tuple[set, set]:
+        """
+        Walks the graph from a set of used materials, following patch includes and
+        parameters referencing other materials, e.g. $bottommaterial.
+
+        :param roots: The used materials, normalized by material_key.
+        :type roots: set
+        :return: A (VMT paths, textures) tuple of every reachable material in the graph
+            and every texture they reference.
+        :rtype: tuple
+        """
+
+        materials = set()
+        textures = set()
+        stack = [self.material_paths[key] for key in roots if key in self.material_paths]
+        while stack:
+            vmt_path = stack.pop()
+            if vmt_path in materials:
+                continue
+            materials.add(vmt_path)
+
+            entry = self.materials[vmt_path]
+            linked = [texture for _, texture in entry["textures"]]
+            textures.update(linked)
+            if entry["include"]:
+                linked.append(entry["include"])
+
+            for key in linked:
+                if key in self.material_paths:
+                    stack.append(self.material_paths[key])
+
+        return materials, textures
@@ -0,0 +1,234 @@
+import re
+from pathlib import Path
+
+from .keyvalues import tokenize_keyvalues
+from .misc import exception_logger, report_logger
+
+
+# GLua adds // and /* */ comments, != and the C style logical operators to Lua 5.1
+LUA_TOKEN_REGEX = re.compile(
+    r"""
+    (?P<newline>\r\n|\n|\r)
+    | (?P<space>[ \t\f\v]+)
+    | (?P<long_comment>--\[(?P<comment_level>=*)\[.*?\](?P=comment_level)\])
+    | (?P<line_comment>(?:--|//)[^\r\n]*)
+    | (?P<block_comment>/\*.*?\*/)
+    | (?P<long_string>\[(?P<string_level>=*)\[.*?\](?P=string_level)\])
+    | (?P<string>"(?:[^"\\\r\n]|\\.)*"|'(?:[^'\\\r\n]|\\.)*')
+    | (?P<number>
+        0[xX][0-9A-Fa-f]*(?:\.[0-9A-Fa-f]*)?(?:[pP][+-]?[0-9]+)?[uUlLi]*
+        | (?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?[uUlLi]*
+    )
+    | (?P<name>[A-Za-z_\x80-\xff][A-Za-z0-9_\x80-\xff]*)
+    | (?P<operator>\.\.\.|\.\.|==|~=|!=|<=|>=|::|&&|\|\||[-+*/%^\#&|~<>=(){}\[\];:,.!])
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+LUA_COMMENTS = ("long_comment", "line_comment", "block_comment")
+LINE_BREAK_REGEX = re.compile(r"\r\n|\r|\n")
+
+# adjacent characters which would lex as one token, or open a comment or long string
+LUA_JOINED_PAIRS = frozenset(
+    ("--", "//", "/*", "[[", "[=", "==", "~=", "!=", "<=", ">=", "..", "::", "&&", "||")
+)
+KEYVALUES_DIRECTIVES = ("#base", "#include")
+# the folders whose .txt files are KeyValues, e.g. soundscripts and localization
+KEYVALUES_TEXT_DIRS = ("materials", "resource", "scripts")
+
+
+def tokenize_glua(text: str) -> list[tuple[str, str]]:
+    """
+    Splits GLua code into tokens, including whitespace and comments.
+
+    :param text: The GLua code to tokenize.
+    :type text: str
+    :return: A list of (kind, token) tuples, where kind is the LUA_TOKEN_REGEX group
+        that matched, e.g. "name", "string" or "line_comment".
+    :rtype: list
+    """
+
+    tokens = []
+    position = 0
+    while position < len(text):
+        match = LUA_TOKEN_REGEX.match(text, position)
+        if match is None:
+            raise ValueError(f"Unexpected character {text[position]!r} at {position}.")
+        tokens.append((match.lastgroup, match.group()))
+        position = match.end()
+    return tokens
+
+
+def _is_word(char: str) -> bool:
+    return char.isalnum() or char == "_" or char >= "\x80"
+
+
+def _needs_space(previous: tuple[str, str], token: tuple[str, str]) -> bool:
+    previous_kind, previous_text = previous
+    last, first = previous_text[-1], token[1][0]
+
+    if _is_word(last) and _is_word(first):
+        return True
+    if previous_kind == "number" and (first == "." or (last in "eEpP" and first in "+-")):
+        return True
+    return last + first in LUA_JOINED_PAIRS
+
+
+def minify_glua(text: str, keep_lines: bool = False) -> str:
+    """
+    Strips comments and redundant whitespace from GLua code.
+
+    :param text: The GLua code to minify.
+    :type text: str
+    :param keep_lines: True if every token should stay on its original line, so that
+        errors still report the right line numbers.
+    :type keep_lines: bool
+    :return: The minified code.
+    :rtype: str
+    """
+
+    output = []
+    previous = None
+    line_breaks = 0
+    separated = False
+    for kind, token in tokenize_glua(text):
+        if kind in ("newline", "space") or kind in LUA_COMMENTS:
+            line_breaks += len(LINE_BREAK_REGEX.findall(token))
+            separated = True
+            continue
+
+        if keep_lines and line_breaks:
+            output.append("\n" * line_breaks)
+        elif previous and separated and _needs_space(previous, (kind, token)):
+            output.append(" ")
+
+        output.append(token)
+        previous = (kind, token)
+        line_breaks = 0
+        separated = False
+
+    return "".join(output)
+
+
+def _is_unquoted(kind: str, token: str) -> bool:
+    # an unquoted token is also kept apart from braces, as some parsers read through them
+    return kind == "string" and not token.startswith('"')
+
+
+def _is_keyvalues(tokens: list[tuple]) -> bool:
+    # every top-level key opens a block, besides #base and #include, and every nested
+    # key is followed by a value or a block
+    depth = 0
+    expect = "key"
+    for kind, value, _, _ in tokens:
+        if kind == "conditional":
+            continue
+        if expect == "key":
+            if kind == "}" and depth:
+                depth -= 1
+            elif kind == "string":
+                if depth or value.lower() in KEYVALUES_DIRECTIVES:
+                    expect = "value"
+                else:
+                    expect = "block"
+            else:
+                return False
+        elif kind == "{":
+            depth += 1
+            expect = "key"
+        elif kind == "string" and expect == "value":
+            expect = "key"
+        else:
+            return False
+    return depth == 0 and expect == "key" and any(kind == "{" for kind, *_ in tokens)
+
+
+def minify_keyvalues(text: str) -> str | None:
+    """
+    Strips comments and redundant whitespace from KeyValues text, e.g. a VMT or a
+    soundscript, keeping every token's quoting as it was.
+
+    :param text: The KeyValues text to minify.
+    :type text: str
+    :return: The minified text, or None if the text does not look like KeyValues.
+    :rtype: str | None
+    """
+
+    # escaped quotes are only read as such by some KeyValues parsers, so these files
+    # are left as they are rather than risk splitting their values
+    if '\\"' in text:
+        return None
+
+    tokens = tokenize_keyvalues(text)
+    if not _is_keyvalues(tokens):
+        return None
+
+    output = []
+    previous = None
+    directive = False
+    for kind, value, start, end in tokens:
+        token = text[start:end]
+        if directive:
+            # #base and #include are read up to the end of their line
+            output.append("\n")
+        elif previous is not None and (
+            (previous[0] not in "{}" and kind not in "{}")
+            or _is_unquoted(*previous)
+            or _is_unquoted(kind, token)
+        ):
+            output.append(" ")
+
+        directive = previous is not None and previous[1].lower() in KEYVALUES_DIRECTIVES
+        output.append(token)
+        previous = (kind, token)
+
+    return "".join(output)
+
+
+def minify_script(
+    input_file: Path, output_file: Path, keep_lines: bool = False
+) -> bool:
+    """
+    Minifies a GLua script or KeyValues text file. Text files that do not look like
+    KeyValues and scripts that cannot be tokenized are copied unchanged.
+
+    :param input_file: The .lua, .txt or .vmt file to minify.
+    :type input_file: Path
+    :param output_file: The minified file to write to.
+    :type output_file: Path
+    :param keep_lines: True if GLua tokens should stay on their original lines, so that
+        errors still report the right line numbers.
+    :type keep_lines: bool
+    :return: Whether the function completed successfully.
+    :rtype: bool
+    """
+
+    try:
+        data = input_file.read_bytes()
+        # latin-1 maps every byte to one character, so any encoding round-trips
+        text = data.decode("latin-1")
+
+        try:
+            if input_file.suffix.lower() == ".lua":
+                minified = minify_glua(text, keep_lines=keep_lines)
+            else:
+                minified = minify_keyvalues(text)
+        except ValueError as e:
+            exception_logger(e)
+            minified = None
+
+        if minified is None or len(minified) >= len(text):
+            output_file.write_bytes(data)
+            return True
+
+        output_file.write_bytes(minified.encode("latin-1"))
+        report_logger(
+            "minify_script",
+            input_file,
+            size=len(data),
+            minified_size=len(minified),
+            saved=len(data) - len(minified),
+        )
+        return True
+    except Exception as e:
+        exception_logger(e)
+        return False
@@ -1,9 +1,19 @@
+import ctypes
+import json
+import os
 import traceback
 import shutil
+import subprocess
 from pathlib import Path
 
 import tomllib
 
+MEMORY_BUDGET_FRACTION = 0.5
+FALLBACK_MEMORY_BUDGET = 4 * 1024**3
+# keeps external tools from opening a console window; CREATE_NO_WINDOW only exists
+# on Windows
+SUBPROCESS_FLAGS = getattr(subprocess, "CREATE_NO_WINDOW", 0)
+
 def exception_logger(exc: Exception) -> None:
     """
     Logs an exception to error.log.
@@ -17,6 +27,61 @@ def exception_logger(exc: Exception) -> None:
         log.write(error)
 
 
+def report_logger(tool: str, file: Path, **fields) -> None:
+    """
+    Logs a per-file decision made by a tool to report.log, one JSON object per line.
+
+    :param tool: The name of the tool that made the decision.
+    :type tool: str
+    :param file: The file the decision was made for.
+    :type file: Path
+    :param fields: Any metrics or details describing the decision.
+    """
+
+    entry = {"tool": tool, "file": str(file), **fields}
+    with open("report.log", "a") as log:
+        log.write(json.dumps(entry) + "\n")
+
+
+def get_memory_budget(fraction: float = MEMORY_BUDGET_FRACTION) -> int:
+    """
+    Computes a memory budget in bytes as a fraction of the machine's physical memory.
+
+    :param fraction: The fraction of physical memory to allow.
+    :type fraction: float
+    :return: The memory budget in bytes.
+    :rtype: int
+    """
+
+    try:
+        if os.name == "nt":
+
+            class MEMORYSTATUSEX(ctypes.Structure):
+                _fields_ = [
+                    ("dwLength", ctypes.c_ulong),
+                    ("dwMemoryLoad", ctypes.c_ulong),
+                    ("ullTotalPhys", ctypes.c_ulonglong),
+                    ("ullAvailPhys", ctypes.c_ulonglong),
+                    ("ullTotalPageFile", ctypes.c_ulonglong),
+                    ("ullAvailPageFile", ctypes.c_ulonglong),
+                    ("ullTotalVirtual", ctypes.c_ulonglong),
+                    ("ullAvailVirtual", ctypes.c_ulonglong),
+                    ("ullAvailExtendedVirtual", ctypes.c_ulonglong),
+                ]
+
+            status = MEMORYSTATUSEX()
+            status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+            ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status))
+            total = status.ullTotalPhys
+        else:
+            total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+        return int(total * fraction)
+    except Exception as e:
+        exception_logger(e)
+        return FALLBACK_MEMORY_BUDGET
+
+
 def get_project_version():
     try:
         path = Path(__file__).parent.parent.parent.parent.parent / "pyproject.toml" 
@@ -28,6 +93,10 @@ def get_project_version():
 
 
 def fop_copy(src: Path, dst: Path, mode: int = 1) -> bool:
+    # an unchanged archive entry stays in its archive rather than being written out
+    if isinstance(src, bytes):
+        return
+
     try:
         if mode == 1:
             shutil.copy(src, dst)
@@ -43,6 +112,9 @@ def fop_copy(src: Path, dst: Path, mode: int = 1) -> bool:
 
 
 def dir_size_bytes(dir: Path) -> int:
+    if dir.is_file():
+        return dir.stat().st_size
+
     total = 0
     for f in dir.rglob("*"):
         if f.is_file():
@@ -0,0 +1,107 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from .misc import exception_logger
+
+
+# below this many changed files, parsing inline beats starting worker processes
+PARALLEL_PARSE_THRESHOLD = 256
+PARSE_CHUNK_SIZE = 64
+
+
+def parse_incrementally(
+    input_dir: Path,
+    cache_path: Path,
+    version: int,
+    scan,
+    worker,
+    chunksize: int = PARSE_CHUNK_SIZE,
+) -> dict:
+    """
+    Parses every file scan finds under a directory, only re-parsing files whose size or
+    modification time changed since the results were last persisted to cache_path.
+    Results of files elsewhere are kept in the cache, so one cache serves many folders.
+
+    :param input_dir: The directory to parse the files of.
+    :type input_dir: Path
+    :param cache_path: The path of the persisted results.
+    :type cache_path: Path
+    :param version: The version of the result format. A cache of another version is
+        discarded.
+    :type version: int
+    :param scan: A function taking input_dir and returning a list of (path, stat)
+        tuples of the files to parse.
+    :type scan: Callable
+    :param worker: A picklable function taking a path and returning its result as a
+        JSON serializable dictionary, or the exception it raised.
+    :type worker: Callable
+    :param chunksize: The number of files sent to a worker process at a time.
+    :type chunksize: int
+    :return: A dictionary of the scanned file paths and their results. Files which
+        failed to parse are left out.
+    :rtype: dict
+    """
+
+    cached = {}
+    try:
+        if cache_path.is_file():
+            data = json.loads(cache_path.read_text(encoding="utf-8"))
+            if data.get("version") == version:
+                cached = data["entries"]
+    except Exception as e:
+        exception_logger(e)
+
+    scanned = scan(input_dir)
+    keys = {path: os.path.abspath(path) for path, _ in scanned}
+
+    changed = []
+    for path, stat in scanned:
+        entry = cached.get(keys[path])
+        if (
+            entry is None
+            or entry["mtime_ns"] != stat.st_mtime_ns
+            or entry["size"] != stat.st_size
+        ):
+            changed.append((path, stat))
+
+    changed_paths = [path for path, _ in changed]
+    if len(changed) >= PARALLEL_PARSE_THRESHOLD:
+        with ProcessPoolExecutor() as executor:
+            results = list(executor.map(worker, changed_paths, chunksize=chunksize))
+    else:
+        results = [worker(path) for path in changed_paths]
+
+    for (path, stat), entry in zip(changed, results):
+        if isinstance(entry, Exception):
+            exception_logger(entry)
+            cached.pop(keys[path], None)
+            continue
+
+        entry["mtime_ns"] = stat.st_mtime_ns
+        entry["size"] = stat.st_size
+        cached[keys[path]] = entry
+
+    # forget files under this directory which no longer exist
+    prefix = os.path.join(os.path.abspath(input_dir), "")
+    seen = set(keys.values())
+    stale = [key for key in cached if key.startswith(prefix) and key not in seen]
+    for key in stale:
+        del cached[key]
+
+    if changed or stale or not cache_path.is_file():
+        _persist(cached, cache_path, version)
+
+    return {path: cached[keys[path]] for path, _ in scanned if keys[path] in cached}
+
+
+def _persist(cached: dict, cache_path: Path, version: int) -> None:
+    try:
+        temp_path = cache_path.with_name(cache_path.name + ".tmp")
+        temp_path.write_text(
+            json.dumps({"version": version, "entries": cached}), encoding="utf-8"
+        )
+        os.replace(temp_path, cache_path)
+    except Exception as e:
+        exception_logger(e)
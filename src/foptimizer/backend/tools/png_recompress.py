@@ -0,0 +1,507 @@
+import struct
+import zlib
+
+import numpy as np
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_CHUNK_HEADER = struct.Struct(">I4s")
+PNG_IHDR = struct.Struct(">2I5B")
+
+PNG_GREY = 0
+PNG_RGB = 2
+PNG_PALETTE = 3
+PNG_GREY_ALPHA = 4
+PNG_RGBA = 6
+PNG_CHANNELS = {PNG_GREY: 1, PNG_RGB: 3, PNG_PALETTE: 1, PNG_GREY_ALPHA: 2, PNG_RGBA: 4}
+
+# ancillary chunks kept as they change how colours display, like oxipng's --strip safe
+PNG_SAFE_CHUNKS = (b"cICP", b"iCCP", b"sRGB", b"pHYs")
+# animated PNGs keep frames outside IDAT, so they are left untouched
+PNG_ANIMATION_CHUNK = b"acTL"
+
+# Adam7 passes: x start, y start, x step, y step
+ADAM7_PASSES = (
+    (0, 0, 8, 8),
+    (4, 0, 8, 8),
+    (0, 4, 4, 8),
+    (2, 0, 4, 4),
+    (0, 2, 2, 4),
+    (1, 0, 2, 2),
+    (0, 1, 1, 2),
+)
+
+ZLIB_STRATEGIES = (zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED)
+# below this level, only the adaptive and unfiltered strategies are tried
+FULL_SEARCH_LEVEL = 50
+# images larger than this are searched on a sample of about this many bytes, taken as
+# this many bands of rows, at this zlib level
+SEARCH_SAMPLE_BYTES = 256 * 1024
+SEARCH_SAMPLE_BANDS = 8
+SEARCH_ZLIB_LEVEL = 6
+
+
+def read_png_chunks(data: bytes) -> list[tuple[bytes, bytes]]:
+    """
+    Splits a PNG into its chunks, without checking their CRCs.
+
+    :param data: The contents of the PNG file.
+    :type data: bytes
+    :return: A list of (chunk type, chunk data) tuples in file order.
+    :rtype: list
+    """
+
+    if data[:8] != PNG_SIGNATURE:
+        raise ValueError("Not a PNG file.")
+
+    chunks = []
+    offset = 8
+    while offset + PNG_CHUNK_HEADER.size <= len(data):
+        length, chunk_type = PNG_CHUNK_HEADER.unpack_from(data, offset)
+        start = offset + PNG_CHUNK_HEADER.size
+        chunks.append((chunk_type, data[start : start + length]))
+        offset = start + length + 4
+        if chunk_type == b"IEND":
+            break
+    return chunks
+
+
+def _unfilter_wavefront(lines: np.ndarray, filters: np.ndarray, bpp: int) -> np.ndarray:
+    # a pixel depends on its left, up and upper left neighbours only, so each
+    # anti-diagonal of pixels is decoded at once, whatever the rows' filter types
+    height, stride = lines.shape
+    width = -(-stride // bpp)
+    data = np.zeros((height, width * bpp), dtype=np.int16)
+    data[:, :stride] = lines
+    data = data.reshape(height, width, bpp)
+
+    # padded with a zero row above and a zero column to the left
+    out = np.zeros((height + 1, width + 1, bpp), dtype=np.int16)
+    types = filters.astype(np.int16)
+    for diagonal in range(height + width - 1):
+        y = np.arange(max(0, diagonal - width + 1), min(height, diagonal + 1))
+        x = diagonal - y
+        a = out[y + 1, x]
+        b = out[y, x + 1]
+        c = out[y, x]
+        filter_type = types[y][:, None]
+
+        pa = np.abs(b - c)
+        pb = np.abs(a - c)
+        pc = np.abs(a + b - 2 * c)
+        paeth = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+        predictor = np.select(
+            [filter_type == 1, filter_type == 2, filter_type == 3, filter_type == 4],
+            [a, b, (a + b) >> 1, paeth],
+            0,
+        )
+        out[y + 1, x + 1] = (data[y, x] + predictor) & 0xFF
+
+    return out[1:, 1:].reshape(height, -1)[:, :stride].astype(np.uint8)
+
+
+def _unfilter(raw: bytes, height: int, stride: int, bpp: int) -> np.ndarray:
+    lines = np.frombuffer(raw, dtype=np.uint8, count=height * (stride + 1))
+    lines = lines.reshape(height, stride + 1)
+    filters = lines[:, 0]
+    if np.isin(filters, (3, 4)).any():
+        # Average and Paeth depend on the byte just decoded
+        return _unfilter_wavefront(lines[:, 1:], filters, bpp)
+
+    rows = np.empty((height, stride), dtype=np.uint8)
+    previous = np.zeros(stride, dtype=np.uint8)
+    for y in range(height):
+        line = lines[y, 1:]
+        if filters[y] == 0:
+            row = line
+        elif filters[y] == 2:
+            row = line + previous
+        else:
+            # a running sum per byte of the pixel, wrapping at 256
+            padded = np.zeros(-(-stride // bpp) * bpp, dtype=np.uint8)
+            padded[:stride] = line
+            row = np.cumsum(padded.reshape(-1, bpp), axis=0, dtype=np.uint8)
+            row = row.reshape(-1)[:stride]
+
+        rows[y] = row
+        previous = rows[y]
+    return rows
+
+
+def _unpack_rows(rows: np.ndarray, width: int, channels: int, bit_depth: int) -> np.ndarray:
+    if bit_depth == 16:
+        samples = rows.view(">u2").astype(np.uint16)
+    elif bit_depth == 8:
+        samples = rows
+    else:
+        bits = np.unpackbits(rows, axis=1)
+        per_row = width * channels * bit_depth
+        bits = bits[:, :per_row].reshape(rows.shape[0], -1, bit_depth)
+        weights = (1 << np.arange(bit_depth - 1, -1, -1)).astype(np.uint8)
+        samples = (bits * weights).sum(axis=2, dtype=np.uint8)
+    return samples[:, : width * channels].reshape(rows.shape[0], width, channels)
+
+
+def decode_png(chunks: list[tuple[bytes, bytes]]) -> tuple[np.ndarray, dict]:
+    """
+    Decodes a PNG's pixels, reversing its filters and any Adam7 interlacing.
+
+    :param chunks: The chunks of the PNG, from read_png_chunks.
+    :type chunks: list
+    :return: A (samples, header) tuple, where samples is a (height, width, channels)
+        array of the stored samples, i.e. palette indices for palette images, and
+        header holds the IHDR fields plus any "palette" and "transparency" data.
+    :rtype: tuple
+    """
+
+    chunk_data = {}
+    for chunk_type, data in chunks:
+        chunk_data.setdefault(chunk_type, data)
+
+    width, height, bit_depth, colour_type, _, _, interlace = PNG_IHDR.unpack(
+        chunk_data[b"IHDR"]
+    )
+    header = {
+        "width": width,
+        "height": height,
+        "bit_depth": bit_depth,
+        "colour_type": colour_type,
+        "palette": chunk_data.get(b"PLTE"),
+        "transparency": chunk_data.get(b"tRNS"),
+    }
+
+    channels = PNG_CHANNELS[colour_type]
+    bits_per_pixel = channels * bit_depth
+    bpp = max(1, bits_per_pixel // 8)
+    raw = zlib.decompress(b"".join(data for kind, data in chunks if kind == b"IDAT"))
+
+    if not interlace:
+        stride = (width * bits_per_pixel + 7) // 8
+        rows = _unfilter(raw, height, stride, bpp)
+        return _unpack_rows(rows, width, channels, bit_depth), header
+
+    dtype = np.uint16 if bit_depth == 16 else np.uint8
+    samples = np.zeros((height, width, channels), dtype=dtype)
+    position = 0
+    for x_start, y_start, x_step, y_step in ADAM7_PASSES:
+        pass_width = max(0, (width - x_start + x_step - 1) // x_step)
+        pass_height = max(0, (height - y_start + y_step - 1) // y_step)
+        if not pass_width or not pass_height:
+            continue
+
+        stride = (pass_width * bits_per_pixel + 7) // 8
+        size = pass_height * (stride + 1)
+        rows = _unfilter(raw[position : position + size], pass_height, stride, bpp)
+        position += size
+        samples[y_start::y_step, x_start::x_step] = _unpack_rows(
+            rows, pass_width, channels, bit_depth
+        )
+    return samples, header
+
+
+def _to_rgba(samples: np.ndarray, header: dict) -> np.ndarray | None:
+    # expands any image to RGBA at its own bit depth, for colour counting
+    colour_type = header["colour_type"]
+    if colour_type == PNG_PALETTE:
+        palette = np.frombuffer(header["palette"], dtype=np.uint8).reshape(-1, 3)
+        alpha = np.full(len(palette), 255, dtype=np.uint8)
+        transparency = (header["transparency"] or b"")[: len(palette)]
+        alpha[: len(transparency)] = np.frombuffer(transparency, dtype=np.uint8)
+        indices = samples[..., 0]
+        if indices.max(initial=0) >= len(palette):
+            return None
+        return np.dstack((palette[indices], alpha[indices]))
+
+    # values too small for their bit depth are scaled up to 8 bits
+    if header["bit_depth"] < 8:
+        samples = (samples * (255 // ((1 << header["bit_depth"]) - 1))).astype(np.uint8)
+    full = 65535 if header["bit_depth"] == 16 else 255
+
+    if colour_type in (PNG_GREY, PNG_GREY_ALPHA):
+        grey = samples[..., :1]
+        colour = np.concatenate((grey, grey, grey), axis=2)
+    else:
+        colour = samples[..., :3]
+
+    if colour_type in (PNG_GREY_ALPHA, PNG_RGBA):
+        alpha = samples[..., -1:]
+    else:
+        alpha = np.full(samples.shape[:2] + (1,), full, dtype=samples.dtype)
+        if header["transparency"]:
+            # a single colour, or grey level, is fully transparent
+            key = np.frombuffer(header["transparency"], dtype=">u2").astype(samples.dtype)
+            original = samples[..., : len(key)]
+            if header["bit_depth"] < 8:
+                key = key * (255 // ((1 << header["bit_depth"]) - 1))
+            alpha[np.all(original == key, axis=2)] = 0
+    return np.concatenate((colour, alpha), axis=2)
+
+
+def _pack_rows(samples: np.ndarray, bit_depth: int) -> np.ndarray:
+    height, width, channels = samples.shape
+    if bit_depth == 16:
+        return samples.astype(">u2").view(np.uint8).reshape(height, -1)
+    if bit_depth == 8:
+        return samples.reshape(height, -1).astype(np.uint8)
+
+    values = samples.reshape(height, -1).astype(np.uint8)
+    shifts = np.arange(bit_depth - 1, -1, -1, dtype=np.uint8)
+    bits = (values[..., None] >> shifts) & 1
+    return np.packbits(bits.reshape(height, -1), axis=1)
+
+
+def _low_bit_depth(values: np.ndarray) -> int:
+    # the smallest depth whose levels, scaled to 8 bits, cover every value
+    for bit_depth in (1, 2, 4):
+        scale = 255 // ((1 << bit_depth) - 1)
+        if not np.any(values % scale):
+            return bit_depth
+    return 8
+
+
+def reduce_png(rgba: np.ndarray, bit_depth: int, keep_colour: bool) -> list[dict]:
+    """
+    Computes the lossless encodings of an image worth trying: the smallest colour type
+    and bit depth that stores it exactly, and a palette when it has 256 colours or
+    fewer.
+
+    :param rgba: The (height, width, 4) RGBA samples.
+    :type rgba: np.ndarray
+    :param bit_depth: The bit depth of the samples, 8 or 16.
+    :type bit_depth: int
+    :param keep_colour: True if the image must stay RGB, e.g. for its ICC profile.
+    :type keep_colour: bool
+    :return: A list of candidate encodings, each a dictionary of "samples",
+        "colour_type", "bit_depth" and optional "palette" and "transparency" data.
+    :rtype: list
+    """
+
+    if bit_depth == 16:
+        # 16-bit samples whose two bytes are equal are 8-bit samples scaled up
+        if np.all(rgba >> 8 == rgba & 0xFF):
+            rgba = (rgba >> 8).astype(np.uint8)
+            bit_depth = 8
+
+    full = 65535 if bit_depth == 16 else 255
+    opaque = bool(np.all(rgba[..., 3] == full))
+    grey = not keep_colour and bool(
+        np.all(rgba[..., 0] == rgba[..., 1]) and np.all(rgba[..., 1] == rgba[..., 2])
+    )
+
+    if grey:
+        channels = rgba[..., :1] if opaque else rgba[..., [0, 3]]
+        colour_type = PNG_GREY if opaque else PNG_GREY_ALPHA
+    else:
+        channels = rgba[..., :3] if opaque else rgba
+        colour_type = PNG_RGB if opaque else PNG_RGBA
+
+    candidate_depth = bit_depth
+    if colour_type == PNG_GREY and bit_depth == 8:
+        candidate_depth = _low_bit_depth(channels)
+        if candidate_depth < 8:
+            channels = channels // (255 // ((1 << candidate_depth) - 1))
+
+    candidates = [
+        {"samples": channels, "colour_type": colour_type, "bit_depth": candidate_depth}
+    ]
+
+    if bit_depth == 8 and candidate_depth == 8:
+        pixels = rgba.reshape(-1, 4).view(np.uint32).ravel()
+        colours, indices = np.unique(pixels, return_inverse=True)
+        if len(colours) <= 256:
+            palette = colours.view(np.uint8).reshape(-1, 4)
+            # translucent entries first, so tRNS can stop at the last of them
+            order = np.argsort(palette[:, 3] == 255, kind="stable")
+            palette = palette[order]
+            remap = np.empty(len(order), dtype=np.uint8)
+            remap[order] = np.arange(len(order), dtype=np.uint8)
+            indices = remap[indices].reshape(rgba.shape[:2] + (1,))
+
+            palette_depth = next(
+                depth for depth in (1, 2, 4, 8) if len(palette) <= 1 << depth
+            )
+            translucent = int(np.count_nonzero(palette[:, 3] != 255))
+            candidates.append(
+                {
+                    "samples": indices,
+                    "colour_type": PNG_PALETTE,
+                    "bit_depth": palette_depth,
+                    "palette": palette[:, :3].tobytes(),
+                    "transparency": palette[:translucent, 3].tobytes() or None,
+                }
+            )
+
+    return candidates
+
+
+def filter_rows(rows: np.ndarray, bpp: int) -> list[np.ndarray]:
+    """
+    Applies each of the five PNG filters to every row at once.
+
+    :param rows: The (height, stride) packed bytes of the image.
+    :type rows: np.ndarray
+    :param bpp: The bytes per complete pixel, at least 1.
+    :type bpp: int
+    :return: The filtered rows for filter types 0 to 4, each (height, stride) uint8.
+    :rtype: list
+    """
+
+    x = rows.astype(np.int16)
+    a = np.zeros_like(x)
+    a[:, bpp:] = x[:, :-bpp]
+    b = np.zeros_like(x)
+    b[1:] = x[:-1]
+    c = np.zeros_like(x)
+    c[1:, bpp:] = x[:-1, :-bpp]
+
+    estimate = a + b - c
+    pa = np.abs(estimate - a)
+    pb = np.abs(estimate - b)
+    pc = np.abs(estimate - c)
+    paeth = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+
+    return [
+        rows,
+        (x - a).astype(np.uint8),
+        (x - b).astype(np.uint8),
+        (x - ((a + b) >> 1)).astype(np.uint8),
+        (x - paeth).astype(np.uint8),
+    ]
+
+
+def _compress_rows(
+    filtered: list[np.ndarray], choices: np.ndarray, strategy: int, level: int = 9
+) -> bytes:
+    height = choices.shape[0]
+    lines = np.stack(filtered)[choices, np.arange(height)]
+    data = np.hstack((choices.astype(np.uint8)[:, None], lines)).tobytes()
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 15, 9, strategy)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _sample_rows(height: int, stride: int) -> np.ndarray:
+    # evenly spaced bands of whole rows, so the up, average and Paeth filters' rows
+    # still follow the rows they were filtered against
+    sample_height = max(SEARCH_SAMPLE_BANDS, SEARCH_SAMPLE_BYTES // (stride + 1))
+    band = max(1, sample_height // SEARCH_SAMPLE_BANDS)
+    starts = np.linspace(0, height - band, SEARCH_SAMPLE_BANDS).astype(np.intp)
+    return np.unique((starts[:, None] + np.arange(band)).ravel())
+
+
+def encode_idat(rows: np.ndarray, bpp: int, level: int = 100) -> bytes:
+    """
+    Filters and compresses packed image rows, trying each single filter type and a
+    per-row adaptive choice, and keeping the smallest at the maximum zlib level. Large
+    images pick their filters and zlib strategy on a sample of their rows.
+
+    :param rows: The (height, stride) packed bytes of the image.
+    :type rows: np.ndarray
+    :param bpp: The bytes per complete pixel, at least 1.
+    :type bpp: int
+    :param level: The normalized "intensity" of the search. Below FULL_SEARCH_LEVEL
+        only the adaptive and unfiltered choices are tried.
+    :type level: int
+    :return: The compressed IDAT data.
+    :rtype: bytes
+    """
+
+    filtered = filter_rows(rows, bpp)
+    height = rows.shape[0]
+
+    # the minimum sum of absolute differences heuristic, per row
+    costs = np.stack(
+        [np.abs(lines.view(np.int8).astype(np.int32)).sum(axis=1) for lines in filtered]
+    )
+    choices = [np.zeros(height, dtype=np.intp), costs.argmin(axis=0)]
+    if level >= FULL_SEARCH_LEVEL:
+        choices += [np.full(height, filter_type, dtype=np.intp) for filter_type in (1, 2, 3, 4)]
+
+    strategies = ZLIB_STRATEGIES if level >= FULL_SEARCH_LEVEL else ZLIB_STRATEGIES[:1]
+    candidates = [(choice, strategy) for choice in choices for strategy in strategies]
+
+    if rows.nbytes <= SEARCH_SAMPLE_BYTES:
+        return min(
+            (
+                _compress_rows(filtered, choice, strategy)
+                for choice, strategy in candidates
+            ),
+            key=len,
+        )
+
+    # large images are searched on a sample at a lower level, and only the winner is
+    # compressed whole at the maximum level
+    sample = _sample_rows(height, rows.shape[1])
+    sampled = [lines[sample] for lines in filtered]
+    choice, strategy = min(
+        candidates,
+        key=lambda candidate: len(
+            _compress_rows(
+                sampled, candidate[0][sample], candidate[1], SEARCH_ZLIB_LEVEL
+            )
+        ),
+    )
+    return _compress_rows(filtered, choice, strategy)
+
+
+def _chunk(chunk_type: bytes, data: bytes) -> bytes:
+    crc = zlib.crc32(data, zlib.crc32(chunk_type))
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", crc)
+
+
+def recompress_png(data: bytes, level: int = 100) -> bytes:
+    """
+    Losslessly recompresses a PNG in process, stripping ancillary chunks that do not
+    change how it displays, reducing its colour type and bit depth where that stores
+    the same pixels, and searching PNG filters and zlib strategies.
+
+    :param data: The contents of the PNG file.
+    :type data: bytes
+    :param level: The normalized "intensity" of the search.
+    0 => fastest, largest filesizes. 100 => slowest, smallest filesizes.
+    :type level: int
+    :return: The smallest encoding found, or data itself if nothing was smaller.
+    :rtype: bytes
+    """
+
+    chunks = read_png_chunks(data)
+    if any(chunk_type == PNG_ANIMATION_CHUNK for chunk_type, _ in chunks):
+        return data
+
+    samples, header = decode_png(chunks)
+    rgba = _to_rgba(samples, header)
+    if rgba is None:
+        return data
+
+    kept = [(kind, chunk_data) for kind, chunk_data in chunks if kind in PNG_SAFE_CHUNKS]
+    keep_colour = any(kind == b"iCCP" for kind, _ in kept)
+    bit_depth = 16 if header["bit_depth"] == 16 else 8
+
+    best = data
+    for candidate in reduce_png(rgba, bit_depth, keep_colour):
+        candidate_samples = candidate["samples"]
+        height, width, channels = candidate_samples.shape
+        rows = _pack_rows(candidate_samples, candidate["bit_depth"])
+        bpp = max(1, channels * candidate["bit_depth"] // 8)
+
+        parts = [
+            PNG_SIGNATURE,
+            _chunk(
+                b"IHDR",
+                PNG_IHDR.pack(
+                    width, height, candidate["bit_depth"], candidate["colour_type"], 0, 0, 0
+                ),
+            ),
+        ]
+        parts += [_chunk(kind, chunk_data) for kind, chunk_data in kept]
+        if candidate.get("palette"):
+            parts.append(_chunk(b"PLTE", candidate["palette"]))
+        if candidate.get("transparency"):
+            parts.append(_chunk(b"tRNS", candidate["transparency"]))
+        parts.append(_chunk(b"IDAT", encode_idat(rows, bpp, level)))
+        parts.append(_chunk(b"IEND", b""))
+
+        encoded = b"".join(parts)
+        if len(encoded) < len(best):
+            best = encoded
+
+    return best
@@ -1,9 +1,19 @@
 import shutil
 from pathlib import Path
 
-from .misc import exception_logger, fop_copy
-from .deduplication import get_head_directories, get_vmt_dependencies
+from .misc import exception_logger, fop_copy, report_logger
+from .asset_references import (
+    SCRIPT_SUFFIXES,
+    scan_model_and_map_references,
+    scan_script_references,
+)
+from .deduplication import get_head_directories
+from .material_graph import MaterialGraph, material_key
+from .sound_graph import SOUND_SUFFIXES, SoundGraph
+
 
+# soundscripts are left to the sound graph, as scanning them would keep every wave
+SOUND_SCAN_SUFFIXES = (".lua", ".res")
 
 FILE_BLACKLIST = (
     "*.360.vtx",
@@ -69,7 +79,8 @@ def remove_unaccessed_vtfs(
     input_dir: Path, output_dir: Path, remove: bool = False, progress_window=None
 ) -> bool:
     """
-    Scans for VTF files not referenced by any VMT in the directory tree.
+    Scans for VTF files not referenced by any VMT, Lua, text or resource file in the
+    directory tree.
 
     :param input_dir: The directory to remove unaccessed VTFs from.
     :type input_dir: Path
@@ -99,17 +110,17 @@ def remove_unaccessed_vtfs(
                 )
             return False
 
-        all_deps_map = get_vmt_dependencies(input_dir)
-        vmt_deps = set()
-        for deps in all_deps_map.values():
-            for vtf_path in deps:
-                clean_vtf = vtf_path.lower().replace("\\", "/")
-                if not clean_vtf.endswith(".vtf"):
-                    clean_vtf += ".vtf"
+        graph = MaterialGraph.build(
+            input_dir=input_dir, materials_roots=materials_roots
+        )
 
-                vmt_deps.add(clean_vtf)
-                if clean_vtf.startswith("materials/"):
-                    vmt_deps.add(clean_vtf.replace("materials/", "", 1))
+        unreferenced = {
+            key
+            for materials_root in materials_roots
+            for key in map(graph.relative_key, materials_root.rglob("*.vtf"))
+            if not graph.is_referenced(key)
+        }
+        script_references = scan_script_references(input_dir, unreferenced)
 
         for materials_root in materials_roots:
             vmt_files = list(materials_root.rglob("*.vmt"))
@@ -121,9 +132,8 @@ def remove_unaccessed_vtfs(
 
             processed = len(vmt_files)
             for vtf_path in vtf_files:
-                rel_path = vtf_path.relative_to(materials_root).as_posix().lower()
-
-                is_used = rel_path in vmt_deps
+                key = graph.relative_key(vtf_path)
+                is_used = graph.is_referenced(key) or key in script_references
 
                 if not is_used:
                     if remove:
@@ -156,3 +166,248 @@ def remove_unaccessed_vtfs(
                 "Remove Unaccessed VTFs failed with an unknown error."
             )
         return False
+
+
+def get_used_materials(
+    input_dir: Path, graph: MaterialGraph, references: dict
+) -> tuple[set, set, bool]:
+    """
+    Computes the materials and textures reachable from a set of models and maps, or
+    mentioned in any Lua, text or resource file.
+
+    :param input_dir: The directory whose scripts are scanned.
+    :type input_dir: Path
+    :param graph: The material graph of input_dir.
+    :type graph: MaterialGraph
+    :param references: The references of the used models and maps, from
+        scan_model_and_map_references.
+    :type references: dict
+    :return: A (VMT paths, texture keys, referenced) tuple, where referenced is False
+        if nothing referenced any material at all.
+    :rtype: tuple
+    """
+
+    used = set()
+    for file_references in references.values():
+        used.update(file_references["materials"])
+        for _, value in file_references["entities"]:
+            key = material_key(value, ".vmt").removesuffix(".spr")
+            if key in graph.material_paths:
+                used.add(key)
+
+    vtf_keys = {
+        graph.relative_key(vtf_path)
+        for materials_root in graph.materials_roots
+        for vtf_path in materials_root.rglob("*.vtf")
+    }
+    # VMTs are left to the graph, as scanning them would keep every texture of
+    # every unused material
+    script_references = scan_script_references(
+        input_dir,
+        vtf_keys | graph.material_paths.keys(),
+        suffixes=tuple(s for s in SCRIPT_SUFFIXES if s != ".vmt"),
+    )
+    used.update(script_references)
+
+    used_vmts, used_vtfs = graph.reachable(used)
+    used_vtfs.update(script_references)
+    return used_vmts, used_vtfs, bool(references or script_references)
+
+
+def get_used_sounds(input_dir: Path, sound_keys) -> set | None:
+    """
+    Computes the sounds played by anything in a directory tree, through the sound graph
+    or by being named in any Lua or resource file.
+
+    :param input_dir: The directory to find the used sounds of.
+    :type input_dir: Path
+    :param sound_keys: The lowercase paths relative to sound/ of its sound files.
+    :type sound_keys: Iterable[str]
+    :return: The used sound paths relative to sound/, or None if nothing references
+        any sound at all.
+    :rtype: set | None
+    """
+
+    graph = SoundGraph.build(input_dir=input_dir)
+    used = graph.reachable()
+
+    unreferenced = {key for key in sound_keys if key not in used}
+    unreached = graph.soundscripts.keys() - used
+    script_references = scan_script_references(
+        input_dir, unreferenced | unreached, suffixes=SOUND_SCAN_SUFFIXES
+    )
+    if not used and not script_references:
+        return None
+    return graph.reachable(script_references)
+
+
+def remove_unaccessed_materials(
+    input_dir: Path, output_dir: Path, remove: bool = False, progress_window=None
+) -> bool:
+    """
+    Scans for VMT and VTF files not reachable from any model or map in the directory
+    tree. Models reference materials through their texture names and $cdmaterials paths,
+    maps through their brush textures, skybox and entity keyvalues, and materials
+    reference textures and other materials through the material graph. Any material or
+    texture mentioned in a Lua, text or resource file is also kept.
+
+    :param input_dir: The directory to remove unaccessed materials from.
+    :type input_dir: Path
+    :param output_dir: The directory to copy over only used files to.
+    :type output_dir: Path
+    :param remove: True if the function should remove unused from the input directory instead
+        of copying used files to the output directory.
+    :type remove: bool
+    :return: Whether the function completed successfully.
+    :rtype: bool
+    """
+    try:
+        if not input_dir.is_dir():
+            if progress_window:
+                progress_window.error(
+                    "Remove Unaccessed Materials failed: "
+                    "Input folder was not a folder, or does not exist."
+                )
+            return False
+
+        materials_roots = get_head_directories(
+            input_dir=input_dir, target_dir="materials"
+        )
+        if not materials_roots:
+            if progress_window:
+                progress_window.error(
+                    "Remove Unaccessed Materials failed: No 'materials/' subfolders found."
+                )
+            return False
+
+        graph = MaterialGraph.build(
+            input_dir=input_dir, materials_roots=materials_roots
+        )
+        used_vmts, used_vtfs, referenced = get_used_materials(
+            input_dir, graph, scan_model_and_map_references(input_dir)
+        )
+        if not referenced:
+            if progress_window:
+                progress_window.error(
+                    "Remove Unaccessed Materials failed: No models, maps or scripts "
+                    "reference any material, so every material would be removed."
+                )
+            return False
+
+        for materials_root in materials_roots:
+            vmt_files = list(materials_root.rglob("*.vmt"))
+            vtf_files = list(materials_root.rglob("*.vtf"))
+
+            total = len(vmt_files) + len(vtf_files)
+            processed = 0
+            for path in vmt_files + vtf_files:
+                if path.suffix.lower() == ".vmt":
+                    is_used = path in used_vmts
+                else:
+                    is_used = graph.relative_key(path) in used_vtfs
+
+                if not is_used:
+                    if remove:
+                        path.unlink()
+                        report_logger("remove_unaccessed_materials", path, removed=True)
+                    else:
+                        # unused files are left out of the output rather than removed
+                        report_logger("remove_unaccessed_materials", path, copied=False)
+                elif not remove:
+                    target_path = output_dir / path.relative_to(input_dir)
+                    target_path.parent.mkdir(parents=True, exist_ok=True)
+                    fop_copy(src=path, dst=target_path, mode=2)
+
+                processed += 1
+                if progress_window and (processed % 10 == 0 or processed == total):
+                    progress_window.update(processed, total)
+
+        return True
+    except Exception as e:
+        exception_logger(e)
+        if progress_window:
+            progress_window.error(
+                "Remove Unaccessed Materials failed with an unknown error."
+            )
+        return False
+
+
+def remove_unaccessed_sounds(
+    input_dir: Path, output_dir: Path, remove: bool = False, progress_window=None
+) -> bool:
+    """
+    Scans for sound files not played by anything in the directory tree. Sounds are
+    played through soundscript and soundscape waves, string literals passed to Lua's
+    Sound, EmitSound, surface.PlaySound and CreateSound, map entities such as
+    ambient_generic, and model animation events, either by path or by soundscript
+    name. Any sound or soundscript named anywhere in a Lua or resource file is also
+    kept.
+
+    :param input_dir: The directory to remove unaccessed sounds from.
+    :type input_dir: Path
+    :param output_dir: The directory to copy over only used files to.
+    :type output_dir: Path
+    :param remove: True if the function should remove unused from the input directory instead
+        of copying used files to the output directory.
+    :type remove: bool
+    :return: Whether the function completed successfully.
+    :rtype: bool
+    """
+    try:
+        if not input_dir.is_dir():
+            if progress_window:
+                progress_window.error(
+                    "Remove Unaccessed Sounds failed: "
+                    "Input folder was not a folder, or does not exist."
+                )
+            return False
+
+        sound_roots = get_head_directories(input_dir=input_dir, target_dir="sound")
+        if not sound_roots:
+            if progress_window:
+                progress_window.error(
+                    "Remove Unaccessed Sounds failed: No 'sound/' subfolders found."
+                )
+            return False
+
+        sound_files = {
+            path: path.relative_to(sound_root).as_posix().lower()
+            for sound_root in sound_roots
+            for path in sound_root.rglob("*")
+            if path.suffix.lower() in SOUND_SUFFIXES and path.is_file()
+        }
+
+        used = get_used_sounds(input_dir, sound_files.values())
+        if used is None:
+            if progress_window:
+                progress_window.error(
+                    "Remove Unaccessed Sounds failed: No scripts, models or maps "
+                    "reference any sound, so every sound would be removed."
+                )
+            return False
+
+        total = len(sound_files)
+        for processed, (path, key) in enumerate(sound_files.items(), 1):
+            if key not in used:
+                if remove:
+                    path.unlink()
+                    report_logger("remove_unaccessed_sounds", path, removed=True)
+                else:
+                    # unused files are left out of the output rather than removed
+                    report_logger("remove_unaccessed_sounds", path, copied=False)
+            elif not remove:
+                target_path = output_dir / path.relative_to(input_dir)
+                target_path.parent.mkdir(parents=True, exist_ok=True)
+                fop_copy(src=path, dst=target_path, mode=2)
+
+            if progress_window and (processed % 10 == 0 or processed == total):
+                progress_window.update(processed, total)
+
+        return True
+    except Exception as e:
+        exception_logger(e)
+        if progress_window:
+            progress_window.error(
+                "Remove Unaccessed Sounds failed with an unknown error."
+            )
+        return False
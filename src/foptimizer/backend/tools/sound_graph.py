@@ -0,0 +1,281 @@
+import os
+import re
+import struct
+from pathlib import Path
+
+from .asset_references import MDL_SIGNATURE, parse_bsp_references
+from .keyvalues import tokenize_keyvalues
+from .parse_cache import parse_incrementally
+
+
+SOUND_GRAPH_PATH = Path("sound_graph.json")
+SOUND_GRAPH_VERSION = 2
+# models and maps take far longer to parse than a VMT
+PARSE_CHUNK_SIZE = 16
+
+SOUND_SUFFIXES = (".wav", ".mp3", ".ogg")
+# leading characters of a sound path which set playback flags, e.g. ")" or "^"
+SOUND_CHARS = "*?!#><^@)(}$~&+"
+
+# the first string literal passed to a sound playing call, or CreateSound's second
+LUA_SOUND_CALL_REGEX = re.compile(
+    r"""
+    \b(?:Sound|EmitSound|PlaySound|PrecacheSound)\s*\(\s*
+    | \bCreateSound\s*\([^,()]*,\s*
+    """,
+    re.VERBOSE,
+)
+LUA_STRING_REGEX = re.compile(r""""((?:[^"\\\n]|\\.)*)"|'((?:[^'\\\n]|\\.)*)'""")
+
+# studiohdr_t: numlocalseq, localseqindex
+MDL_SEQUENCES = struct.Struct("<2i")
+MDL_SEQUENCES_OFFSET = 188
+MDL_SEQUENCE_SIZE = 212
+# mstudioseqdesc_t: numevents, eventindex
+MDL_SEQUENCE_EVENTS = struct.Struct("<2i")
+MDL_SEQUENCE_EVENTS_OFFSET = 24
+MDL_EVENT_SIZE = 80
+MDL_EVENT_OPTIONS_OFFSET = 12
+MDL_EVENT_OPTIONS_SIZE = 64
+
+
+def split_sound_reference(value: str) -> tuple[str, str]:
+    """
+    Splits a sound reference into its leading playback flag characters and any sound/
+    prefix, and the lowercase path relative to sound/ or soundscript name it names.
+
+    :param value: The reference, e.g. a soundscript wave or a Lua string.
+    :type value: str
+    :return: A (prefix, key) tuple.
+    :rtype: tuple
+    """
+
+    path = value.strip().replace("\\\\", "/").replace("\\", "/")
+    stripped = path.lstrip(SOUND_CHARS)
+    prefix = path[: len(path) - len(stripped)]
+    if stripped.lower().startswith("sound/"):
+        prefix += stripped[:6]
+        stripped = stripped[6:]
+    return prefix, stripped.lower()
+
+
+def parse_soundscripts(text: str) -> tuple[dict, list]:
+    """
+    Parses the entries of a soundscript, soundscape or other KeyValues script.
+
+    :param text: The contents of the script.
+    :type text: str
+    :return: A (soundscripts, references) tuple, where soundscripts maps each lowercase
+        top-level entry name to the waves inside it, and references lists every other
+        value, e.g. the soundscript names a weapon script plays.
+    :rtype: tuple
+    """
+
+    soundscripts = {}
+    references = []
+
+    depth = 0
+    name = None
+    key = None
+    for kind, value, _, _ in tokenize_keyvalues(text):
+        if kind == "conditional":
+            continue
+
+        if kind == "{":
+            if depth == 0 and key is not None:
+                name = key.lower()
+                soundscripts.setdefault(name, [])
+            depth += 1
+            key = None
+        elif kind == "}":
+            depth = max(0, depth - 1)
+            key = None
+        elif key is None:
+            key = value
+        else:
+            if depth and key.lower() == "wave":
+                soundscripts[name].append(split_sound_reference(value)[1])
+            else:
+                references.append(value)
+            key = None
+
+    # entries without waves, e.g. weapon scripts, only reference other sounds
+    return {name: waves for name, waves in soundscripts.items() if waves}, references
+
+
+def parse_lua_sounds(text: str) -> list[str]:
+    """
+    Finds the string literals passed to Sound, EmitSound, surface.PlaySound,
+    util.PrecacheSound and CreateSound calls in Lua code.
+
+    :param text: The Lua code to search.
+    :type text: str
+    :return: A list of the literals' contents.
+    :rtype: list
+    """
+
+    references = []
+    for call in LUA_SOUND_CALL_REGEX.finditer(text):
+        literal = LUA_STRING_REGEX.match(text, call.end())
+        if literal:
+            references.append(
+                literal.group(1) if literal.group(1) is not None else literal.group(2)
+            )
+    return references
+
+
+def parse_mdl_sounds(data: bytes) -> list[str]:
+    """
+    Collects the options of every animation event of a model's sequences, which name
+    the sound played by sound events such as AE_CL_PLAYSOUND.
+
+    :param data: The contents of the MDL file.
+    :type data: bytes
+    :return: A list of the non-empty event options.
+    :rtype: list
+    """
+
+    if data[:4] != MDL_SIGNATURE:
+        return []
+
+    references = []
+    num_sequences, sequence_index = MDL_SEQUENCES.unpack_from(data, MDL_SEQUENCES_OFFSET)
+    for i in range(num_sequences):
+        sequence_offset = sequence_index + i * MDL_SEQUENCE_SIZE
+        num_events, event_index = MDL_SEQUENCE_EVENTS.unpack_from(
+            data, sequence_offset + MDL_SEQUENCE_EVENTS_OFFSET
+        )
+        for j in range(num_events):
+            options_offset = (
+                sequence_offset + event_index + j * MDL_EVENT_SIZE + MDL_EVENT_OPTIONS_OFFSET
+            )
+            options = data[options_offset : options_offset + MDL_EVENT_OPTIONS_SIZE]
+            options = options.split(b"\0", 1)[0].decode("latin-1").strip()
+            if options:
+                references.append(options)
+
+    return references
+
+
+def is_script(path: Path, input_dir: Path) -> bool:
+    """
+    Checks whether a file is a KeyValues script that may play sounds, i.e. a .txt
+    under a scripts folder, such as a soundscript, soundscape or weapon script.
+
+    :param path: The path of the file.
+    :type path: Path
+    :param input_dir: The directory the file was found in.
+    :type input_dir: Path
+    :return: Whether the file is such a script.
+    :rtype: bool
+    """
+
+    parts = [part.lower() for part in path.relative_to(input_dir).parts[:-1]]
+    return path.suffix.lower() == ".txt" and "scripts" in parts
+
+
+def _parse_sounds_worker(path: Path):
+    try:
+        suffix = path.suffix.lower()
+        entry = {"soundscripts": {}, "references": []}
+        if suffix == ".lua":
+            text = path.read_text(encoding="latin-1")
+            entry["references"] = parse_lua_sounds(text)
+        elif suffix == ".txt":
+            text = path.read_text(encoding="latin-1")
+            entry["soundscripts"], entry["references"] = parse_soundscripts(text)
+        elif suffix == ".mdl":
+            entry["references"] = parse_mdl_sounds(path.read_bytes())
+        elif suffix == ".bsp":
+            # e.g. ambient_generic's message, or env_soundscape's soundscape
+            entry["references"] = [
+                value for _, value in parse_bsp_references(path)["entities"]
+            ]
+        return entry
+    except Exception as e:
+        return e
+
+
+def _scan_sound_sources(input_dir: Path) -> list[tuple[Path, os.stat_result]]:
+    found = []
+    stack = [input_dir]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    stack.append(entry.path)
+                    continue
+                if not entry.is_file():
+                    continue
+
+                path = Path(entry.path)
+                suffix = path.suffix.lower()
+                if suffix in (".lua", ".mdl", ".bsp") or (
+                    suffix == ".txt" and is_script(path, input_dir)
+                ):
+                    found.append((path, entry.stat()))
+    return found
+
+
+class SoundGraph:
+    """
+    An index of every sound reference in a directory tree: the waves of each
+    soundscript and soundscape, and the sounds or soundscripts played by Lua, scripts,
+    models and maps.
+    """
+
+    def __init__(self, sources: dict):
+        self.sources = sources
+
+        self.soundscripts = {}
+        self.references = set()
+        for entry in sources.values():
+            for name, waves in entry["soundscripts"].items():
+                self.soundscripts.setdefault(name, []).extend(waves)
+            for reference in entry["references"]:
+                self.references.add(split_sound_reference(reference)[1])
+
+    @classmethod
+    def build(
+        cls, input_dir: Path, cache_path: Path = SOUND_GRAPH_PATH
+    ) -> "SoundGraph":
+        """
+        Builds the graph of every Lua, script, model and map under a directory, only
+        re-parsing files whose size or modification time changed since the graph was
+        last persisted to cache_path.
+
+        :param input_dir: The directory to index the sound references of.
+        :type input_dir: Path
+        :param cache_path: The path of the persisted graph.
+        :type cache_path: Path
+        :return: The sound graph.
+        :rtype: SoundGraph
+        """
+
+        sources = parse_incrementally(
+            input_dir=input_dir,
+            cache_path=cache_path,
+            version=SOUND_GRAPH_VERSION,
+            scan=_scan_sound_sources,
+            worker=_parse_sounds_worker,
+            chunksize=PARSE_CHUNK_SIZE,
+        )
+        return cls(sources)
+
+    def reachable(self, roots: set = frozenset()) -> set:
+        """
+        Computes every sound played by the indexed references, directly or through the
+        soundscripts they name.
+
+        :param roots: Additional sound paths or soundscript names known to be used,
+            normalized by split_sound_reference.
+        :type roots: set
+        :return: The set of used sound paths relative to sound/, in lowercase.
+        :rtype: set
+        """
+
+        used = set()
+        for key in self.references | set(roots):
+            used.add(key)
+            used.update(self.soundscripts.get(key, ()))
+        return used
@@ -0,0 +1,291 @@
+import json
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+
+from sourcepp import vpkpp
+
+from .misc import exception_logger
+
+
+VPK_INDEX_PATH = Path("vpk_index.bin")
+VPK_INDEX_MAGIC = b"FOPVPKI2"
+# sources, strings, components, nodes, edges, paths, contents
+VPK_INDEX_HEADER = struct.Struct("<7I")
+
+
+def _align(size: int) -> int:
+    return (size + 3) & ~3
+
+
+def _vpk_sources(vpk_paths: list[Path]) -> list[list]:
+    sources = []
+    for vpk_path in sorted(vpk_paths):
+        stat = vpk_path.stat()
+        sources.append([os.path.abspath(vpk_path), stat.st_mtime_ns, stat.st_size])
+    return sources
+
+
+def _build_index(vpk_paths: list[Path], sources: list, index_path: Path) -> None:
+    # every (crc32, length) a path has across the VPKs, as games may pack the same
+    # path with different content
+    entries = {}
+    for vpk_path in vpk_paths:
+        vpkpp.VPK.open(
+            str(vpk_path),
+            lambda path, entry: entries.setdefault(
+                path.lower().replace("\\", "/"), set()
+            ).add((entry.crc32, entry.length)),
+        )
+
+    # a trie of every entry's path components, last component first
+    children = [{}]
+    contents = [()]
+    for entry, entry_contents in entries.items():
+        node = 0
+        for component in reversed(entry.split("/")):
+            child = children[node].get(component)
+            if child is None:
+                child = len(children)
+                children[node][component] = child
+                children.append({})
+                contents.append(())
+            node = child
+        contents[node] = tuple(sorted(entry_contents))
+
+    components = sorted({component for node in children for component in node})
+    component_ids = {component: i for i, component in enumerate(components)}
+
+    # renumber the nodes breadth first, so each node's edges are contiguous and
+    # sorted by component id
+    order = [0]
+    new_ids = {0: 0}
+    for node in order:
+        for component in sorted(children[node], key=component_ids.__getitem__):
+            new_ids[children[node][component]] = len(order)
+            order.append(children[node][component])
+
+    edge_starts = []
+    edge_counts = []
+    edge_components = []
+    edge_children = []
+    content_starts = []
+    content_counts = []
+    content_crcs = []
+    content_lengths = []
+    for node in order:
+        edge_starts.append(len(edge_components))
+        edge_counts.append(len(children[node]))
+        for component in sorted(children[node], key=component_ids.__getitem__):
+            edge_components.append(component_ids[component])
+            edge_children.append(new_ids[children[node][component]])
+
+        content_starts.append(len(content_crcs))
+        content_counts.append(len(contents[node]))
+        for crc, length in contents[node]:
+            content_crcs.append(crc)
+            content_lengths.append(length)
+
+    sources_blob = json.dumps(sources).encode("utf-8")
+    strings_blob = "\0".join(components).encode("utf-8")
+
+    temp_path = index_path.with_name(index_path.name + ".tmp")
+    with open(temp_path, "wb") as index_file:
+        index_file.write(VPK_INDEX_MAGIC)
+        index_file.write(
+            VPK_INDEX_HEADER.pack(
+                len(sources_blob),
+                len(strings_blob),
+                len(components),
+                len(order),
+                len(edge_components),
+                len(entries),
+                len(content_crcs),
+            )
+        )
+        for blob in (sources_blob, strings_blob):
+            index_file.write(blob.ljust(_align(len(blob)), b"\0"))
+        for values in (
+            edge_starts,
+            edge_counts,
+            edge_components,
+            edge_children,
+            content_starts,
+            content_counts,
+            content_crcs,
+            content_lengths,
+        ):
+            index_file.write(array("I", values).tobytes())
+    os.replace(temp_path, index_path)
+
+
+class VPKIndex:
+    """
+    A memory-mapped, persisted index of every file path inside a set of VPKs and the
+    CRC32 and length of its content, stored as a trie of path components from the file
+    name upwards so that checking whether any suffix of a path is packed walks each
+    component once.
+    """
+
+    def __init__(self, index_path: Path):
+        self.index_file = open(index_path, "rb")
+        self.data = mmap.mmap(self.index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            self._map()
+        except Exception:
+            self.close()
+            raise
+
+    def _map(self) -> None:
+        if self.data[: len(VPK_INDEX_MAGIC)] != VPK_INDEX_MAGIC:
+            raise ValueError(f"{self.index_file.name} is not a VPK index.")
+
+        offset = len(VPK_INDEX_MAGIC)
+        (
+            sources_size,
+            strings_size,
+            component_count,
+            node_count,
+            edge_count,
+            self.path_count,
+            content_count,
+        ) = VPK_INDEX_HEADER.unpack_from(self.data, offset)
+        offset += VPK_INDEX_HEADER.size
+
+        self.sources = json.loads(self.data[offset : offset + sources_size])
+        offset += _align(sources_size)
+
+        strings = self.data[offset : offset + strings_size].decode("utf-8")
+        self.component_ids = (
+            {component: i for i, component in enumerate(strings.split("\0"))}
+            if component_count
+            else {}
+        )
+        offset += _align(strings_size)
+
+        self.views = [memoryview(self.data)]
+        for name, count in (
+            ("edge_starts", node_count),
+            ("edge_counts", node_count),
+            ("edge_components", edge_count),
+            ("edge_children", edge_count),
+            ("content_starts", node_count),
+            ("content_counts", node_count),
+            ("content_crcs", content_count),
+            ("content_lengths", content_count),
+        ):
+            values = self.views[0][offset : offset + count * 4].cast("I")
+            offset += count * 4
+            self.views.append(values)
+            setattr(self, name, values)
+
+    @classmethod
+    def load(
+        cls, vpk_paths: list[Path], index_path: Path = VPK_INDEX_PATH
+    ) -> "VPKIndex":
+        """
+        Opens the persisted index of a set of VPKs, rebuilding it first if any VPK was
+        added, removed or modified since it was built.
+
+        :param vpk_paths: The paths of the *_dir.vpk files to index.
+        :type vpk_paths: list[Path]
+        :param index_path: The path of the persisted index.
+        :type index_path: Path
+        :return: The index.
+        :rtype: VPKIndex
+        """
+
+        sources = _vpk_sources(vpk_paths)
+
+        # indexes of an older layout are rebuilt without complaint
+        current = False
+        if index_path.is_file():
+            with open(index_path, "rb") as index_file:
+                current = index_file.read(len(VPK_INDEX_MAGIC)) == VPK_INDEX_MAGIC
+
+        if current:
+            try:
+                index = cls(index_path)
+                if index.sources == sources:
+                    return index
+                index.close()
+            except Exception as e:
+                exception_logger(e)
+
+        _build_index(vpk_paths, sources, index_path)
+        return cls(index_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.path_count
+
+    def _child(self, node: int, component: str) -> int | None:
+        component_id = self.component_ids.get(component)
+        if component_id is None:
+            return None
+
+        start = self.edge_starts[node]
+        end = start + self.edge_counts[node]
+        i = bisect_left(self.edge_components, component_id, start, end)
+        if i < end and self.edge_components[i] == component_id:
+            return self.edge_children[i]
+        return None
+
+    def contains_suffix(self, parts: tuple[str]) -> bool:
+        """
+        Checks whether any trailing run of path components is a file inside the VPKs,
+        e.g. whether addons/x/materials/a.vtf ends with the packed materials/a.vtf.
+
+        :param parts: The lowercase components of the path.
+        :type parts: tuple[str]
+        :return: Whether a suffix of the path is packed.
+        :rtype: bool
+        """
+
+        node = 0
+        for component in reversed(parts):
+            node = self._child(node, component)
+            if node is None:
+                return False
+            if self.content_counts[node]:
+                return True
+        return False
+
+    def contents(self, parts: tuple[str]) -> set[tuple[int, int]]:
+        """
+        Collects the content of every packed file a trailing run of path components
+        matches.
+
+        :param parts: The lowercase components of the path.
+        :type parts: tuple[str]
+        :return: A set of (crc32, length) tuples.
+        :rtype: set
+        """
+
+        found = set()
+        node = 0
+        for component in reversed(parts):
+            node = self._child(node, component)
+            if node is None:
+                break
+
+            start = self.content_starts[node]
+            for i in range(start, start + self.content_counts[node]):
+                found.add((self.content_crcs[i], self.content_lengths[i]))
+        return found
+
+    def close(self) -> None:
+        # views into the map must be released before it can be closed
+        for view in reversed(getattr(self, "views", [])):
+            view.release()
+        self.data.close()
+        self.index_file.close()
@@ -32,7 +32,9 @@ OPTIMIZATIONS = {
     "Remove Base Game Content": {
         "description": (
             "Removes all content from the input folder which are already included in the "
-            "selected game's base content. (VPK's)"
+            "selected games' base content. (VPK's)\nSelect as many game folders to "
+            "mount as needed, then cancel. Files whose content differs from the packed "
+            "file are kept as overrides."
         ),
         "lossless_option": None,
         "level_range": None,
@@ -51,17 +53,58 @@ OPTIMIZATIONS = {
         "one_click": True,
         "function": backend.logic_remove_duplicate_vtfs,
     },
+    "Remove Pixel-Duplicate VTFs": {
+        "description": (
+            "Like Remove Duplicate VTFs, but also catches VTFs which decode to the same "
+            "pixels despite differing headers, versions or thumbnails.\nAbove level 0, "
+            "near-identical re-saves within that many bits of perceptual difference "
+            "are merged too (lossy)."
+        ),
+        "lossless_option": None,
+        "level_range": (0, 16, 0),
+        "remove_option": None,
+        "one_click": False,
+        "function": backend.logic_remove_pixel_duplicate_vtfs,
+    },
+    "Remove Duplicate Sounds": {
+        "description": (
+            "Collects all duplicate sounds into a shared directory and redirects "
+            "soundscripts and Lua to that single sound.\nWAVs only differing in "
+            "metadata count as duplicates. Sounds referenced in ways that cannot be "
+            "rewritten are kept and listed in report.log."
+        ),
+        "lossless_option": None,
+        "level_range": None,
+        "remove_option": None,
+        "one_click": True,
+        "function": backend.logic_remove_duplicate_sounds,
+    },
     "Fit Alpha": {
         "description": (
             "Strip unnecessary channels from VTF images, 'fitting' their formats "
-            "as exactly as possible."
+            "as exactly as possible.\nWith Lossless disabled, uncompressed VTFs are "
+            "also trial-encoded to DXT and kept only if their similarity (SSIM %) "
+            "reaches the selected level and their PSNR is at least 40 dB. Decisions "
+            "are written to report.log."
         ),
         "lossless_option": True,
-        "level_range": None,
+        "level_range": (80, 100, 98),
         "remove_option": None,
         "one_click": True,
         "function": backend.logic_fit_alpha,
     },
+    "Strip Unread Alpha": {
+        "description": (
+            "Strips the alpha channel from VTF images whose VMTs never read it "
+            "(no $translucent, $alphatest, $selfillum, alpha masks etc.), encoding "
+            "them as DXT1 or BGR888.\nDecisions are written to report.log."
+        ),
+        "lossless_option": None,
+        "level_range": None,
+        "remove_option": None,
+        "one_click": False,
+        "function": backend.logic_fit_material_alpha,
+    },
     "Remove Redundant Files": {
         "description": "Removes files unused by both modern engine branches and modding tools.",
         "lossless_option": None,
@@ -83,8 +126,9 @@ OPTIMIZATIONS = {
     },
     "Remove Unaccessed VTFs": {
         "description": (
-            "Removes all VTF files not referenced by any VMT in the input folder."
-            "\nWARNING: this will remove VTF images referenced only in code!"
+            "Removes all VTF files not referenced by any VMT, Lua, text or resource "
+            "file in the input folder.\nWARNING: this will remove VTF images whose "
+            "paths are built at runtime in code!"
         ),
         "lossless_option": None,
         "level_range": None,
@@ -92,6 +136,34 @@ OPTIMIZATIONS = {
         "one_click": True,
         "function": backend.logic_remove_unaccessed_vtfs,
     },
+    "Remove Unaccessed Materials": {
+        "description": (
+            "Removes all VMT and VTF files not used by any model or map in the input "
+            "folder, following materials through to the textures they reference. "
+            "Materials named in Lua, text or resource files are kept."
+            "\nWARNING: this will remove materials referenced only by particles or "
+            "by paths built at runtime in code!"
+        ),
+        "lossless_option": None,
+        "level_range": None,
+        "remove_option": True,
+        "one_click": False,
+        "function": backend.logic_remove_unaccessed_materials,
+    },
+    "Remove Unaccessed Sounds": {
+        "description": (
+            "Removes all sound files not played by any soundscript, soundscape, Lua "
+            "sound call, map entity or model animation event in the input folder. "
+            "Sounds named in Lua or resource files are kept."
+            "\nWARNING: this will remove sounds only played through soundscripts that "
+            "the game itself references, or by paths built at runtime in code!"
+        ),
+        "lossless_option": None,
+        "level_range": None,
+        "remove_option": True,
+        "one_click": False,
+        "function": backend.logic_remove_unaccessed_sounds,
+    },
     "PNG Optimization": {
         "description": "Optimizes PNG images and strips unnecessary metadata.",
         "lossless_option": False,
@@ -105,14 +177,68 @@ OPTIMIZATIONS = {
             "Maps all stereo WAVs' two channels to a single one, trading spatiality loss "
             "to exactly halve their filesizes i.e. sum to mono. This may fix broken "
             "directionality, where sounds are played at the same volume in both ears "
-            "even when the player's head is turned."
+            "even when the player's head is turned.\nLossless only converts WAVs whose "
+            "channels are identical."
         ),
-        "lossless_option": None,
+        "lossless_option": False,
         "level_range": None,
         "remove_option": True,
         "one_click": True,
         "function": backend.logic_wav_stereo_to_mono,
     },
+    "Downsample WAVs": {
+        "description": (
+            "Resamples WAVs to 22.05 kHz or 11.025 kHz when they have no content above "
+            "those rates' frequency limits, halving or quartering their filesizes "
+            "without an audible change.\nThe level is how many decibels below the "
+            "total the removed high-frequency energy must be."
+        ),
+        "lossless_option": None,
+        "level_range": (20, 80, 40),
+        "remove_option": None,
+        "one_click": False,
+        "function": backend.logic_wav_downsample,
+    },
+    "Optimize Map Pakfiles": {
+        "description": (
+            "Losslessly optimizes the VTFs, PNGs and WAVs embedded in maps' pakfiles "
+            "with the same tools used on loose files, and removes embedded files "
+            "identical to the loose file at the same path. Only changed maps are "
+            "written."
+        ),
+        "lossless_option": None,
+        "level_range": None,
+        "remove_option": None,
+        "one_click": True,
+        "function": backend.logic_optimize_bsp_pakfiles,
+    },
+    "Minify Scripts": {
+        "description": (
+            "Strips comments and redundant whitespace from Lua scripts, and from "
+            "KeyValues .txt and .vmt files, which clients download. Bytes saved are "
+            "written to report.log.\nLossless keeps every line of Lua where it was, so "
+            "errors still report the right line numbers."
+        ),
+        "lossless_option": True,
+        "level_range": None,
+        "remove_option": None,
+        "one_click": True,
+        "function": backend.logic_minify_scripts,
+    },
+    "Build FastDL": {
+        "description": (
+            "Compresses every downloadable file to a bzip2 mirror in the output folder "
+            "for FastDL, skipping files unchanged since the last run, and writes "
+            "fastdl_resources.lua: a resource.AddFile list of only the referenced "
+            "models, materials, sounds and resources.\nRun it after the other "
+            "optimizations."
+        ),
+        "lossless_option": None,
+        "level_range": None,
+        "remove_option": None,
+        "one_click": False,
+        "function": backend.logic_build_fastdl,
+    },
     "Halve Normals": {
         "description": (
             "Halves the dimensions of all normal map VTF images. "
@@ -537,7 +663,10 @@ class App(ctk.CTk):
             self.root_scrollable,
             label="Select Input Folder",
             placeholder_text="",
-            tip_text="File path to input folder",
+            tip_text=(
+                "File path to input folder\nA .gma or .vpk path can be entered to "
+                "read from the archive directly; only changed files are written out."
+            ),
             on_empty_text="Please select an existing input folder",
         )
         self.input_frame.grid(row=1, column=0, padx=0, pady=(3, 0), sticky="nsew")
@@ -549,7 +678,8 @@ class App(ctk.CTk):
             tip_text=(
                 "File path to output folder\nLeave this "
                 "field blank to apply changes directly"
-                "to the input folder."
+                "to the input folder.\nA .vpk or .gma path packs the "
+                "output into that archive instead."
             ),
             on_empty_text="",
         )
@@ -0,0 +1,36 @@
+import os
+import sys
+
+from foptimizer.backend.tools.hash_cache import HashCache
+
+
+def _stat(path, inode):
+    # a stat result of path whose inode is replaced, e.g. by DirEntry.stat() on Windows
+    stat = os.stat(path)
+    fields = list(stat)
+    fields[1] = inode
+    return os.stat_result(fields, {"st_mtime_ns": stat.st_mtime_ns})
+
+
+def test_inode_ignored_on_windows(tmp_path, monkeypatch):
+    path = tmp_path / "file.bin"
+    path.write_bytes(b"data")
+    monkeypatch.setattr(sys, "platform", "win32")
+
+    with HashCache(tmp_path / "cache.sqlite3") as cache:
+        cache.put(path, "full", path.stat(), "digest")
+        assert cache.get(path, "full", _stat(path, 0)) == "digest"
+
+        cache.put(path, "partial", _stat(path, 0), "digest")
+        assert cache.get(path, "partial", path.stat()) == "digest"
+
+
+def test_inode_compared_elsewhere(tmp_path, monkeypatch):
+    path = tmp_path / "file.bin"
+    path.write_bytes(b"data")
+    monkeypatch.setattr(sys, "platform", "linux")
+
+    with HashCache(tmp_path / "cache.sqlite3") as cache:
+        cache.put(path, "full", path.stat(), "digest")
+        assert cache.get(path, "full", path.stat()) == "digest"
+        assert cache.get(path, "full", _stat(path, path.stat().st_ino + 1)) is None
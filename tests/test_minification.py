@@ -0,0 +1,126 @@
+import pytest
+
+from foptimizer.backend.tools.keyvalues import tokenize_keyvalues
+from foptimizer.backend.tools.minification import (
+    LUA_COMMENTS,
+    minify_glua,
+    minify_keyvalues,
+    tokenize_glua,
+)
+
+
+KEYVALUES_SAMPLES = [
+    """"VertexLitGeneric"
+{
+	// comment
+	"$basetexture" "models/foo"   // trailing
+	$bumpmap models/bar
+	"Proxies" { Sine { resultVar "$color[0]" sineperiod 2 } }
+	"$x" "1" [$X360]
+}
+""",
+    """#base "npc_base.txt"
+"Weapon.Fire"
+{
+	"channel"	"CHAN_WEAPON"
+	"rndwave"
+	{
+		"wave"	")weapons/fire1.wav"
+		"wave"	")weapons/fire2.wav"
+	}
+}
+""",
+    """"UnlitGeneric"
+{
+	Proxies
+	{
+		Equals
+		{
+			srcVar1 $color[0]
+			resultVar $color2[1]
+		}
+	}
+}
+""",
+    """patch
+{
+	include "materials/brick/wall.vmt"
+	replace { "$envmap" "env_cubemap" }
+}
+""",
+]
+
+GLUA_SAMPLE = r"""-- header comment
+local a = 1 -- trailing
+/* block
+ comment */
+local b = a - -a  // glua comment
+if a != b && !false || b ~= 2 then
+  for i = 1, 10 do if i == 5 then continue end end
+end
+local s = "str -- not comment" .. 'x\'y' .. [[long
+-- still string]] .. [==[ ]] ]==]
+local t = {} t[ [[k]] ] = 1.5 .. 1 .. 0x1E -1
+--[[ long
+comment ]] print(a)
+return a.b:c(1e5, 3e-2)
+"""
+
+
+def _keyvalues_values(text: str) -> list[tuple[str, str]]:
+    return [(kind, value) for kind, value, _, _ in tokenize_keyvalues(text)]
+
+
+def _glua_tokens(text: str) -> list[tuple[str, str]]:
+    return [
+        token
+        for token in tokenize_glua(text)
+        if token[0] not in ("newline", "space") and token[0] not in LUA_COMMENTS
+    ]
+
+
+@pytest.mark.parametrize("text", KEYVALUES_SAMPLES)
+def test_keyvalues_round_trip(text):
+    minified = minify_keyvalues(text)
+
+    assert minified is not None
+    assert len(minified) < len(text)
+    assert _keyvalues_values(minified) == _keyvalues_values(text)
+
+
+def test_keyvalues_keeps_unquoted_indexes():
+    text = "VertexLitGeneric\n{\n\tProxies { Sine { resultVar $color[0] } }\n}\n"
+    minified = minify_keyvalues(text)
+
+    assert "$color[0]" in minified
+    assert ("string", "$color[0]") in _keyvalues_values(minified)
+    assert all(kind != "conditional" for kind, _ in _keyvalues_values(minified))
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "Credits:\n Models by Bob (see http://bob.example/models)\n Config: { size 4 }",
+        '"lang" { "Tokens" { "hello" "Hello \\"world\\"" } }',
+        "just a readme",
+        '"unbalanced" { "a" "b"',
+    ],
+)
+def test_keyvalues_rejects_other_text(text):
+    assert minify_keyvalues(text) is None
+
+
+@pytest.mark.parametrize("keep_lines", [False, True])
+def test_glua_round_trip(keep_lines):
+    minified = minify_glua(GLUA_SAMPLE, keep_lines=keep_lines)
+
+    assert len(minified) < len(GLUA_SAMPLE)
+    assert _glua_tokens(minified) == _glua_tokens(GLUA_SAMPLE)
+
+
+def test_glua_keeps_lines():
+    minified = minify_glua(GLUA_SAMPLE, keep_lines=True).splitlines()
+
+    for i, line in enumerate(GLUA_SAMPLE.splitlines()):
+        if line.startswith(("local b", "if a", "return")):
+            assert minified[i].startswith(line.split(" ")[0])
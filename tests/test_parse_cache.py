@@ -0,0 +1,66 @@
+import json
+import os
+from pathlib import Path
+
+from foptimizer.backend.tools.parse_cache import parse_incrementally
+
+
+def _scan(input_dir):
+    return [(path, path.stat()) for path in sorted(input_dir.glob("*.txt"))]
+
+
+def _parse(parsed, cache_path, input_dir, version=1):
+    def worker(path):
+        parsed.append(path.name)
+        return {"text": path.read_text()}
+
+    return parse_incrementally(
+        input_dir=input_dir,
+        cache_path=cache_path,
+        version=version,
+        scan=_scan,
+        worker=worker,
+    )
+
+
+def test_only_changed_files_are_parsed(tmp_path):
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    (input_dir / "a.txt").write_text("a")
+    (input_dir / "b.txt").write_text("b")
+    cache_path = tmp_path / "cache.json"
+
+    parsed = []
+    entries = _parse(parsed, cache_path, input_dir)
+    assert sorted(parsed) == ["a.txt", "b.txt"]
+    assert entries[input_dir / "a.txt"]["text"] == "a"
+
+    parsed.clear()
+    (input_dir / "b.txt").write_text("bb")
+    (input_dir / "a.txt").unlink()
+    entries = _parse(parsed, cache_path, input_dir)
+    assert parsed == ["b.txt"]
+    assert list(entries) == [input_dir / "b.txt"]
+    assert entries[input_dir / "b.txt"]["text"] == "bb"
+
+    cached = json.loads(cache_path.read_text())["entries"]
+    assert list(cached) == [os.path.abspath(input_dir / "b.txt")]
+
+
+def test_other_folders_and_versions(tmp_path):
+    first, second = tmp_path / "first", tmp_path / "second"
+    for folder in (first, second):
+        folder.mkdir()
+        (folder / "a.txt").write_text(folder.name)
+    cache_path = tmp_path / "cache.json"
+
+    parsed = []
+    _parse(parsed, cache_path, first)
+    _parse(parsed, cache_path, second)
+    parsed.clear()
+
+    # a cache serves several folders, and is discarded when the format changes
+    _parse(parsed, cache_path, first)
+    assert parsed == []
+    _parse(parsed, cache_path, Path(second), version=2)
+    assert parsed == ["a.txt"]
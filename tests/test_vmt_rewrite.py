@@ -0,0 +1,106 @@
+import re
+
+import pytest
+
+from foptimizer.backend.tools.deduplication import (
+    VMT_REGEX,
+    _init_rewrite_vmt_worker,
+    _rewrite_vmt_worker,
+)
+
+
+DUPLICATES = {
+    "models/props/crate": "0123abcd",
+    "brick/wall_normal": "4567ef01",
+    "effects/glow": "89ab2345",
+}
+
+VMT_SAMPLES = [
+    # comments, backslashes and mixed case
+    """"VertexLitGeneric"
+{
+	// a crate
+	"$basetexture" "models\\props\\crate"   // diffuse
+	"$BumpMap" "Brick/Wall_Normal"
+	"$surfaceprop" "wood"
+}
+""",
+    # proxies, with unquoted keys
+    """"UnlitGeneric"
+{
+	$basetexture "effects/glow"
+	"$detail" "models/props/unused"
+	"Proxies"
+	{
+		"AnimatedTexture"
+		{
+			"animatedTextureVar" "$basetexture"
+			"animatedTextureFrameNumVar" "$frame"
+		}
+	}
+}
+""",
+    # patch blocks
+    """"patch"
+{
+	"include" "materials/brick/wall.vmt"
+	"insert"
+	{
+		"$bumpmap" "brick/wall_normal"
+	}
+	"replace"
+	{
+		"$basetexture" "models/props/crate"
+	}
+}
+""",
+    # unquoted and padded values, which were never rewritten
+    """"LightmappedGeneric"
+{
+	$basetexture models/props/crate
+	"$bumpmap" " brick/wall_normal "
+}
+""",
+    # nothing to rewrite
+    """"LightmappedGeneric"
+{
+	"$basetexture" "brick/wall"
+}
+""",
+]
+
+
+def _old_rewrite(original: str, duplicates: dict) -> str:
+    # the regex loop _rewrite_vmt_worker replaced
+    content = original.replace("\\", "/")
+    for _, vtf_path in VMT_REGEX.findall(content):
+        clean_vtf = vtf_path.strip().lower()
+        if clean_vtf in duplicates:
+            new_vtf = f"foptimizer_shared_duplicates/{duplicates[clean_vtf]}"
+            pattern = re.compile(f'"{re.escape(clean_vtf)}"', re.IGNORECASE)
+            content = pattern.sub(
+                f'"{new_vtf}" // Original: {clean_vtf}', content, count=1
+            )
+    return content
+
+
+@pytest.mark.parametrize("vmt", VMT_SAMPLES)
+def test_rewrite_matches_regex_loop(tmp_path, vmt):
+    vmt_path = tmp_path / "test.vmt"
+    vmt_path.write_text(vmt, encoding="latin-1")
+
+    _init_rewrite_vmt_worker(DUPLICATES)
+    assert _rewrite_vmt_worker(vmt_path) is True
+
+    assert vmt_path.read_text(encoding="latin-1") == _old_rewrite(vmt, DUPLICATES)
+
+
+def test_rewrite_skips_commented_parameters(tmp_path):
+    vmt = '"VertexLitGeneric"\n{\n\t// "$basetexture" "models/props/crate"\n}\n'
+    vmt_path = tmp_path / "test.vmt"
+    vmt_path.write_text(vmt, encoding="latin-1")
+
+    _init_rewrite_vmt_worker(DUPLICATES)
+    _rewrite_vmt_worker(vmt_path)
+
+    assert vmt_path.read_text(encoding="latin-1") == vmt